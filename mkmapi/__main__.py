@@ -0,0 +1,5 @@
+import sys
+
+from mkmapi.cli import main
+
+sys.exit(main())
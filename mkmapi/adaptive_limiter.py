@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+
+from requests import RequestException
+
+from mkmapi.exceptions import CircuitOpenError, MKMConnectionError
+
+# Status codes that mean the server is overloaded or down, other errors are the client's fault
+OVERLOAD_STATUS_CODES = (429, 500, 502, 503, 504)
+# Responses faster than this never count as slow, small baselines make the latency ratio noisy
+MIN_SLOW_LATENCY = 0.05
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class _EndpointGroup:
+
+    def __init__(self, limit, window):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+
+
+class AdaptiveLimiter:
+    """
+    Adapts the number of requests in flight to the server's health, separately for every endpoint group
+    (the first segment of the resource URL, e.g. /stock or /products).
+
+    The limit of a group follows AIMD: every successful request whose latency stays within `latency_tolerance`
+    times the group's baseline latency adds 1 / limit (about +1 per round trip), an overload (429, 5xx, a
+    connection error or a slow response) multiplies the limit by `backoff`. Only requests started after the last
+    decrease can decrease the limit again, so one storm of failures only counts once.
+
+    A circuit breaker opens after `failure_threshold` overloads in a row or when at least `failure_rate` of the
+    last `window` requests failed. While it is open requests fail immediately with CircuitOpenError; after
+    `open_seconds` a single probe request is let through and closes the circuit again if it succeeds.
+    """
+
+    def __init__(
+            self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32, backoff: float = 0.5,
+            latency_tolerance: float = 2.0, failure_threshold: int = 5, failure_rate: float = 0.5,
+            window: int = 20, open_seconds: float = 30
+    ):
+        """
+        :param initial_limit: Requests in flight per group at the start (default: 4)
+        :param min_limit: Lowest limit (default: 1)
+        :param max_limit: Highest limit (default: 32)
+        :param backoff: Factor applied to the limit on overload (default: 0.5)
+        :param latency_tolerance: Latency above this multiple of the baseline counts as overload (default: 2.0)
+        :param failure_threshold: Overloads in a row that open the circuit (default: 5)
+        :param failure_rate: Share of overloads within the window that opens the circuit (default: 0.5)
+        :param window: Number of recent requests used for the failure rate (default: 20)
+        :param open_seconds: Seconds the circuit stays open before a probe request (default: 30)
+        """
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.window = window
+        self.open_seconds = open_seconds
+        self._groups = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def group_for(resource_url):
+        """
+        :param resource_url: Resource URL of a request, e.g. '/stock/file'
+        :return: Returns the endpoint group, e.g. 'stock'
+        """
+        return resource_url.strip('/').split('/', 1)[0].split('?', 1)[0]
+
+    def acquire(self, group, timeout: float = None):
+        """
+        Waits until the group allows another request in flight.
+
+        :raise CircuitOpenError: If the circuit of the group is open
+        :param group: Endpoint group
+        :param timeout: Maximum seconds to wait (optional)
+        :return: Start time of the request, pass it to release(). None if `timeout` expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            state = self._group(group)
+            while True:
+                now = time.monotonic()
+                if state.state == OPEN:
+                    retry_after = state.opened_at + self.open_seconds - now
+                    if retry_after > 0:
+                        raise CircuitOpenError(group, retry_after)
+                    state.state = HALF_OPEN
+                    state.in_flight += 1
+                    return now
+                if state.state == HALF_OPEN:
+                    if state.in_flight == 0:
+                        state.in_flight += 1
+                        return now
+                elif state.in_flight < int(state.limit):
+                    state.in_flight += 1
+                    return now
+
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def release(self, group, started, overloaded: bool):
+        """
+        Records the outcome of a request and adapts the limit of the group.
+
+        :param group: Endpoint group
+        :param started: Value returned by acquire()
+        :param overloaded: True if the server was overloaded or unreachable
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            state = self._group(group)
+            state.in_flight -= 1
+            if not overloaded:
+                if state.baseline is None or latency < state.baseline:
+                    state.baseline = latency
+                else:
+                    state.baseline += 0.01 * (latency - state.baseline)
+                overloaded = latency > state.baseline * self.latency_tolerance and latency > MIN_SLOW_LATENCY
+                failed = False
+            else:
+                failed = True
+
+            if overloaded:
+                if started >= state.last_decrease:
+                    state.limit = max(self.min_limit, state.limit * self.backoff)
+                    state.last_decrease = now
+            else:
+                state.limit = min(self.max_limit, state.limit + 1 / state.limit)
+
+            state.outcomes.append(failed)
+            state.consecutive_failures = state.consecutive_failures + 1 if failed else 0
+            if state.state == HALF_OPEN:
+                if failed:
+                    self._open(state, now)
+                else:
+                    state.state = CLOSED
+                    state.outcomes.clear()
+            elif state.state == CLOSED and failed and (
+                    state.consecutive_failures >= self.failure_threshold
+                    or (len(state.outcomes) == self.window
+                        and sum(state.outcomes) >= self.failure_rate * self.window)
+            ):
+                self._open(state, now)
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        :return: Dictionary mapping endpoint groups to their limit, in_flight, baseline latency and circuit state
+        """
+        with self._condition:
+            return {
+                group: {
+                    'limit': int(state.limit),
+                    'in_flight': state.in_flight,
+                    'baseline': state.baseline,
+                    'state': state.state,
+                }
+                for group, state in self._groups.items()
+            }
+
+    def wrap(self, resolve):
+        """
+        Wraps a resolve function (see Mkm.resolve) so that every request goes through the limiter.
+        The result can be passed to the API map classes, e.g. StockManagement(limiter.wrap(mkm.resolve)).
+
+        :param resolve: The resolve function to wrap
+        :return: Returns the limited resolve function
+        """
+
+        def limited_resolve(request_method, resource_url, params=None, data=None, **kwargs):
+            group = self.group_for(resource_url)
+            started = self.acquire(group)
+            try:
+                response = resolve(request_method, resource_url, params=params, data=data, **kwargs)
+            except MKMConnectionError as e:
+                self.release(group, started, getattr(e.response, 'status_code', None) in OVERLOAD_STATUS_CODES)
+                raise
+            except RequestException:
+                self.release(group, started, True)
+                raise
+            except BaseException:
+                self.release(group, started, False)
+                raise
+            self.release(group, started, False)
+            return response
+
+        return limited_resolve
+
+    def _group(self, group):
+        if group not in self._groups:
+            self._groups[group] = _EndpointGroup(self.initial_limit, self.window)
+        return self._groups[group]
+
+    @staticmethod
+    def _open(state, now):
+        state.state = OPEN
+        state.opened_at = now
+        state.consecutive_failures = 0
+        state.outcomes.clear()
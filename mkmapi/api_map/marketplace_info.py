@@ -7,15 +7,27 @@ class MarketplaceInfo:
     products we list, articles available at the market, or user registered at MKM.
     """
 
-    def __init__(self, resolve):
+    def __init__(self, resolve, metadata=None):
+        """
+        :param resolve: Resolve function sending the requests
+        :param metadata: MetadataStore answering get_games() and get_expansion() without requests while it holds a
+            bundle, see mkmapi.metadata_bundle (optional)
+        """
         self.resolve = resolve
+        self.metadata = metadata
+
+    def _bundle(self):
+        return self.metadata.current() if self.metadata is not None else None
 
     def get_games(self):
         """
         Returns all games supported by MKM and you can sell and buy products for.
 
-        :return: Response Object - Game
+        :return: Response Object - Game (the decoded body {'game': [...]} if answered by the metadata store)
         """
+        bundle = self._bundle()
+        if bundle is not None:
+            return {'game': bundle.games}
         request_method = 'GET'
         resource_url = '/games'
         return self.resolve(request_method, resource_url)
@@ -25,8 +37,11 @@ class MarketplaceInfo:
         Returns all expansions with single cards for the specified game.
 
         :param game_id: ID of the game, see get_games()
-        :return: Response Object - Expansion
+        :return: Response Object - Expansion (the decoded body {'expansion': [...]} if answered by the metadata store)
         """
+        bundle = self._bundle()
+        if bundle is not None and game_id in bundle.expansions:
+            return {'expansion': bundle.expansions[game_id]}
         request_method = 'GET'
         resource_url = f'/games/{game_id}/expansions'
         return self.resolve(request_method, resource_url)
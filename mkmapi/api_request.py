@@ -1,5 +1,4 @@
 from oauthlib.oauth1.rfc5849 import Client
-from requests import request
 
 from mkmapi.env_variables import (
     get_mkm_app_token,
@@ -11,11 +10,16 @@ from mkmapi.env_variables import (
 from mkmapi.exceptions import MKMConnectionError
 from mkmapi.mkm_oauth1_client import MKMClient
 from mkmapi.mkm_oauth1_serializer import MKMOAuth1
+from mkmapi.profiling import profiler
+from mkmapi.transport import RequestsTransport
 
 
 class ApiRequest:
 
-    def __init__(self, app_token=None, app_secret=None, access_token=None, access_token_secret=None, is_sandbox=False):
+    def __init__(
+            self, app_token=None, app_secret=None, access_token=None, access_token_secret=None, is_sandbox=False,
+            session=None, transport=None, pool_size=None, timeout=None
+    ):
         """
         Initializes the endpoint used for requests.
 
@@ -24,6 +28,11 @@ class ApiRequest:
         :param access_token: Authentication token
         :param access_token_secret: Secret for authentication token
         :param is_sandbox: True to connect to sandbox endpoint, False for production endpoint
+        :param session: requests.Session used to send the requests, e.g. to share a connection pool (optional)
+        :param transport: Transport that sends the requests, see mkmapi.transport (default: RequestsTransport(session))
+        :param pool_size: Number of connections kept open by the default transport (optional)
+        :param timeout: Seconds to wait for the server to connect or send data before the request fails
+            (optional; default: wait forever)
         """
         self.base_endpoint = get_mkm_base_url(is_sandbox)
         self.app_token = app_token if app_token is not None else get_mkm_app_token()
@@ -31,6 +40,9 @@ class ApiRequest:
         self.access_token = access_token if access_token is not None else get_mkm_access_token()
         self.access_token_secret = access_token_secret \
             if access_token_secret is not None else get_mkm_access_token_secret()
+        self.session = session
+        self.transport = transport if transport is not None else RequestsTransport(session, pool_size)
+        self.timeout = timeout
 
     def request(self, url, method, params, **kwargs):
         """
@@ -45,7 +57,10 @@ class ApiRequest:
 
         complete_url = f'{self.base_endpoint}{url}'
         auth = self.create_auth(complete_url)
-        response = request(method=method, url=complete_url, auth=auth, params=params, **kwargs)
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        with profiler.phase('network'):
+            response = self.transport.send(method, complete_url, auth=auth, params=params, **kwargs)
         return self.handle_response(response)
 
     def create_auth(self, url):
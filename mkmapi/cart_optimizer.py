@@ -0,0 +1,274 @@
+import math
+
+from mkmapi.response_parser import flatten_article
+
+
+class CartOptimizer:
+    """
+    Chooses the articles to buy for a list of wanted products so that the total of article prices plus
+    shipping per seller is as low as possible.
+
+    This is an uncapacitated facility location problem: once the set of sellers is fixed, every product
+    is simply filled with the cheapest articles of those sellers. The optimizer searches the seller set:
+        - small inputs (at most `exact_limit` candidate sellers) are solved exactly with branch and bound
+        - larger inputs are solved with an add/drop/swap local search that only re-evaluates the products
+          touched by a move
+    Every assignment reports a lower bound, so the gap to the optimum is known.
+
+    Shipping is modelled as a fixed cost per seller.
+    """
+
+    def __init__(
+            self, wants, offers, shipping_costs=None, default_shipping: float = 1.0,
+            candidates_per_item: int = 20, exact_limit: int = 12
+    ):
+        """
+        Initializes the optimizer.
+
+        :param wants: Dictionary mapping product IDs to the number of copies wanted
+        :param offers: Iterable of Article entities (as returned by get_articles_for_product() or flattened)
+        :param shipping_costs: Dictionary mapping seller IDs (idUser) to the shipping cost or a callable
+            taking the seller ID (optional)
+        :param default_shipping: Shipping cost for sellers missing in `shipping_costs` (default: 1.0)
+        :param candidates_per_item: Only the cheapest offers of this many sellers are considered per product
+            (default: 20)
+        :param exact_limit: Use the exact solver if there are at most this many candidate sellers (default: 12)
+        """
+        self.exact_limit = exact_limit
+        self._shipping_costs = shipping_costs if shipping_costs is not None else {}
+        self.default_shipping = default_shipping
+
+        by_product = {}
+        for offer in offers:
+            offer = flatten_article(offer)
+            if offer['idProduct'] in wants and offer.get('count'):
+                by_product.setdefault(offer['idProduct'], []).append(offer)
+
+        self.need = {}
+        self.offers = {}
+        self.missing = {}
+        self.seller_items = {}
+        for product_id, wanted in wants.items():
+            candidates = _candidates(sorted(by_product.get(product_id, []), key=_price), wanted, candidates_per_item)
+            available = sum(offer['count'] for offer in candidates)
+            self.need[product_id] = min(wanted, available)
+            if available < wanted:
+                self.missing[product_id] = wanted - available
+            if self.need[product_id]:
+                self.offers[product_id] = candidates
+                for offer in candidates:
+                    self.seller_items.setdefault(offer['idUser'], set()).add(product_id)
+
+    def shipping(self, seller_id):
+        """
+        :param seller_id: ID of the seller
+        :return: Shipping cost of the seller
+        """
+        if callable(self._shipping_costs):
+            return self._shipping_costs(seller_id)
+        return self._shipping_costs.get(seller_id, self.default_shipping)
+
+    def optimize(self):
+        """
+        Computes the assignment.
+
+        :return: Returns a CartAssignment
+        """
+        sellers = set(self.seller_items)
+        item_costs = {product_id: self._fill_cost(product_id, sellers) for product_id in self.offers}
+        cheapest_shipping = min((self.shipping(seller) for seller in sellers), default=0)
+        lower_bound = sum(item_costs.values()) + cheapest_shipping
+
+        open_sellers = self._local_search()
+        is_optimal = False
+        if len(sellers) <= self.exact_limit:
+            open_sellers = self._branch_and_bound(open_sellers)
+            is_optimal = True
+
+        assignment = self._assignment(open_sellers)
+        if is_optimal or math.isclose(assignment.total, lower_bound):
+            lower_bound = assignment.total
+            is_optimal = True
+        assignment.lower_bound = lower_bound
+        assignment.is_optimal = is_optimal
+        return assignment
+
+    def _fill_cost(self, product_id, open_sellers):
+        """Cost of the cheapest articles of the open sellers for a product, infinite if there are not enough."""
+        need = self.need[product_id]
+        cost = 0
+        for offer in self.offers[product_id]:
+            if offer['idUser'] in open_sellers:
+                amount = min(need, offer['count'])
+                cost += amount * offer['price']
+                need -= amount
+                if need == 0:
+                    return cost
+        return math.inf
+
+    def _fill(self, product_id, open_sellers):
+        need = self.need[product_id]
+        picks = []
+        for offer in self.offers[product_id]:
+            if need and offer['idUser'] in open_sellers:
+                amount = min(need, offer['count'])
+                picks.append((offer, amount))
+                need -= amount
+        return picks
+
+    def _used_sellers(self, product_id, open_sellers):
+        return {offer['idUser'] for offer, _ in self._fill(product_id, open_sellers)}
+
+    def _local_search(self):
+        """
+        First improvement add/drop/swap search, starting from the sellers of the cheapest solution without
+        shipping. A move only re-evaluates the products supplied by the removed sellers and offered by the
+        added sellers. Swaps are only tried with open sellers whose products the new seller offers as well.
+        """
+        all_sellers = set(self.seller_items)
+        open_sellers = set()
+        for product_id in self.offers:
+            open_sellers |= self._used_sellers(product_id, all_sellers)
+        item_costs = {product_id: self._fill_cost(product_id, open_sellers) for product_id in self.offers}
+        item_sellers = {product_id: self._used_sellers(product_id, open_sellers) for product_id in self.offers}
+        usage = {seller: set() for seller in all_sellers}
+        for product_id, sellers in item_sellers.items():
+            for seller in sellers:
+                usage[seller].add(product_id)
+
+        def try_move(added, removed):
+            nonlocal open_sellers
+            candidate = (open_sellers | added) - removed
+            affected = set()
+            for seller in added:
+                affected |= self.seller_items[seller]
+            for seller in removed:
+                affected |= usage[seller]
+            costs = {product_id: self._fill_cost(product_id, candidate) for product_id in affected}
+            change = sum(costs[product_id] - item_costs[product_id] for product_id in affected)
+            change += sum(self.shipping(seller) for seller in added) - sum(self.shipping(seller) for seller in removed)
+            if not change < -1e-9:
+                return False
+
+            open_sellers = candidate
+            item_costs.update(costs)
+            for product_id in affected:
+                for seller in item_sellers[product_id]:
+                    usage[seller].discard(product_id)
+                item_sellers[product_id] = self._used_sellers(product_id, open_sellers)
+                for seller in item_sellers[product_id]:
+                    usage[seller].add(product_id)
+            return True
+
+        improved = True
+        while improved:
+            improved = False
+            for seller in sorted(open_sellers):
+                if seller in open_sellers:
+                    improved |= try_move(set(), {seller})
+            for seller in sorted(all_sellers - open_sellers):
+                if seller not in open_sellers:
+                    improved |= try_move({seller}, set())
+            if improved:
+                continue
+            for seller in sorted(all_sellers - open_sellers):
+                if seller in open_sellers:
+                    continue
+                for rival in sorted(open_sellers):
+                    if usage[rival] <= self.seller_items[seller] and try_move({seller}, {rival}):
+                        improved = True
+                        break
+        return open_sellers
+
+    def _branch_and_bound(self, incumbent):
+        """Exact search over all seller sets, bounded by filling every product from all undecided sellers."""
+        sellers = sorted(self.seller_items, key=lambda seller: -len(self.seller_items[seller]))
+        best = [self._total(incumbent), incumbent]
+
+        def search(position, included, excluded):
+            available = set(sellers[position:]) | included
+            bound = sum(self.shipping(seller) for seller in included)
+            for product_id in self.offers:
+                bound += self._fill_cost(product_id, available)
+                if bound >= best[0]:
+                    return
+            if position == len(sellers):
+                best[0], best[1] = bound, set(included)
+                return
+            seller = sellers[position]
+            search(position + 1, included | {seller}, excluded)
+            search(position + 1, included, excluded | {seller})
+
+        search(0, set(), set())
+        return best[1]
+
+    def _total(self, open_sellers):
+        used = set()
+        total = 0
+        for product_id in self.offers:
+            total += self._fill_cost(product_id, open_sellers)
+            used |= self._used_sellers(product_id, open_sellers)
+        return total + sum(self.shipping(seller) for seller in used)
+
+    def _assignment(self, open_sellers):
+        articles = []
+        item_cost = 0
+        used = set()
+        for product_id in self.offers:
+            for offer, amount in self._fill(product_id, open_sellers):
+                articles.append({'idArticle': offer['idArticle'], 'amount': amount})
+                item_cost += amount * offer['price']
+                used.add(offer['idUser'])
+        shipping_cost = sum(self.shipping(seller) for seller in used)
+        return CartAssignment(articles, item_cost, shipping_cost, sorted(used), dict(self.missing))
+
+
+class CartAssignment:
+    """Result of the CartOptimizer: the articles to add to the shopping cart and the cost breakdown."""
+
+    def __init__(self, articles, item_cost, shipping_cost, sellers, missing):
+        """
+        :param articles: List of dictionaries with idArticle and amount
+        :param item_cost: Sum of the article prices
+        :param shipping_cost: Sum of the shipping costs of the sellers
+        :param sellers: IDs of the sellers used
+        :param missing: Dictionary mapping product IDs to the number of copies no offer was found for
+        """
+        self.articles = articles
+        self.item_cost = item_cost
+        self.shipping_cost = shipping_cost
+        self.sellers = sellers
+        self.missing = missing
+        self.lower_bound = None
+        self.is_optimal = False
+
+    @property
+    def total(self):
+        return self.item_cost + self.shipping_cost
+
+    def submit(self, shopping_cart_manipulation):
+        """
+        Adds all articles of the assignment to the shopping cart with one request.
+
+        :param shopping_cart_manipulation: ShoppingCartManipulation instance, e.g. mkm.shopping_cart_manipulation
+        :return: Response Object - Shopping Cart
+        """
+        return shopping_cart_manipulation.bulk_edit_shopping_cart('add', self.articles)
+
+
+def _price(offer):
+    return offer['price']
+
+
+def _candidates(offers, wanted, sellers_limit):
+    """Cheapest offers of the first `sellers_limit` sellers, extended until the wanted amount is covered."""
+    candidates = []
+    sellers = set()
+    available = 0
+    for offer in offers:
+        if len(sellers) >= sellers_limit and available >= wanted and offer['idUser'] not in sellers:
+            continue
+        candidates.append(offer)
+        sellers.add(offer['idUser'])
+        available += offer['count']
+    return candidates
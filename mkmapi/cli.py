@@ -0,0 +1,372 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mkmapi.api_map.stock_management import StockManagement
+from mkmapi.crawl_coordinator import KINDS, CrawlQueue, CrawlWorker, merge_results
+from mkmapi.exceptions import MissingEnvVar
+from mkmapi.file_storage import read_json
+from mkmapi.gzip_csv import read_csv_lines
+from mkmapi.market_crawler import MarketCrawler
+from mkmapi.mkm import Mkm
+from mkmapi.rate_limiter import RateLimiter
+from mkmapi.stock_journal import StockJournal, confirm_change
+from mkmapi.stock_snapshot import (
+    StockArticle, iter_stock_file, iterate_stock, snapshot_stock, stock_file_columns,
+)
+
+_UNCONFIRMED_HINT = (
+    'Requests without an answer may or may not have been applied: add --confirm to check changed articles with '
+    'get_stock_article (added articles cannot be checked), --resend-unconfirmed to send them again or '
+    '--discard-pending to drop them.'
+)
+
+
+def main(argv=None):
+    """
+    Entry point of `python -m mkmapi`. The credentials are read from the environment variables, see Mkm.
+
+    :param argv: Command line arguments (default: sys.argv[1:])
+    :return: Returns the exit code
+    """
+    args = build_parser().parse_args(argv)
+    if not args.needs_client:
+        return args.command(None, args)
+    try:
+        mkm = Mkm(
+            sandbox=args.sandbox, pool_size=max(1, getattr(args, 'workers', 1)), timeout=getattr(args, 'timeout', None)
+        )
+    except MissingEnvVar as e:
+        print(e, file=sys.stderr)
+        return 2
+    return args.command(mkm, args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m mkmapi', description='Bulk jobs against the MKM API.')
+    parser.add_argument('--sandbox', action='store_true', help='use the sandbox API')
+    parser.set_defaults(needs_client=True)
+    subparsers = parser.add_subparsers(dest='subcommand', metavar='command')
+    subparsers.required = True
+
+    export = subparsers.add_parser('export-stock', help='write the stock to a CSV file')
+    export.add_argument('output', help="CSV file to write, '-' for stdout")
+    export.add_argument('--game', type=int, action='append', dest='games', help='game ID (repeatable, default: 1)')
+    export.add_argument('--sealed', action='store_true', help='include sealed products')
+    export.add_argument(
+        '--method', choices=('auto', 'file', 'paged'), default='auto',
+        help='file export, paged get_stock or whichever needs fewer requests (default: auto)'
+    )
+    export.set_defaults(command=export_stock)
+
+    import_ = subparsers.add_parser('import-stock', help='add or change stock articles from a CSV file')
+    import_.add_argument('input', help='CSV file written by export-stock or exported from MKM')
+    import_.add_argument('--action', choices=('add', 'change'), default='add', help='default: add')
+    import_.add_argument('--chunk-size', type=int, default=100, help='articles per request (default: 100)')
+    import_.add_argument('--workers', type=int, default=4, help='concurrent requests (default: 4)')
+    import_.add_argument('--journal', help='journal file to resume an interrupted import')
+    unconfirmed = import_.add_mutually_exclusive_group()
+    unconfirmed.add_argument(
+        '--confirm', action='store_true',
+        help='check unconfirmed changes of the journal with get_stock_article and resend those not applied'
+    )
+    unconfirmed.add_argument(
+        '--resend-unconfirmed', action='store_true', help='send unconfirmed requests of the journal again'
+    )
+    unconfirmed.add_argument(
+        '--discard-pending', action='store_true', help='drop the pending requests of the journal and import the file'
+    )
+    import_.add_argument('--dry-run', action='store_true', help='parse the file and report, send nothing')
+    import_.set_defaults(command=import_stock)
+
+    crawl = subparsers.add_parser('crawl-market', help='snapshot the offers of products')
+    crawl.add_argument('products', help="file with one product ID per line, '-' for stdin")
+    crawl.add_argument('output', help='snapshot file (gzip, see read_market_snapshot())')
+    crawl.add_argument('--workers', type=int, default=4, help='concurrent requests (default: 4)')
+    crawl.add_argument('--rate', type=float, help='maximum requests per second')
+    crawl.add_argument('--burst', type=int, default=1, help='requests sent at once before the rate applies')
+    crawl.add_argument('--reserve', type=int, default=0, help='requests of the quota left unused')
+    crawl.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    crawl.add_argument('--language', type=int, dest='language_id', help='language ID filter')
+    crawl.add_argument('--min-condition', help='minimum condition filter, e.g. EX')
+    crawl.add_argument('--foil', type=_boolean, dest='is_foil', help='foil filter (true/false)')
+    crawl.set_defaults(command=crawl_market)
+
+    queue = subparsers.add_parser('crawl-queue', help='add shards to a distributed crawl queue')
+    queue.add_argument('queue', help='SQLite database of the queue, created if missing')
+    queue.add_argument('kind', choices=KINDS, help="what the IDs are (users may have a ':game_id' suffix)")
+    queue.add_argument('items', help="file with one ID per line, '-' for stdin")
+    queue.add_argument('--shard-size', type=int, default=50, help='items per shard (default: 50)')
+    queue.add_argument('--retry-failed', action='store_true', help='also put failed shards back into the queue')
+    queue.set_defaults(command=crawl_queue, needs_client=False)
+
+    worker = subparsers.add_parser('crawl-worker', help='crawl shards of a queue with the credentials of this host')
+    worker.add_argument('queue', help='SQLite database of the queue')
+    worker.add_argument('output_dir', help='directory of the shard results, shared by all workers')
+    worker.add_argument('--workers', type=int, default=4, help='concurrent requests (default: 4)')
+    worker.add_argument('--rate', type=float, help='maximum requests per second')
+    worker.add_argument('--burst', type=int, default=1, help='requests sent at once before the rate applies')
+    worker.add_argument('--reserve', type=int, default=0, help='requests of the quota left unused')
+    worker.add_argument('--lease', type=float, default=300, help='seconds until a silent shard is reassigned')
+    worker.add_argument('--timeout', type=float, default=60, help='seconds until a silent request fails (default: 60)')
+    worker.add_argument('--max-shards', type=int, help='stop after this many shards')
+    worker.set_defaults(command=crawl_worker)
+
+    merge = subparsers.add_parser('crawl-merge', help='merge the results of a distributed crawl into one file')
+    merge.add_argument('queue', help='SQLite database of the queue')
+    merge.add_argument('output', help='merged gzip file')
+    merge.add_argument('--kind', choices=KINDS, help='only merge shards of this kind')
+    merge.set_defaults(command=crawl_merge, needs_client=False)
+    return parser
+
+
+def export_stock(mkm, args):
+    games = args.games or [1]
+    started = time.monotonic()
+    if args.method == 'paged':
+        articles = iterate_stock(mkm.stock_management, game_ids=games, include_sealed=args.sealed)
+    elif args.method == 'file':
+        streaming_stock_management = StockManagement(mkm.streaming_resolve)
+        articles = (
+            article
+            for game_id in games for is_sealed in ((False, True) if args.sealed else (False,))
+            for article in iter_stock_file(streaming_stock_management.get_stock_as_file(game_id, is_sealed))
+        )
+    else:
+        articles = snapshot_stock(mkm, game_ids=games, include_sealed=args.sealed)
+
+    count = 0
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        writer = csv.writer(output)
+        writer.writerow(StockArticle._fields)
+        for article in articles:
+            writer.writerow(article)
+            count += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    _report(f'Exported {count} articles', count, started)
+    return 0
+
+
+def import_stock(mkm, args):
+    started = time.monotonic()
+    with open(args.input, 'r', encoding='utf-8-sig', newline='') as file:
+        header, reader = read_csv_lines(file)
+        columns = _import_columns(header)
+        articles = [_import_article(StockArticle.from_csv_row(columns, row), args.action) for row in reader if row]
+
+    chunks = [articles[position:position + args.chunk_size] for position in range(0, len(articles), args.chunk_size)]
+    if args.dry_run:
+        _report(f'Would {args.action} {len(articles)} articles in {len(chunks)} requests', len(articles), started)
+        return 0
+
+    if args.journal:
+        return _import_with_journal(mkm, args, articles, started)
+
+    stock_management = mkm.stock_management
+    progress = _Progress()
+    sent = failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(stock_management.bulk_modify_stock, args.action, chunk): len(chunk) for chunk in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                sent += futures[future]
+            except Exception as e:
+                failed += futures[future]
+                print(f'\nRequest failed: {e}', file=sys.stderr)
+            progress(sent + failed, len(articles))
+    print(file=sys.stderr)
+    _report(f'Sent {sent} articles, {failed} failed', sent, started)
+    return 1 if failed else 0
+
+
+def _import_with_journal(mkm, args, articles, started):
+    """
+    Journals all chunks before sending them. If the journal has pending chunks, only those are sent: unsent
+    chunks always, unconfirmed chunks as chosen with --confirm, --resend-unconfirmed or --discard-pending.
+    """
+    journal = StockJournal(args.journal)
+    try:
+        if args.discard_pending:
+            for chunk in journal.pending():
+                journal.discard(chunk['id'])
+        pending = journal.pending()
+        if pending:
+            confirm = None
+            if args.resend_unconfirmed:
+                confirm = _resend
+            elif args.confirm:
+                confirm = confirm_change(mkm.stock_management)
+            responses = journal.resume(mkm.stock_management, confirm=confirm)
+            left = journal.pending()
+            if left:
+                _report(f'Resumed {len(responses)} of {len(pending)} pending requests, {len(left)} unconfirmed left',
+                        len(responses), started)
+                print(f'{_UNCONFIRMED_HINT} The file was not imported.', file=sys.stderr)
+                return 1
+            count = sum(len(chunk['articles']) for chunk in pending)
+            message = f'Resumed {len(pending)} pending requests with {count} articles'
+        else:
+            journal.bulk_modify_stock(
+                mkm.stock_management, args.action, articles, chunk_size=args.chunk_size, max_workers=args.workers
+            )
+            count = len(articles)
+            message = f'Sent {count} articles'
+        rejected = [entry for chunk in journal.rejected() for entry in chunk['rejected']]
+        for entry in rejected:
+            print(f'Rejected: {entry}', file=sys.stderr)
+        for chunk in journal.rejected():
+            journal.discard(chunk['id'])
+        journal.compact()
+    except Exception as e:
+        print(f'Import interrupted: {e}. Run the command again to send the unsent requests. {_UNCONFIRMED_HINT}',
+              file=sys.stderr)
+        return 1
+    finally:
+        journal.close()
+    _report(f'{message}, {len(rejected)} rejected', count - len(rejected), started)
+    return 1 if rejected else 0
+
+
+def _resend(_):
+    return False
+
+
+def crawl_market(mkm, args):
+    if args.restart:
+        for path in (args.output, f'{args.output}.checkpoint'):
+            if os.path.exists(path):
+                os.remove(path)
+    product_file = sys.stdin if args.products == '-' else open(args.products, 'r', encoding='utf-8')
+    try:
+        product_ids = [int(line.strip()) for line in product_file if line.strip()]
+    finally:
+        if product_file is not sys.stdin:
+            product_file.close()
+
+    filters = {
+        name: getattr(args, name) for name in ('language_id', 'min_condition', 'is_foil')
+        if getattr(args, name) is not None
+    }
+    rate_limiter = RateLimiter(requests_per_second=args.rate, burst=args.burst, reserve=args.reserve)
+    crawler = MarketCrawler(
+        mkm, args.output, rate_limiter=rate_limiter, max_workers=args.workers, **filters
+    )
+    already_completed = len(read_json(crawler.checkpoint_path, default={}).get('completed', []))
+    started = time.monotonic()
+    result = crawler.crawl(product_ids, progress=_Progress(already_completed))
+    print(file=sys.stderr)
+    for product_id, error in result['failed'].items():
+        print(f'Product {product_id} failed: {error}', file=sys.stderr)
+    if result['quota_exhausted']:
+        print('Request quota exhausted, run the command again to resume.', file=sys.stderr)
+    fetched = result['completed'] - already_completed
+    _report(f"Crawled {result['completed']} of {len(set(product_ids))} products", fetched, started)
+    return 1 if result['failed'] or result['quota_exhausted'] else 0
+
+
+def crawl_queue(_, args):
+    item_file = sys.stdin if args.items == '-' else open(args.items, 'r', encoding='utf-8')
+    try:
+        items = [line.strip() for line in item_file if line.strip()]
+    finally:
+        if item_file is not sys.stdin:
+            item_file.close()
+    if args.kind != 'user':
+        items = [int(item) for item in items]
+
+    queue = CrawlQueue(args.queue)
+    try:
+        added = queue.add(args.kind, items, shard_size=args.shard_size)
+        retried = queue.retry_failed() if args.retry_failed else 0
+        print(f'Added {added} shards, retrying {retried} failed shards: {queue.stats()}', file=sys.stderr)
+    finally:
+        queue.close()
+    return 0
+
+
+def crawl_worker(mkm, args):
+    queue = CrawlQueue(args.queue, lease_seconds=args.lease)
+    rate_limiter = RateLimiter(requests_per_second=args.rate, burst=args.burst, reserve=args.reserve)
+    started = time.monotonic()
+    try:
+        worker = CrawlWorker(queue, mkm, args.output_dir, rate_limiter=rate_limiter, max_workers=args.workers)
+        result = worker.run(max_shards=args.max_shards)
+        stats = queue.stats()
+    finally:
+        queue.close()
+    if result['quota_exhausted']:
+        print('Request quota exhausted, the current shard was handed back.', file=sys.stderr)
+    _report(
+        f"Crawled {result['completed']} shards, {result['failed']} failed attempts, {result['lost']} lost leases "
+        f"(queue: {stats})", result['completed'], started
+    )
+    return 1 if result['quota_exhausted'] else 0
+
+
+def crawl_merge(_, args):
+    queue = CrawlQueue(args.queue)
+    try:
+        stats = queue.stats()
+        merged = merge_results(queue, args.output, kind=args.kind)
+        for shard, error in queue.failed():
+            print(f'Shard {shard.id} ({shard.kind}, {len(shard.items)} items) failed: {error}', file=sys.stderr)
+    finally:
+        queue.close()
+    print(f'Merged {merged} shards, {stats["pending"] + stats["leased"]} not done, {stats["failed"]} failed',
+          file=sys.stderr)
+    return 0 if stats['pending'] + stats['leased'] + stats['failed'] == 0 else 1
+
+
+def _import_columns(header):
+    """Column positions of a file written by export-stock (StockArticle fields) or exported from MKM."""
+    names = [name.strip() for name in header]
+    if set(StockArticle._fields) & set(names):
+        return {name: position for position, name in enumerate(names) if name in StockArticle._fields}
+    return stock_file_columns(names)
+
+
+def _import_article(article, action):
+    data = article.to_api()
+    if action == 'add':
+        del data['idArticle']
+        data['idProduct'] = article.id_product
+    return data
+
+
+class _Progress:
+    """Prints `completed/total (throughput)` to stderr, at most twice a second."""
+
+    def __init__(self, already_completed: int = 0):
+        self.started = time.monotonic()
+        self.already_completed = already_completed
+        self.printed = 0.0
+
+    def __call__(self, completed, total):
+        now = time.monotonic()
+        if completed < total and now - self.printed < 0.5:
+            return
+        self.printed = now
+        rate = (completed - self.already_completed) / max(now - self.started, 1e-9)
+        print(f'\r{completed}/{total} ({rate:.1f}/s)', end='', file=sys.stderr, flush=True)
+
+
+def _report(message, count, started):
+    elapsed = time.monotonic() - started
+    print(f'{message} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f}/s)', file=sys.stderr)
+
+
+def _boolean(value):
+    if value.lower() in ('true', '1', 'yes'):
+        return True
+    if value.lower() in ('false', '0', 'no'):
+        return False
+    raise argparse.ArgumentTypeError('expected true or false')
@@ -0,0 +1,198 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from mkmapi.mkm import Mkm
+from mkmapi.rate_limiter import RateLimiter
+
+
+class PooledMkm(Mkm):
+    """Mkm instance of a ClientPool account, every request goes through the account's rate limiter."""
+
+    def __init__(self, rate_limiter, **kwargs):
+        """
+        :param rate_limiter: RateLimiter of the account
+        :param kwargs: Arguments for Mkm
+        """
+        super(PooledMkm, self).__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        self._limited_resolve = rate_limiter.wrap(super(PooledMkm, self).resolve)
+
+    def resolve(self, request_method, resource_url, params=None, data=None, **kwargs):
+        return self._limited_resolve(request_method, resource_url, params=params, data=data, **kwargs)
+
+
+class _Account:
+
+    def __init__(self, mkm):
+        self.mkm = mkm
+        self.queue = deque()
+        self.in_flight = 0
+        self.completed = 0
+
+
+class ClientPool:
+    """
+    Runs many MKM accounts from one process.
+
+    All accounts share one HTTP connection pool. Every account has its own credentials (and thus its own
+    OAuth signer) and its own RateLimiter. Work is submitted per account and executed by a shared set of
+    worker threads; the scheduler visits the accounts round-robin and skips accounts that have no budget
+    left right now or already run `max_in_flight` jobs, so one busy account can't starve the others.
+    """
+
+    def __init__(
+            self, max_workers: int = 8, max_connections: int = 20, max_in_flight: int = 2, sandbox: bool = False
+    ):
+        """
+        Initializes the pool and starts the worker threads.
+
+        :param max_workers: Number of worker threads shared by all accounts (default: 8)
+        :param max_connections: Size of the shared HTTP connection pool (default: 20)
+        :param max_in_flight: Maximum number of jobs of one account running at the same time (default: 2)
+        :param sandbox: True to use the sandbox API for all accounts (default: False)
+        """
+        self.sandbox = sandbox
+        self.max_in_flight = max_in_flight
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._accounts = {}
+        self._order = []
+        self._cursor = 0
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f'mkmapi-pool-{number}', daemon=True)
+            for number in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def add_account(
+            self, name, app_token, app_secret, access_token='', access_token_secret='', rate_limiter=None
+    ):
+        """
+        Registers an account.
+
+        :param name: Name the account is referred to by
+        :param app_token: App token for the app registered with the MKM account
+        :param app_secret: Secret (key) for the app registered with the MKM account
+        :param access_token: Access token for the MKM account
+        :param access_token_secret: Secret (key) for the MKM account token
+        :param rate_limiter: RateLimiter of the account (default: a limiter without rate that tracks the quota)
+        :return: Returns the PooledMkm of the account
+        """
+        mkm = PooledMkm(
+            rate_limiter if rate_limiter is not None else RateLimiter(),
+            app_token=app_token,
+            app_secret=app_secret,
+            access_token=access_token,
+            access_token_secret=access_token_secret,
+            sandbox=self.sandbox,
+            session=self.session,
+        )
+        with self._condition:
+            if name in self._accounts:
+                raise ValueError(f'Account `{name}` already exists.')
+            self._accounts[name] = _Account(mkm)
+            self._order.append(name)
+        return mkm
+
+    def get(self, name):
+        """
+        :param name: Name of the account
+        :return: The PooledMkm of the account
+        """
+        return self._accounts[name].mkm
+
+    def submit(self, name, function, *args, **kwargs):
+        """
+        Schedules a job for an account.
+
+        :param name: Name of the account
+        :param function: Callable invoked with the account's PooledMkm followed by args and kwargs
+        :return: Returns a concurrent.futures.Future with the result of the job
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('The pool is shut down.')
+            self._accounts[name].queue.append((future, function, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def stats(self):
+        """
+        :return: Dictionary mapping every account to its number of `queued`, `running` and `completed` jobs
+            and its `remaining` quota (None if unknown)
+        """
+        with self._condition:
+            return {
+                name: {
+                    'queued': len(account.queue),
+                    'running': account.in_flight,
+                    'completed': account.completed,
+                    'remaining': account.mkm.rate_limiter.remaining,
+                }
+                for name, account in self._accounts.items()
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the workers once all queued jobs are done.
+
+        :param wait: Wait for the workers to finish (default: True)
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self.session.close()
+
+    def _next_job(self):
+        """Picks the next job round-robin, returns the job or the seconds to wait for one."""
+        wait = None
+        for offset in range(len(self._order)):
+            position = (self._cursor + offset) % len(self._order)
+            account = self._accounts[self._order[position]]
+            if not account.queue or account.in_flight >= self.max_in_flight:
+                continue
+            delay = account.mkm.rate_limiter.time_until_available()
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            self._cursor = (position + 1) % len(self._order)
+            account.in_flight += 1
+            return account, account.queue.popleft()
+        return wait
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    job = self._next_job()
+                    if isinstance(job, tuple):
+                        break
+                    if self._shutdown and not any(account.queue for account in self._accounts.values()):
+                        return
+                    self._condition.wait(timeout=job)
+
+            account, (future, function, args, kwargs) = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(account.mkm, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._condition:
+                account.in_flight -= 1
+                account.completed += 1
+                self._condition.notify_all()
@@ -0,0 +1,182 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from mkmapi.exceptions import MKMConnectionError
+from mkmapi.response_parser import get_entities
+
+
+class _Pending:
+
+    def __init__(self):
+        self.net = {}
+        self.futures = {}
+
+    def add(self, article_id, count, future):
+        self.net[article_id] = self.net.get(article_id, 0) + count
+        self.futures.setdefault(article_id, []).append(future)
+
+    def __bool__(self):
+        return bool(self.futures)
+
+
+class CoalescingBuffer:
+    """
+    Collects stock quantity and shopping cart changes for a short window and sends them as bulk requests.
+
+    Changes of the same idArticle are netted: increasing an article by 3 and decreasing it by 1 sends one increase
+    by 2, changes that cancel out send nothing. Every call returns a Future with the response of the request that
+    carried its change (None if it was netted out). If MKM reports the quantity change of an article as failed,
+    the futures of that article raise MKMConnectionError.
+
+        buffer = CoalescingBuffer(mkm, window=0.2)
+        future = buffer.decrease_quantity_for_article(1234, 1)
+        response = future.result()
+    """
+
+    def __init__(self, mkm, window: float = 0.2, max_articles: int = 100):
+        """
+        Initializes the buffer and starts its flush thread.
+
+        :param mkm: Mkm instance used for the requests
+        :param window: Seconds changes are collected before they are sent (default: 0.2)
+        :param max_articles: Maximum number of articles per request (default: 100)
+        """
+        self.stock_management = mkm.stock_management
+        self.shopping_cart_manipulation = mkm.shopping_cart_manipulation
+        self.window = window
+        self.max_articles = max_articles
+        self._stock = _Pending()
+        self._cart = _Pending()
+        self._first_change = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._flusher = threading.Thread(target=self._run, name='mkmapi-coalescing-buffer', daemon=True)
+        self._flusher.start()
+
+    def increase_quantity_for_article(self, article_id: int, increase_by: int):
+        """
+        :param article_id: Article ID to increase stock for
+        :param increase_by: Stock will be increased by this amount
+        :return: Returns a Future with the response
+        """
+        return self._add(self._stock, article_id, increase_by)
+
+    def decrease_quantity_for_article(self, article_id: int, decrease_by: int):
+        """
+        :param article_id: Article ID to decrease stock for
+        :param decrease_by: Stock will be decreased by this amount
+        :return: Returns a Future with the response
+        """
+        return self._add(self._stock, article_id, -decrease_by)
+
+    def add_to_shopping_cart(self, article_id, amount: int = 1):
+        """
+        :param article_id: ID of the article to add
+        :param amount: Amount to add (default: 1)
+        :return: Returns a Future with the response
+        """
+        return self._add(self._cart, article_id, amount)
+
+    def remove_from_shopping_cart(self, article_id, amount: int = 1):
+        """
+        :param article_id: ID of the article to remove
+        :param amount: Amount to remove (default: 1)
+        :return: Returns a Future with the response
+        """
+        return self._add(self._cart, article_id, -amount)
+
+    def flush(self):
+        """Sends all collected changes now and waits for the responses."""
+        with self._condition:
+            stock, cart = self._take()
+        self._send(stock, cart)
+
+    def close(self):
+        """Sends the remaining changes and stops the flush thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+
+    def _add(self, pending, article_id, count):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The buffer is closed.')
+            pending.add(article_id, count, future)
+            if self._first_change is None:
+                self._first_change = time.monotonic()
+                self._condition.notify_all()
+        return future
+
+    def _take(self):
+        stock, cart = self._stock, self._cart
+        self._stock, self._cart = _Pending(), _Pending()
+        self._first_change = None
+        return stock, cart
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._first_change is not None:
+                        wait = self._first_change + self.window - time.monotonic()
+                        if wait <= 0 or self._closed:
+                            break
+                    elif self._closed:
+                        return
+                    else:
+                        wait = None
+                    self._condition.wait(wait)
+                stock, cart = self._take()
+            self._send(stock, cart)
+
+    def _send(self, stock, cart):
+        if stock:
+            self._send_netted(stock, self.stock_management.bulk_change_stock_quantity, 'increase', 'decrease', 'count')
+        if cart:
+            self._send_netted(cart, self.shopping_cart_manipulation.bulk_edit_shopping_cart, 'add', 'remove', 'amount')
+
+    def _send_netted(self, pending, send, positive, negative, count_key):
+        for article_id, count in pending.net.items():
+            if count == 0:
+                for future in pending.futures[article_id]:
+                    future.set_result(None)
+
+        for action, sign in ((positive, 1), (negative, -1)):
+            article_ids = [article_id for article_id, count in pending.net.items() if count * sign > 0]
+            for position in range(0, len(article_ids), self.max_articles):
+                chunk = article_ids[position:position + self.max_articles]
+                articles = [{'idArticle': article_id, count_key: abs(pending.net[article_id])} for article_id in chunk]
+                try:
+                    response = send(action, articles)
+                except BaseException as e:
+                    for article_id in chunk:
+                        for future in pending.futures[article_id]:
+                            future.set_exception(e)
+                    continue
+
+                failed = _failed_article_ids(response)
+                for article_id in chunk:
+                    for future in pending.futures[article_id]:
+                        if article_id in failed:
+                            future.set_exception(
+                                MKMConnectionError(response, message=f'Changing article {article_id} failed')
+                            )
+                        else:
+                            future.set_result(response)
+
+
+def _failed_article_ids(response):
+    """IDs of the articles listed under `failed` in a bulk_change_stock_quantity() response."""
+    try:
+        failed = get_entities(response, 'failed')
+    except (ValueError, AttributeError):
+        return set()
+    article_ids = set()
+    for entry in failed:
+        article = entry.get('article', entry) if isinstance(entry, dict) else {}
+        if 'idArticle' in article:
+            article_ids.add(article['idArticle'])
+    return article_ids
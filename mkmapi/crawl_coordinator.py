@@ -0,0 +1,475 @@
+import gzip
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+from mkmapi.api_map.marketplace_info import MarketplaceInfo
+from mkmapi.exceptions import LeaseLost, QuotaExhausted, ShardStalled
+from mkmapi.market_crawler import iterate_product_articles
+from mkmapi.response_parser import ARTICLE_FIELDS, get_entities, parse_json
+from mkmapi.seller_crawler import fetch_user_articles
+
+KINDS = ('product', 'user', 'expansion')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shard (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    items TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS shard_state ON shard (state, lease_expires);
+'''
+
+
+class Shard(NamedTuple):
+    id: int
+    kind: str
+    items: list
+    attempts: int
+
+
+class CrawlQueue:
+    """
+    Work queue of a crawl split into shards, stored in an SQLite database.
+
+    Workers lease a shard, crawl it and mark it done with the path of its result file. A lease expires after
+    `lease_seconds` unless it is renewed, so the shards of a crashed or stuck worker are handed to another worker.
+    A shard that failed, or whose lease expired, is retried until that happened `max_attempts` times.
+
+    Several processes can share the queue. Workers on other hosts need the database on a shared file system
+    with working file locks (SQLite does not support NFS without them).
+    """
+
+    def __init__(self, path, lease_seconds: float = 300, max_attempts: int = 3):
+        """
+        Opens or creates a queue.
+
+        :param path: Path of the database
+        :param lease_seconds: Seconds a leased shard stays assigned to its worker (default: 300)
+        :param max_attempts: Number of failed attempts after which a shard is not retried (default: 3)
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def add(self, kind, items, shard_size: int = 50):
+        """
+        Splits items into shards and adds them to the queue.
+
+        :param kind: product (product IDs), user (user IDs or usernames with an optional ':game_id' suffix)
+            or expansion (expansion IDs)
+        :param items: Iterable of items
+        :param shard_size: Number of items per shard (default: 50)
+        :return: Returns the number of added shards
+        """
+        if kind not in KINDS:
+            raise ValueError(f'kind must be one of {", ".join(KINDS)}.')
+        items = list(dict.fromkeys(items))
+        shards = [
+            (kind, json.dumps(items[position:position + shard_size]))
+            for position in range(0, len(items), shard_size)
+        ]
+        with self._transaction() as cursor:
+            cursor.executemany('INSERT INTO shard (kind, items) VALUES (?, ?)', shards)
+        return len(shards)
+
+    def lease(self, worker):
+        """
+        Assigns the next pending shard, or a shard whose lease expired, to a worker.
+
+        An expired lease counts as a failed attempt: a shard that crashes or hangs every worker is marked failed
+        after `max_attempts` expired leases instead of being handed out forever.
+
+        :param worker: Name of the worker
+        :return: Returns a Shard or None if no shard is available
+        """
+        now = time.time()
+        with self._transaction() as cursor:
+            while True:
+                row = cursor.execute(
+                    "SELECT id, kind, items, attempts, state, worker FROM shard "
+                    "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                shard_id, kind, items, attempts, state, previous_worker = row
+                if state == 'leased':
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        cursor.execute(
+                            "UPDATE shard SET state = 'failed', attempts = ?, lease_expires = NULL, error = ? "
+                            "WHERE id = ?",
+                            (attempts, f'The lease of worker {previous_worker} expired', shard_id)
+                        )
+                        continue
+                cursor.execute(
+                    "UPDATE shard SET state = 'leased', worker = ?, lease_expires = ?, attempts = ? WHERE id = ?",
+                    (worker, now + self.lease_seconds, attempts, shard_id)
+                )
+                return Shard(shard_id, kind, json.loads(items), attempts)
+
+    def renew(self, shard, worker):
+        """
+        Extends the lease of a shard.
+
+        :return: Returns False if the shard is no longer leased by the worker
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE shard SET lease_expires = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                (time.time() + self.lease_seconds, shard.id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, shard, worker, result):
+        """
+        Marks a shard as done. A shard that was already completed by another worker is left unchanged.
+
+        :param result: Path of the result file
+        :return: Returns False if the shard was already done
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE shard SET state = 'done', worker = ?, result = ?, error = NULL "
+                "WHERE id = ? AND state != 'done'",
+                (worker, result, shard.id)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, shard, worker, error):
+        """
+        Records a failed attempt. The shard is pending again until it failed `max_attempts` times.
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE shard SET attempts = attempts + 1, error = ?, lease_expires = NULL, "
+                "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ? AND state = 'leased' AND worker = ?",
+                (str(error), self.max_attempts, shard.id, worker)
+            )
+
+    def release(self, shard, worker):
+        """
+        Hands a shard back without counting an attempt, e.g. when the quota of the worker is used up.
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE shard SET state = 'pending', lease_expires = NULL WHERE id = ? AND state = 'leased' "
+                "AND worker = ?",
+                (shard.id, worker)
+            )
+
+    def retry_failed(self):
+        """
+        Puts all failed shards back into the queue with a new budget of attempts.
+
+        :return: Returns the number of shards
+        """
+        with self._transaction() as cursor:
+            cursor.execute("UPDATE shard SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        :return: Dictionary mapping the states pending, leased, done and failed to their number of shards
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT state, COUNT(*) FROM shard GROUP BY state').fetchall()
+        stats = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        stats.update(rows)
+        return stats
+
+    def failed(self):
+        """
+        :return: List of (Shard, error) of the shards that failed `max_attempts` times
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, kind, items, attempts, error FROM shard WHERE state = 'failed' ORDER BY id"
+            ).fetchall()
+        return [(Shard(row[0], row[1], json.loads(row[2]), row[3]), row[4]) for row in rows]
+
+    def results(self, kind=None):
+        """
+        :param kind: Only shards of this kind (optional)
+        :return: Paths of the result files of all done shards, in shard order
+        """
+        query = "SELECT result FROM shard WHERE state = 'done'"
+        params = ()
+        if kind is not None:
+            query += ' AND kind = ?'
+            params = (kind,)
+        with self._lock:
+            return [row[0] for row in self._connection.execute(query + ' ORDER BY id', params)]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _transaction(self):
+        return _Transaction(self._connection, self._lock)
+
+
+class _Transaction:
+    """Holds the write lock of the database (BEGIN IMMEDIATE) and the lock of the connection."""
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection.cursor()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.lock.release()
+        return False
+
+
+class CrawlWorker:
+    """
+    Pulls shards from a CrawlQueue and crawls them with its own Mkm instance (and thus its own request quota).
+
+    Every shard is written to its own gzip file of JSON lines in `output_dir`, one line per item:
+        product:   {"idProduct": 1234, "fetched": ..., "article": [[...], ...]} (see read_market_snapshot())
+        user:      {"idUser": "name", "idGame": 1, "fetched": ..., "article": [[...], ...]}
+        expansion: {"idExpansion": 1469, "fetched": ..., "expansion": {...}, "single": [...]}
+    Articles are lists of the values of ARTICLE_FIELDS. The output directory should be shared by all workers,
+    otherwise copy the files there before merge_results().
+
+    The lease of a shard is only renewed while its requests keep finishing. A shard without a finished request
+    for `lease_seconds` fails with ShardStalled and is retried; give the Mkm instance a `timeout`, so a hung
+    request does not block the worker itself.
+
+        queue = CrawlQueue('crawl.db')
+        queue.add('product', product_ids)
+        CrawlWorker(queue, Mkm(timeout=60), 'crawl').run()
+        merge_results(queue, 'market.gz', kind='product')
+    """
+
+    def __init__(self, queue, mkm, output_dir, worker=None, rate_limiter=None, max_workers: int = 4):
+        """
+        :param queue: CrawlQueue the shards are taken from
+        :param mkm: Mkm instance used for the requests
+        :param output_dir: Directory of the result files
+        :param worker: Name of the worker (default: host name and process ID)
+        :param rate_limiter: RateLimiter all requests go through (optional)
+        :param max_workers: Number of items of a shard fetched concurrently (default: 4)
+        """
+        self.queue = queue
+        self.output_dir = output_dir
+        self.worker = worker if worker is not None else f'{socket.gethostname()}-{os.getpid()}'
+        self.max_workers = max_workers
+        self.resolve = rate_limiter.wrap(mkm.resolve) if rate_limiter is not None else mkm.resolve
+        os.makedirs(output_dir, exist_ok=True)
+
+    def run(self, max_shards: int = None):
+        """
+        Crawls shards until the queue is empty, `max_shards` are done or the request quota is used up.
+
+        :param max_shards: Maximum number of shards to crawl (optional)
+        :return: Dictionary with the number of `completed` and `failed` shards, the number of shards whose lease
+            was `lost` (they are retried by another worker) and `quota_exhausted`
+        """
+        result = {'completed': 0, 'failed': 0, 'lost': 0, 'quota_exhausted': False}
+        while max_shards is None or result['completed'] + result['failed'] + result['lost'] < max_shards:
+            shard = self.queue.lease(self.worker)
+            if shard is None:
+                break
+            try:
+                path = self.crawl_shard(shard)
+            except QuotaExhausted:
+                self.queue.release(shard, self.worker)
+                result['quota_exhausted'] = True
+                break
+            except LeaseLost:
+                result['lost'] += 1
+                continue
+            except Exception as e:
+                self.queue.fail(shard, self.worker, e)
+                result['failed'] += 1
+                continue
+            self.queue.complete(shard, self.worker, path)
+            result['completed'] += 1
+        return result
+
+    def crawl_shard(self, shard):
+        """
+        Fetches all items of a shard and writes the result file.
+
+        While the items are fetched, a heartbeat thread renews the lease every third of `lease_seconds` as long as
+        requests keep finishing. If an item fails or the lease is lost, the items that did not start are cancelled
+        and the running ones stop before their next request; this returns once they all stopped.
+
+        :return: Returns the path of the result file
+        """
+        fetch = getattr(self, f'_fetch_{shard.kind}')
+        heartbeat = _Heartbeat(self.queue, shard, self.worker)
+        marketplace_info = MarketplaceInfo(heartbeat.wrap(self.resolve))
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f'mkmapi-shard-{shard.id}')
+        try:
+            futures = [executor.submit(fetch, marketplace_info, item) for item in shard.items]
+            running = set(futures)
+            while running:
+                finished, running = wait(running, timeout=heartbeat.interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                heartbeat.check()
+        finally:
+            heartbeat.abandon()
+            executor.shutdown(wait=True, cancel_futures=True)
+            heartbeat.stop()
+        records = [json.dumps(future.result(), separators=(',', ':')) for future in futures]
+
+        path = os.path.join(self.output_dir, f'shard-{shard.id}.jsonl.gz')
+        temporary_path = f'{path}.{self.worker}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(gzip.compress(''.join(f'{record}\n' for record in records).encode('utf-8')))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+        return path
+
+    @staticmethod
+    def _fetch_product(marketplace_info, product_id):
+        articles = iterate_product_articles(marketplace_info, product_id)
+        return {
+            'idProduct': product_id,
+            'fetched': time.time(),
+            'article': [[article.get(field) for field in ARTICLE_FIELDS] for article in articles],
+        }
+
+    @staticmethod
+    def _fetch_user(marketplace_info, item):
+        user_id, _, game_id = str(item).partition(':')
+        game_id = int(game_id) if game_id else 1
+        articles = fetch_user_articles(marketplace_info, user_id, game_id)
+        return {
+            'idUser': user_id,
+            'idGame': game_id,
+            'fetched': time.time(),
+            'article': [[article.get(field) for field in ARTICLE_FIELDS] for article in articles.values()],
+        }
+
+    @staticmethod
+    def _fetch_expansion(marketplace_info, expansion_id):
+        body = parse_json(marketplace_info.get_expansion_singles(expansion_id))
+        return {
+            'idExpansion': expansion_id,
+            'fetched': time.time(),
+            'expansion': body.get('expansion'),
+            'single': get_entities(body, 'single'),
+        }
+
+
+class _Heartbeat:
+    """
+    Renews the lease of a shard in the background while the requests of the shard make progress.
+
+    wrap() returns the resolve function for the shard: it records every finished request and refuses new requests
+    once the shard is abandoned. Without a finished request for `lease_seconds` the lease is no longer renewed and
+    check() raises ShardStalled.
+    """
+
+    def __init__(self, queue, shard, worker):
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.interval = queue.lease_seconds / 3
+        self.lost = False
+        self.stalled = False
+        self._last_progress = time.monotonic()
+        self._abandoned = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'mkmapi-lease-{shard.id}', daemon=True)
+        self._thread.start()
+
+    def wrap(self, resolve):
+        def shard_resolve(*args, **kwargs):
+            if self._abandoned.is_set():
+                raise LeaseLost(self.shard.id) if self.lost else ShardStalled(self.shard.id, self.idle())
+            try:
+                return resolve(*args, **kwargs)
+            finally:
+                self._last_progress = time.monotonic()
+
+        return shard_resolve
+
+    def idle(self):
+        """
+        :return: Seconds since the last finished request
+        """
+        return time.monotonic() - self._last_progress
+
+    def check(self):
+        if self.lost:
+            raise LeaseLost(self.shard.id)
+        if self.stalled:
+            raise ShardStalled(self.shard.id, self.idle())
+
+    def abandon(self):
+        """Makes the requests of the shard that did not start yet fail."""
+        self._abandoned.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self.idle() >= self.queue.lease_seconds:
+                self.stalled = True
+                return
+            if not self.queue.renew(self.shard, self.worker):
+                self.lost = True
+                return
+
+
+def merge_results(queue, output_path, kind=None):
+    """
+    Concatenates the result files of all done shards into one gzip file, in shard order.
+    A merged product crawl can be read with read_market_snapshot().
+
+    :param queue: CrawlQueue of the crawl
+    :param output_path: Path of the merged file
+    :param kind: Only merge shards of this kind (optional)
+    :return: Returns the number of merged shards
+    """
+    paths = queue.results(kind)
+    temporary_path = f'{output_path}.tmp'
+    with open(temporary_path, 'wb') as output:
+        for path in paths:
+            with open(path, 'rb') as file:
+                # Concatenated gzip members form a valid gzip file
+                while True:
+                    chunk = file.read(1 << 20)
+                    if not chunk:
+                        break
+                    output.write(chunk)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary_path, output_path)
+    return len(paths)
@@ -46,3 +46,88 @@ class SerializationException(Exception):
 
     def __str__(self):
         return f'Serialization exception. {self.args}'
+
+
+class QuotaExhausted(Exception):
+    """Error raised when the request quota of the account is used up."""
+
+    def __init__(self, limit=None):
+        """
+        Initializes the exception with the request limit of the account.
+
+        :param limit: The maximum number of requests of the account if known
+        """
+        self.limit = limit
+
+    def __str__(self):
+        if self.limit is None:
+            return 'Request quota exhausted'
+        return f'Request quota of {self.limit} requests exhausted'
+
+
+class ReplayMiss(Exception):
+    """Error raised by a ReplayTransport for a request that was not recorded."""
+
+    def __init__(self, method, url):
+        """
+        Initializes the exception with the request that was not found.
+
+        :param method: Method of the request
+        :param url: URL of the request including the query string
+        """
+        self.method = method
+        self.url = url
+
+    def __str__(self):
+        return f'No recorded response for {self.method} {self.url}'
+
+
+class CircuitOpenError(Exception):
+    """Error raised without sending the request while the API is considered down."""
+
+    def __init__(self, group, retry_after=None):
+        """
+        Initializes the exception with the endpoint group whose circuit is open.
+
+        :param group: Endpoint group, e.g. 'stock'
+        :param retry_after: Seconds until the next request is let through
+        """
+        self.group = group
+        self.retry_after = retry_after
+
+    def __str__(self):
+        if self.retry_after is None:
+            return f'Circuit open for /{self.group}'
+        return f'Circuit open for /{self.group}, retry in {self.retry_after:.1f}s'
+
+
+class LeaseLost(Exception):
+    """Error raised by a CrawlWorker when the lease of its shard expired, another worker may have taken it."""
+
+    def __init__(self, shard_id):
+        """
+        Initializes the exception with the shard whose lease was lost.
+
+        :param shard_id: ID of the shard
+        """
+        self.shard_id = shard_id
+
+    def __str__(self):
+        return f'The lease of shard {self.shard_id} expired'
+
+
+class ShardStalled(Exception):
+    """Error raised by a CrawlWorker when no request of its shard finished within the lease, the shard is retried."""
+
+    def __init__(self, shard_id, seconds):
+        """
+        Initializes the exception with the shard that made no progress.
+
+        :param shard_id: ID of the shard
+        :param seconds: Seconds without a finished request
+        """
+        self.shard_id = shard_id
+        self.seconds = seconds
+
+    def __str__(self):
+        return f'No request of shard {self.shard_id} finished within {self.seconds:.0f} seconds'
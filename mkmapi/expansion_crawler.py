@@ -0,0 +1,169 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.response_parser import get_entities, parse_date, parse_json
+
+
+class ExpansionCrawler:
+    """
+    Crawls all games, their expansions and the singles of every expansion into an on-disk snapshot.
+
+    The snapshot is a directory with the following layout:
+        games.json              - all games as returned by get_games()
+        expansions.json         - all expansions of all games, keyed by idExpansion
+        singles/<id>.json       - singles of one expansion and the time they were fetched
+
+    Every expansion is written as soon as it is fetched, so an interrupted crawl resumes where it stopped.
+    Later runs only fetch expansions that are missing from the snapshot or that were released recently
+    (their singles still change) and were not refreshed within `refresh_after`.
+    """
+
+    def __init__(self, mkm, snapshot_dir, max_workers: int = 8, recent_days: int = 30, refresh_after: int = 24):
+        """
+        Initializes the crawler.
+
+        :param mkm: Mkm instance used for the requests
+        :param snapshot_dir: Directory the snapshot is written to
+        :param max_workers: Number of requests sent concurrently (default: 8)
+        :param recent_days: Expansions released less than this many days ago are refreshed (default: 30)
+        :param refresh_after: Minimum age in hours of a recent expansion's singles before they are refreshed
+            (default: 24)
+        """
+        self.mkm = mkm
+        self.snapshot_dir = snapshot_dir
+        self.max_workers = max_workers
+        self.recent_days = recent_days
+        self.refresh_after = refresh_after
+
+    @property
+    def games_path(self):
+        return os.path.join(self.snapshot_dir, 'games.json')
+
+    @property
+    def expansions_path(self):
+        return os.path.join(self.snapshot_dir, 'expansions.json')
+
+    def singles_path(self, expansion_id):
+        return os.path.join(self.snapshot_dir, 'singles', f'{expansion_id}.json')
+
+    def crawl(self, game_ids=None):
+        """
+        Updates the snapshot.
+
+        :param game_ids: Only crawl these games (optional; default: all games returned by get_games())
+        :return: Dictionary with the lists of `fetched` and `skipped` expansion IDs and the `failed`
+            expansion IDs (or game IDs for failed expansion listings) mapped to the error message
+        """
+        marketplace_info = self.mkm.marketplace_info
+        games = get_entities(marketplace_info.get_games(), 'game')
+        atomic_write_json(self.games_path, games)
+        if game_ids is not None:
+            games = [game for game in games if game['idGame'] in game_ids]
+
+        summary = {'fetched': [], 'skipped': [], 'failed': {}}
+        expansions = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(marketplace_info.get_expansion, game['idGame']): game['idGame'] for game in games
+            }
+            for future in as_completed(futures):
+                try:
+                    for expansion in get_entities(future.result(), 'expansion'):
+                        expansions[str(expansion['idExpansion'])] = expansion
+                except Exception as e:
+                    summary['failed'][f'game:{futures[future]}'] = str(e)
+
+            known_expansions = read_json(self.expansions_path, default={})
+            known_expansions.update(expansions)
+            atomic_write_json(self.expansions_path, known_expansions)
+
+            to_fetch = []
+            for expansion_id, expansion in expansions.items():
+                if self.needs_refresh(expansion):
+                    to_fetch.append(expansion_id)
+                else:
+                    summary['skipped'].append(expansion_id)
+
+            futures = {
+                executor.submit(self._fetch_singles, expansion_id): expansion_id for expansion_id in to_fetch
+            }
+            for future in as_completed(futures):
+                expansion_id = futures[future]
+                try:
+                    future.result()
+                    summary['fetched'].append(expansion_id)
+                except Exception as e:
+                    summary['failed'][expansion_id] = str(e)
+
+        return summary
+
+    def needs_refresh(self, expansion):
+        """
+        Checks if the singles of an expansion have to be (re-)fetched.
+
+        :param expansion: Expansion entity
+        :return: True if the singles are missing or the expansion is recent and its singles are outdated
+        """
+        fetched = read_json(self.singles_path(expansion['idExpansion']))
+        if fetched is None:
+            return True
+        if not self.is_recent(expansion):
+            return False
+        return time.time() - fetched['fetched'] > self.refresh_after * 3600
+
+    def is_recent(self, expansion):
+        """
+        Checks if an expansion is unreleased or was released within the last `recent_days`.
+
+        :param expansion: Expansion entity
+        :return: True if the expansion is recent
+        """
+        return is_recent_expansion(expansion, self.recent_days)
+
+    def _fetch_singles(self, expansion_id):
+        response = self.mkm.marketplace_info.get_expansion_singles(expansion_id)
+        body = parse_json(response)
+        atomic_write_json(self.singles_path(expansion_id), {
+            'fetched': time.time(),
+            'expansion': body.get('expansion'),
+            'single': get_entities(body, 'single'),
+        })
+
+    def games(self):
+        """
+        :return: All games of the snapshot
+        """
+        return read_json(self.games_path, default=[])
+
+    def expansions(self):
+        """
+        :return: All expansions of the snapshot, keyed by idExpansion (as string)
+        """
+        return read_json(self.expansions_path, default={})
+
+    def singles(self, expansion_id):
+        """
+        :param expansion_id: ID of the expansion
+        :return: The singles of the expansion or None if they were not fetched yet
+        """
+        fetched = read_json(self.singles_path(expansion_id))
+        return None if fetched is None else fetched['single']
+
+
+def is_recent_expansion(expansion, recent_days: int = 30):
+    """
+    Checks if an expansion is unreleased or was released within the last `recent_days`, its singles may still change.
+
+    :param expansion: Expansion entity
+    :param recent_days: Number of days an expansion counts as recent after its release (default: 30)
+    :return: True if the expansion is recent
+    """
+    if not expansion.get('isReleased', True):
+        return True
+    release_date = parse_date(expansion.get('releaseDate'))
+    if release_date is None:
+        return True
+    return release_date > datetime.now(timezone.utc) - timedelta(days=recent_days)
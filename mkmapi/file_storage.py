@@ -0,0 +1,35 @@
+import json
+import os
+
+
+def read_json(path, default=None):
+    """
+    Reads a JSON document from disk.
+
+    :param path: Path of the file
+    :param default: Returned if the file does not exist
+    :return: Returns the decoded document or `default`
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def atomic_write_json(path, data):
+    """
+    Writes a JSON document so that readers (and a crashed process) never see a half written file.
+    The data is written to a temporary file first, flushed to disk and then renamed over `path`.
+
+    :param path: Path of the file
+    :param data: JSON serializable data
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, separators=(',', ':'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
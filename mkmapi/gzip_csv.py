@@ -0,0 +1,42 @@
+import base64
+import csv
+import gzip
+import io
+
+
+def decode_file(encoded):
+    """
+    Decodes the files returned by get_product_list(), get_price_guide() and get_stock_as_file().
+    They are Base64 encoded strings of gzipped CSV files.
+
+    :param encoded: Base64 encoded string (or bytes)
+    :return: Returns the unpacked CSV file as bytes
+    """
+    return gzip.decompress(base64.b64decode(encoded))
+
+
+def read_csv(raw, encoding: str = 'utf-8'):
+    """
+    Parses a CSV file. MKM uses commas for some files and semicolons for others, the delimiter is detected
+    from the header line.
+
+    :param raw: CSV file as bytes
+    :param encoding: Encoding of the file (default: utf-8)
+    :return: Returns the list of column names and an iterator over the rows (lists of strings)
+    """
+    lines = io.StringIO(raw.decode(encoding).lstrip('\ufeff'), newline='')
+    return read_csv_lines(lines)
+
+
+def read_csv_lines(lines):
+    """
+    Parses CSV lines, see read_csv().
+
+    :param lines: Iterable of lines (strings)
+    :return: Returns the list of column names and an iterator over the rows (lists of strings)
+    """
+    lines = iter(lines)
+    header_line = next(lines, '')
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    header = next(csv.reader([header_line], delimiter=delimiter), [])
+    return header, csv.reader(lines, delimiter=delimiter)
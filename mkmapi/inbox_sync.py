@@ -0,0 +1,141 @@
+import threading
+import time
+from bisect import bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from mkmapi.exceptions import MKMConnectionError
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.response_parser import get_entities, parse_date, parse_json
+
+
+class InboxSync:
+    """
+    Keeps a local copy of the authenticated user's message threads.
+
+    The first sync downloads all threads of get_message_overview(). Later syncs ask get_messages_between()
+    for the messages since the last sync and only download the threads those messages belong to.
+    If get_messages_between() fails (it is known to answer 400 for some users) or returns messages without
+    a partner, the changed threads are detected by comparing the latest message of every thread in
+    get_message_overview() with the store instead.
+
+    new_since() answers "what's new since X" from a sorted in-memory index without any request.
+    """
+
+    # Messages sent shortly before the last sync may only show up later, they are requested again
+    OVERLAP_SECONDS = 300
+
+    def __init__(self, mkm, store_path, max_workers: int = 4):
+        """
+        Initializes the synchroniser and loads the local store.
+
+        :param mkm: Mkm instance used for the requests
+        :param store_path: Path of the file the threads are stored in
+        :param max_workers: Number of threads fetched concurrently (default: 4)
+        """
+        self.mkm = mkm
+        self.store_path = store_path
+        self.max_workers = max_workers
+        self.store = read_json(store_path, default={'last_sync': None, 'threads': {}})
+        self._index = []
+        self._lock = threading.Lock()
+        for partner_id, thread in self.store['threads'].items():
+            for message_id, message in thread['messages'].items():
+                self._index.append((message['timestamp'], partner_id, message_id))
+        self._index.sort()
+
+    def sync(self):
+        """
+        Fetches all threads with new messages and merges them into the store.
+
+        :return: Returns a list of the new messages, every message has an additional `idPartner` key
+        """
+        started = time.time()
+        last_sync = self.store['last_sync']
+        if last_sync is None:
+            changed = self._changed_from_overview(everything=True)
+        else:
+            changed = self._changed_since(last_sync - self.OVERLAP_SECONDS)
+
+        account_management = self.mkm.account_management
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            threads = executor.map(lambda partner_id: account_management.get_messages_from(int(partner_id)), changed)
+            threads = list(zip(changed, threads))
+
+        new_messages = []
+        with self._lock:
+            for partner_id, response in threads:
+                new_messages.extend(self._merge(partner_id, parse_json(response)))
+            self.store['last_sync'] = started
+            atomic_write_json(self.store_path, self.store)
+        return new_messages
+
+    def new_since(self, timestamp):
+        """
+        Returns the stored messages that were sent or received after a point in time.
+
+        :param timestamp: UNIX timestamp or timezone aware datetime
+        :return: Returns a list of messages ordered by date, every message has an additional `idPartner` key
+        """
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        with self._lock:
+            position = bisect_right(self._index, (timestamp, chr(0x10ffff), chr(0x10ffff)))
+            entries = self._index[position:]
+            return [
+                dict(self.store['threads'][partner_id]['messages'][message_id], idPartner=int(partner_id))
+                for _, partner_id, message_id in entries
+            ]
+
+    def thread(self, partner_id):
+        """
+        :param partner_id: ID of the other user
+        :return: The stored thread with `partner` and `messages` (keyed by idMessage) or None
+        """
+        return self.store['threads'].get(str(partner_id))
+
+    def _changed_since(self, timestamp):
+        start_date = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S%z')
+        try:
+            messages = get_entities(self.mkm.account_management.get_messages_between(start_date), 'message')
+        except MKMConnectionError:
+            return self._changed_from_overview()
+
+        changed = set()
+        for message in messages:
+            partner = message.get('partner')
+            if partner is None:
+                return self._changed_from_overview()
+            if message['idMessage'] not in self.store['threads'].get(str(partner['idUser']), {}).get('messages', {}):
+                changed.add(str(partner['idUser']))
+        return sorted(changed)
+
+    def _changed_from_overview(self, everything=False):
+        changed = []
+        for thread in get_entities(self.mkm.account_management.get_message_overview(), 'thread'):
+            partner_id = str(thread['partner']['idUser'])
+            latest = thread.get('message') or {}
+            known = self.store['threads'].get(partner_id, {}).get('messages', {})
+            if everything or latest.get('idMessage') not in known:
+                changed.append(partner_id)
+        return changed
+
+    def _merge(self, partner_id, body):
+        thread = self.store['threads'].setdefault(partner_id, {'partner': None, 'messages': {}})
+        if body.get('partner') is not None:
+            thread['partner'] = body['partner']
+
+        new_messages = []
+        for message in get_entities(body, 'message'):
+            message_id = message['idMessage']
+            date = parse_date(message.get('date'))
+            message = dict(message, timestamp=date.timestamp() if date is not None else time.time())
+            known = thread['messages'].get(message_id)
+            if known is not None:
+                # Read state may change, the message itself does not
+                known.update(message, timestamp=known['timestamp'])
+                continue
+            thread['messages'][message_id] = message
+            insort(self._index, (message['timestamp'], partner_id, message_id))
+            new_messages.append(dict(message, idPartner=int(partner_id)))
+        return new_messages
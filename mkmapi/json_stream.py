@@ -0,0 +1,153 @@
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_entities(response, key, chunk_size: int = 65536):
+    """
+    Yields the entities of a top level array of a streamed response as soon as they are downloaded,
+    e.g. the articles of {"article": [{...}, {...}]}. The full document is never held in memory.
+
+    The response must be requested in streaming mode, see Mkm.streaming_resolve():
+        response = StockManagement(mkm.streaming_resolve).get_stock(1)
+        for article in iter_entities(response, 'article'):
+            ...
+
+    :param response: Response received from the server
+    :param key: Name of the entities, e.g. 'article' or 'order'
+    :param chunk_size: Number of bytes read at once (default: 64 KiB)
+    :return: Yields the entities (dictionaries)
+    """
+    try:
+        yield from iter_json_array(response.iter_content(chunk_size=chunk_size), key)
+    finally:
+        response.close()
+
+
+def iter_paged_entities(fetch_page, key, start: int = 1, page_size: int = 100, chunk_size: int = 65536):
+    """
+    Streams the entities of a paginated collection, see paging.iterate_pages().
+
+    :param fetch_page: Callable that takes the start position and returns the streamed response of the page
+    :param key: Name of the entities, e.g. 'article' or 'order'
+    :param start: Position of the first entity (default: 1)
+    :param page_size: Number of entities per page (default: 100)
+    :param chunk_size: Number of bytes read at once (default: 64 KiB)
+    :return: Yields the entities (dictionaries)
+    """
+    while True:
+        count = 0
+        for entity in iter_entities(fetch_page(start), key, chunk_size):
+            count += 1
+            yield entity
+        if count < page_size:
+            return
+        start += page_size
+
+
+def iter_json_array(chunks, key):
+    """
+    Incrementally parses a JSON object from byte chunks and yields the elements of the array stored under `key`.
+    Other keys of the object are skipped. If `key` holds a single object instead of an array, that object is
+    yielded.
+
+    :param chunks: Iterable of bytes
+    :param key: Key of the array in the top level object
+    :return: Yields the elements of the array
+    """
+    parser = _StreamParser(chunks)
+    if not parser.expect('{'):
+        return
+    while True:
+        if not parser.skip_whitespace():
+            return
+        if parser.peek() == ',':
+            parser.position += 1
+            continue
+        if parser.peek() == '}':
+            return
+
+        name = parser.decode()
+        if not parser.expect(':') or not parser.skip_whitespace():
+            return
+        if name != key:
+            parser.decode()
+            continue
+
+        if parser.peek() != '[':
+            yield parser.decode()
+            return
+        parser.position += 1
+        while parser.skip_whitespace():
+            character = parser.peek()
+            if character == ']':
+                return
+            if character == ',':
+                parser.position += 1
+                continue
+            yield parser.decode()
+            parser.compact()
+        return
+
+
+class _StreamParser:
+    """Text buffer over a stream of byte chunks with helpers to decode complete JSON values."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+
+    def fill(self):
+        """Appends the next chunk to the buffer, returns False if the stream is exhausted."""
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += self.text_decoder.decode(chunk)
+                return True
+        if not self.exhausted:
+            self.exhausted = True
+            self.buffer += self.text_decoder.decode(b'', final=True)
+        return False
+
+    def compact(self):
+        if self.position > 65536:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+
+    def skip_whitespace(self):
+        """Moves to the next non whitespace character, returns False at the end of the stream."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return True
+            if not self.fill():
+                return False
+
+    def peek(self):
+        return self.buffer[self.position]
+
+    def expect(self, character):
+        if not self.skip_whitespace() or self.peek() != character:
+            return False
+        self.position += 1
+        return True
+
+    def decode(self):
+        """Decodes the complete JSON value at the current position, reading more chunks until it is complete."""
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not isinstance(value, (dict, list, str)) and self.fill():
+                continue
+            self.position = end
+            return value
@@ -0,0 +1,199 @@
+import gzip
+import json
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from mkmapi.api_map.marketplace_info import MarketplaceInfo
+from mkmapi.exceptions import QuotaExhausted
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.response_parser import ARTICLE_FIELDS, flatten_article, get_entities
+
+PAGE_SIZE = 1000
+
+
+class MarketCrawler:
+    """
+    Snapshots the articles (offers) of many products with get_articles_for_product().
+
+    Results are appended to a gzip file with one JSON line per product:
+        {"idProduct": 1234, "fetched": 1577836800.0, "article": [[...], ...]}
+    where every article is a list of the values of ARTICLE_FIELDS. Each flush appends a new gzip member,
+    read the file back with read_market_snapshot().
+
+    Progress is checkpointed after every flush together with the size of the output file.
+    A resumed crawl truncates the output to that size and skips all completed products.
+    """
+
+    def __init__(
+            self, mkm, output_path, checkpoint_path=None, rate_limiter=None, max_workers: int = 4,
+            flush_every: int = 50, **filters
+    ):
+        """
+        Initializes the crawler.
+
+        :param mkm: Mkm instance used for the requests
+        :param output_path: Path of the snapshot file
+        :param checkpoint_path: Path of the checkpoint file (default: output_path + '.checkpoint')
+        :param rate_limiter: RateLimiter all requests go through (optional)
+        :param max_workers: Number of requests sent concurrently (default: 4)
+        :param flush_every: Number of products written per flush and checkpoint (default: 50)
+        :param filters: Filter parameters passed to get_articles_for_product(), e.g. language_id=1, is_foil=False
+        """
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path if checkpoint_path is not None else f'{output_path}.checkpoint'
+        self.max_workers = max_workers
+        self.flush_every = flush_every
+        self.filters = filters
+        resolve = rate_limiter.wrap(mkm.resolve) if rate_limiter is not None else mkm.resolve
+        self.marketplace_info = MarketplaceInfo(resolve)
+
+    def crawl(self, product_ids, progress=None):
+        """
+        Fetches the articles of all products that are not completed yet.
+
+        :param product_ids: Iterable of product IDs
+        :param progress: Callable invoked with (completed, total) after every product (optional)
+        :return: Dictionary with the number of `completed` products, the `failed` product IDs mapped to
+            the error message and `quota_exhausted` (True if the crawl stopped because the quota is used up)
+        """
+        checkpoint = self._load_checkpoint()
+        completed = set(checkpoint['completed'])
+        pending = [product_id for product_id in dict.fromkeys(product_ids) if product_id not in completed]
+        total = len(completed) + len(pending)
+        failed = {}
+        buffer = []
+        quota_exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            products = iter(pending)
+            futures = {}
+            while True:
+                while not quota_exhausted and len(futures) < self.max_workers * 2:
+                    product_id = next(products, None)
+                    if product_id is None:
+                        break
+                    futures[executor.submit(self.fetch_product, product_id)] = product_id
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    product_id = futures.pop(future)
+                    try:
+                        buffer.append((product_id, future.result()))
+                    except QuotaExhausted:
+                        quota_exhausted = True
+                    except Exception as e:
+                        failed[product_id] = str(e)
+
+                if len(buffer) >= self.flush_every:
+                    self._flush(checkpoint, buffer)
+                    buffer = []
+                if progress is not None:
+                    progress(len(checkpoint['completed']) + len(buffer), total)
+
+        if buffer:
+            self._flush(checkpoint, buffer)
+        return {
+            'completed': len(checkpoint['completed']),
+            'failed': failed,
+            'quota_exhausted': quota_exhausted,
+        }
+
+    def fetch_product(self, product_id):
+        """
+        Fetches all articles of a product, following the pagination of get_articles_for_product().
+
+        :param product_id: ID of the product
+        :return: Returns a list of flattened articles
+        """
+        return list(iterate_product_articles(self.marketplace_info, product_id, **self.filters))
+
+    def _load_checkpoint(self):
+        checkpoint = read_json(self.checkpoint_path)
+        if checkpoint is None:
+            checkpoint = {'filters': self.filters, 'completed': [], 'offset': 0}
+        elif checkpoint['filters'] != self.filters:
+            raise ValueError('The checkpoint was created with different filters, use a new output path.')
+
+        # Everything after the checkpointed offset was written by an interrupted flush
+        if os.path.exists(self.output_path):
+            with open(self.output_path, 'r+b') as file:
+                file.truncate(checkpoint['offset'])
+        return checkpoint
+
+    def _flush(self, checkpoint, buffer):
+        lines = []
+        fetched = time.time()
+        for product_id, articles in buffer:
+            rows = [[article.get(field) for field in ARTICLE_FIELDS] for article in articles]
+            record = {'idProduct': product_id, 'fetched': fetched, 'article': rows}
+            lines.append(json.dumps(record, separators=(',', ':')))
+        member = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+        with open(self.output_path, 'ab') as file:
+            file.write(member)
+            file.flush()
+            os.fsync(file.fileno())
+            offset = file.tell()
+
+        checkpoint['completed'].extend(product_id for product_id, _ in buffer)
+        checkpoint['offset'] = offset
+        atomic_write_json(self.checkpoint_path, checkpoint)
+
+
+def iterate_product_articles(marketplace_info, product_id, **filters):
+    """
+    Iterates over all articles of a product, following the pagination of get_articles_for_product().
+
+    :param marketplace_info: MarketplaceInfo instance used for the requests
+    :param product_id: ID of the product
+    :param filters: Filter parameters passed to get_articles_for_product()
+    :return: Yields flattened articles
+    """
+    start = 0
+    while True:
+        response = marketplace_info.get_articles_for_product(product_id, start=start, max_results=PAGE_SIZE, **filters)
+        page = get_entities(response, 'article')
+        for article in page:
+            yield flatten_article(article)
+        if len(page) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
+
+
+def read_market_snapshot(path, chunk_size: int = 1 << 20):
+    """
+    Reads a snapshot written by MarketCrawler without loading the whole file.
+
+    Reading stops at a corrupt or truncated member (the crawler was interrupted while writing).
+
+    :param path: Path of the snapshot file
+    :param chunk_size: Number of bytes read at once (default: 1 MiB)
+    :return: Yields one dictionary per product with idProduct, fetched and a list of flattened articles
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    pending = b''
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                return
+            while data:
+                try:
+                    pending += decompressor.decompress(data)
+                except zlib.error:
+                    return
+                data = b''
+                if decompressor.eof:
+                    # The next gzip member starts right after the end of this one
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+
+                *lines, pending = pending.split(b'\n')
+                for line in lines:
+                    record = json.loads(line)
+                    record['article'] = [dict(zip(ARTICLE_FIELDS, row)) for row in record['article']]
+                    yield record
@@ -0,0 +1,330 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mkmapi.api_map.marketplace_info import MarketplaceInfo
+from mkmapi.expansion_crawler import is_recent_expansion
+from mkmapi.response_parser import get_entities
+from mkmapi.stock_snapshot import LANGUAGES
+
+MAGIC = b'MKMB'
+VERSION = 1
+# magic, version, created (UNIX timestamp), length of the JSON part, number of product IDs
+HEADER = struct.Struct('<4sBdII')
+
+
+class MetadataBundle:
+    """
+    Games, expansions, languages and the product IDs of every expansion's singles in one compact file.
+
+    The file is a small uncompressed header followed by a zlib compressed JSON document (games, expansions and
+    languages) and all product IDs as one array of 64 bit integers, so loading it takes a few milliseconds.
+    """
+
+    def __init__(self, games, expansions, singles, languages=None, created=None):
+        """
+        :param games: List of Game entities
+        :param expansions: Dictionary mapping game IDs to lists of Expansion entities
+        :param singles: Dictionary mapping expansion IDs to array('q') of the product IDs of their singles
+        :param languages: Dictionary mapping language IDs to names (default: the MKM languages)
+        :param created: UNIX timestamp of the data (default: now)
+        """
+        self.games = games
+        self.expansions = expansions
+        self.singles = singles
+        self.languages = languages if languages is not None else {
+            language_id: name for name, language_id in LANGUAGES.items()
+        }
+        self.created = created if created is not None else time.time()
+        # Requests that failed while building, mapped to the error message (not saved)
+        self.failed = {}
+
+    @property
+    def age(self):
+        """
+        :return: Age of the data in seconds
+        """
+        return time.time() - self.created
+
+    def expansion(self, expansion_id):
+        """
+        :param expansion_id: ID of the expansion
+        :return: The Expansion entity or None
+        """
+        for expansions in self.expansions.values():
+            for expansion in expansions:
+                if expansion['idExpansion'] == expansion_id:
+                    return expansion
+        return None
+
+    def single_product_ids(self, expansion_id):
+        """
+        :param expansion_id: ID of the expansion
+        :return: array('q') of the product IDs of the expansion's singles or None if they are not in the bundle
+        """
+        return self.singles.get(expansion_id)
+
+    @classmethod
+    def build(cls, marketplace_info, game_ids=None, max_workers: int = 8, previous=None, recent_days: int = 30):
+        """
+        Downloads all games, their expansions and the singles of every expansion.
+
+        With a `previous` bundle only the singles of expansions that are new, changed or recent (see
+        is_recent_expansion()) are downloaded, the others are taken from the previous bundle. A request that
+        fails keeps the previous data of its game or expansion; expansions without previous data are left out.
+        The failed requests are listed in `failed` of the new bundle.
+
+        :param marketplace_info: MarketplaceInfo used for the requests, without a metadata store
+        :param game_ids: Only include the expansions of these games (optional; default: all games)
+        :param max_workers: Number of requests sent concurrently (default: 8)
+        :param previous: Bundle to update (optional)
+        :param recent_days: Expansions released less than this many days ago are always refreshed (default: 30)
+        :return: Returns a MetadataBundle
+        """
+        failed = {}
+        try:
+            games = get_entities(marketplace_info.get_games(), 'game')
+        except Exception as e:
+            if previous is None:
+                raise
+            games = previous.games
+            failed['games'] = str(e)
+        selected = [game['idGame'] for game in games if game_ids is None or game['idGame'] in game_ids]
+
+        expansions = {}
+        singles = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(marketplace_info.get_expansion, game_id): game_id for game_id in selected}
+            for future in as_completed(futures):
+                game_id = futures[future]
+                try:
+                    expansions[game_id] = get_entities(future.result(), 'expansion')
+                except Exception as e:
+                    failed[f'game:{game_id}'] = str(e)
+                    if previous is not None and game_id in previous.expansions:
+                        expansions[game_id] = previous.expansions[game_id]
+
+            to_fetch = []
+            for game_expansions in expansions.values():
+                for expansion in game_expansions:
+                    expansion_id = expansion['idExpansion']
+                    known = previous.single_product_ids(expansion_id) if previous is not None else None
+                    if known is None or previous.expansion(expansion_id) != expansion \
+                            or is_recent_expansion(expansion, recent_days):
+                        to_fetch.append(expansion_id)
+                    else:
+                        singles[expansion_id] = known
+
+            futures = {
+                executor.submit(marketplace_info.get_expansion_singles, expansion_id): expansion_id
+                for expansion_id in to_fetch
+            }
+            for future in as_completed(futures):
+                expansion_id = futures[future]
+                try:
+                    products = get_entities(future.result(), 'single')
+                    singles[expansion_id] = array('q', sorted(product['idProduct'] for product in products))
+                except Exception as e:
+                    failed[f'expansion:{expansion_id}'] = str(e)
+                    known = previous.single_product_ids(expansion_id) if previous is not None else None
+                    if known is not None:
+                        singles[expansion_id] = known
+
+        bundle = cls(games, expansions, singles)
+        bundle.failed = failed
+        return bundle
+
+    @classmethod
+    def from_expansion_snapshot(cls, crawler):
+        """
+        Builds a bundle from the snapshot of an ExpansionCrawler without any requests.
+
+        :param crawler: ExpansionCrawler whose snapshot is read
+        :return: Returns a MetadataBundle
+        """
+        expansions = {}
+        singles = {}
+        for expansion in crawler.expansions().values():
+            expansions.setdefault(expansion['idGame'], []).append(expansion)
+            products = crawler.singles(expansion['idExpansion'])
+            if products is not None:
+                singles[expansion['idExpansion']] = array('q', sorted(product['idProduct'] for product in products))
+        return cls(crawler.games(), expansions, singles)
+
+    def save(self, path):
+        """
+        Writes the bundle to a file, readers never see a half written file.
+
+        :param path: Path of the file
+        """
+        expansion_ids = list(self.singles)
+        document = json.dumps({
+            'games': self.games,
+            'expansions': [[game_id, expansions] for game_id, expansions in self.expansions.items()],
+            'languages': [[language_id, name] for language_id, name in self.languages.items()],
+            'singles': [[expansion_id, len(self.singles[expansion_id])] for expansion_id in expansion_ids],
+        }, separators=(',', ':')).encode('utf-8')
+        product_ids = array('q')
+        for expansion_id in expansion_ids:
+            product_ids.extend(self.singles[expansion_id])
+        if sys.byteorder == 'big':
+            product_ids.byteswap()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.created, len(document), len(product_ids)))
+            file.write(zlib.compress(document + product_ids.tobytes(), 6))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: Path of a file written by save()
+        :return: Returns the MetadataBundle or None if the file does not exist
+        """
+        try:
+            with open(path, 'rb') as file:
+                payload = file.read()
+        except FileNotFoundError:
+            return None
+        magic, version, created, document_length, product_count = HEADER.unpack_from(payload)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a metadata bundle of version {VERSION}.')
+        payload = zlib.decompress(payload[HEADER.size:])
+        document = json.loads(payload[:document_length])
+        product_ids = array('q')
+        product_ids.frombytes(payload[document_length:document_length + product_count * product_ids.itemsize])
+        if sys.byteorder == 'big':
+            product_ids.byteswap()
+
+        singles = {}
+        position = 0
+        for expansion_id, count in document['singles']:
+            singles[expansion_id] = product_ids[position:position + count]
+            position += count
+        return cls(
+            document['games'],
+            {game_id: expansions for game_id, expansions in document['expansions']},
+            singles,
+            {language_id: name for language_id, name in document['languages']},
+            created,
+        )
+
+
+class MetadataStore:
+    """
+    Keeps a metadata bundle file fresh and answers lookups from it.
+
+    The bundle is loaded from `path` at start. Once it is older than `max_age`, the next lookup starts a
+    background thread that updates the bundle (see MetadataBundle.build()), saves it and swaps it in; until then
+    the old bundle is served. After a failed update no new one is started for `retry_after` seconds.
+    Lookups of data missing from the bundle are sent to the API. Passed to Mkm or MarketplaceInfo, the store also
+    answers get_games() and get_expansion().
+
+        store = MetadataStore('metadata.bin', Mkm().resolve)
+        product_ids = store.single_product_ids(1469)
+        mkm = Mkm(metadata=store)
+        games = mkm.marketplace_info.get_games()
+    """
+
+    def __init__(
+            self, path, resolve, max_age: float = 24 * 3600, game_ids=None, max_workers: int = 8,
+            retry_after: float = 600
+    ):
+        """
+        :param path: Path of the bundle file
+        :param resolve: Resolve function used for the requests, e.g. mkm.resolve
+        :param max_age: Seconds after which the bundle is refreshed (default: 24 hours)
+        :param game_ids: Only include the expansions of these games (optional; default: all games)
+        :param max_workers: Number of requests sent concurrently while building (default: 8)
+        :param retry_after: Seconds to wait after a failed refresh before the next one (default: 600)
+        """
+        self.path = path
+        self.marketplace_info = MarketplaceInfo(resolve)
+        self.max_age = max_age
+        self.game_ids = game_ids
+        self.max_workers = max_workers
+        self.retry_after = retry_after
+        self.bundle = MetadataBundle.load(path)
+        self.last_error = None
+        self.last_failure = None
+        self._refreshing = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        :return: The current bundle (None if there is none yet), starts a refresh if it is missing or stale
+        """
+        bundle = self.bundle
+        if bundle is None or bundle.age > self.max_age:
+            if self.last_failure is None or time.monotonic() - self.last_failure >= self.retry_after:
+                self.refresh(wait=False)
+        return bundle
+
+    def games(self):
+        """
+        :return: List of all Game entities
+        """
+        bundle = self.current()
+        if bundle is not None:
+            return bundle.games
+        return get_entities(self.marketplace_info.get_games(), 'game')
+
+    def expansions(self, game_id: int):
+        """
+        :param game_id: ID of the game
+        :return: List of the Expansion entities of the game
+        """
+        bundle = self.current()
+        if bundle is not None and game_id in bundle.expansions:
+            return bundle.expansions[game_id]
+        return get_entities(self.marketplace_info.get_expansion(game_id), 'expansion')
+
+    def single_product_ids(self, expansion_id: int):
+        """
+        :param expansion_id: ID of the expansion
+        :return: array('q') of the product IDs of the expansion's singles
+        """
+        bundle = self.current()
+        product_ids = bundle.single_product_ids(expansion_id) if bundle is not None else None
+        if product_ids is not None:
+            return product_ids
+        products = get_entities(self.marketplace_info.get_expansion_singles(expansion_id), 'single')
+        return array('q', sorted(product['idProduct'] for product in products))
+
+    def refresh(self, wait: bool = True):
+        """
+        Updates the bundle unless a refresh is already running.
+
+        :param wait: Wait until the bundle is built (default: True)
+        """
+        with self._lock:
+            if self._refreshing is None or not self._refreshing.is_alive():
+                self._refreshing = threading.Thread(target=self._refresh, name='mkmapi-metadata', daemon=True)
+                self._refreshing.start()
+            thread = self._refreshing
+        if wait:
+            thread.join()
+
+    def _refresh(self):
+        try:
+            bundle = MetadataBundle.build(
+                self.marketplace_info, self.game_ids, self.max_workers, previous=self.bundle
+            )
+            bundle.save(self.path)
+        except Exception as e:
+            self.last_error = e
+            self.last_failure = time.monotonic()
+            return
+        self.bundle = bundle
+        self.last_error = None
+        self.last_failure = None
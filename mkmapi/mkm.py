@@ -6,12 +6,22 @@ from mkmapi.api_map.stock_management import StockManagement
 from mkmapi.api_map.wants_list_management import WantsListManagement
 from mkmapi.api_request import ApiRequest
 from mkmapi.mkm_xmlrequest_serializer import XMLSerializer
+from mkmapi.profiling import profiler
 
 
 class Mkm:
-    """Masterclass that holds all the API methods."""
+    """
+    Masterclass that holds all the API methods.
 
-    def __init__(self, app_token=None, app_secret=None, access_token=None, access_token_secret=None, sandbox=False):
+    An instance can be shared by several threads: requests keep their state (serialization, OAuth signature) on
+    the stack, only the connection pool is shared. Set `pool_size` to the number of threads so every thread can
+    keep a connection open.
+    """
+
+    def __init__(
+            self, app_token=None, app_secret=None, access_token=None, access_token_secret=None, sandbox=False,
+            session=None, transport=None, pool_size=None, metadata=None, timeout=None
+    ):
         """
         Initializes the auth variables and specifies sandbox or production mode.
         Omitted auth vars will be loaded from the environment variables.
@@ -22,6 +32,13 @@ class Mkm:
         :param access_token: Access token for the MKM account
         :param access_token_secret: Secret (key) for the MKM account token
         :param sandbox: False (default) to use the production API, True to use the sandbox api
+        :param session: requests.Session used to send the requests, e.g. to share a connection pool (optional)
+        :param transport: Transport that sends the requests, e.g. a ReplayTransport, see mkmapi.transport (optional)
+        :param pool_size: Number of connections kept open, e.g. the number of threads sharing the instance (optional)
+        :param metadata: MetadataStore answering games and expansions for marketplace_info, see mkmapi.metadata_bundle
+            (optional)
+        :param timeout: Seconds to wait for the server to connect or send data before a request fails
+            (optional; default: wait forever)
         """
         self.is_sandbox = sandbox
         self.api_request = ApiRequest(
@@ -29,10 +46,16 @@ class Mkm:
             app_secret=app_secret,
             access_token=access_token,
             access_token_secret=access_token_secret,
-            is_sandbox=self.is_sandbox
+            is_sandbox=self.is_sandbox,
+            session=session,
+            transport=transport,
+            pool_size=pool_size,
+            timeout=timeout
         )
+        self.serializer = XMLSerializer()
+        self.metadata = metadata
 
-    def resolve(self, request_method, resource_url, params=None, data=None):
+    def resolve(self, request_method, resource_url, params=None, data=None, stream=False):
         """
         Resolve and send a request to the MKM endpoint.
 
@@ -42,16 +65,34 @@ class Mkm:
         :param resource_url: URL that will be appended to the base endpoint URL
         :param params: A dictionary of query parameters for the request
         :param data: A dictionary that will be serialized to an MKM request object (see serializer class)
+        :param stream: True to return as soon as the headers arrived and download the body on demand,
+            see json_stream.iter_entities() (default: False)
         :return: Returns the response received from the server
         """
+        profiler.sample_request()
         if isinstance(data, dict):
-            serializer = XMLSerializer()
-            data = serializer.serialize(data)
+            with profiler.phase('serialize'):
+                data = self.serializer.serialize(data)
 
         if params is None:
             params = {}
 
-        return self.api_request.request(url=resource_url, method=request_method, params=params, data=data)
+        return self.api_request.request(
+            url=resource_url, method=request_method, params=params, data=data, stream=stream
+        )
+
+    def streaming_resolve(self, request_method, resource_url, params=None, data=None):
+        """
+        Same as resolve() in streaming mode. Pass it to an API map class to stream its responses, e.g.
+        StockManagement(mkm.streaming_resolve).get_stock(1)
+
+        :param request_method: GET, PUT, POST, DELETE, etc
+        :param resource_url: URL that will be appended to the base endpoint URL
+        :param params: A dictionary of query parameters for the request
+        :param data: A dictionary that will be serialized to an MKM request object (see serializer class)
+        :return: Returns the response received from the server, the body is not downloaded yet
+        """
+        return self.resolve(request_method, resource_url, params=params, data=data, stream=True)
 
     @property
     def account_management(self):
@@ -59,7 +100,7 @@ class Mkm:
 
     @property
     def marketplace_info(self):
-        return MarketplaceInfo(self.resolve)
+        return MarketplaceInfo(self.resolve, self.metadata)
 
     @property
     def order_management(self):
@@ -3,6 +3,8 @@ from urllib.parse import unquote
 from requests.utils import to_native_string
 from requests_oauthlib import OAuth1
 
+from mkmapi.profiling import profiler
+
 
 class MKMOAuth1(OAuth1):
     """
@@ -11,14 +13,15 @@ class MKMOAuth1(OAuth1):
     """
 
     def __call__(self, r):
-        r = super(MKMOAuth1, self).__call__(r)
+        with profiler.phase('sign'):
+            r = super(MKMOAuth1, self).__call__(r)
 
-        r.prepare_headers(r.headers)
+            r.prepare_headers(r.headers)
 
-        correct_signature = self.decode_signature(r.headers)
+            correct_signature = self.decode_signature(r.headers)
 
-        r.headers.__setitem__('Authorization', correct_signature)
-        r.url = to_native_string(r.url)
+            r.headers.__setitem__('Authorization', correct_signature)
+            r.url = to_native_string(r.url)
         return r
 
     @staticmethod
@@ -7,12 +7,10 @@ from mkmapi.exceptions import SerializationException
 class XMLSerializer:
     """
     Serializes data to XML for MKM requests.
+    The serializer keeps no state between calls, one instance can be shared by several threads.
     Original author: https://github.com/evonove
     """
 
-    def __init__(self):
-        self.generator = None
-
     def serialize(self, data):
         """
         Serializes data to XML so that it can be sent to backend, if data is not a dictionary.
@@ -26,22 +24,23 @@ class XMLSerializer:
             raise SerializationException("Can't serialize data, must be a dictionary.")
 
         stream = StringIO()
-        self.generator = XMLGenerator(stream, 'utf-8')
+        generator = XMLGenerator(stream, 'utf-8')
 
-        self.generator.startDocument()
-        self.generator.startElement('request', {})
+        generator.startDocument()
+        generator.startElement('request', {})
 
-        self._parse(data)
+        self._parse(generator, data)
 
-        self.generator.endElement('request')
-        self.generator.endDocument()
+        generator.endElement('request')
+        generator.endDocument()
 
         return stream.getvalue()
 
-    def _parse(self, data, previous_element_tag=None):
+    def _parse(self, generator, data, previous_element_tag=None):
         """
         Recursively parses data and creates the relative elements.
 
+        :param generator: XMLGenerator of the current serialization
         :param data: Data to parse
         :param previous_element_tag: When parsing a list we pass the previous element tag
         :return:
@@ -49,17 +48,17 @@ class XMLSerializer:
         if isinstance(data, dict):
             for key in data:
                 value = data[key]
-                self._parse(value, key)
+                self._parse(generator, value, key)
 
         elif isinstance(data, (list, tuple)):
             for item in data:
                 if isinstance(item, dict):
-                    self.generator.startElement(previous_element_tag, {})
-                self._parse(item, previous_element_tag)
+                    generator.startElement(previous_element_tag, {})
+                self._parse(generator, item, previous_element_tag)
                 if isinstance(item, dict):
-                    self.generator.endElement(previous_element_tag)
+                    generator.endElement(previous_element_tag)
 
         else:
-            self.generator.startElement(previous_element_tag, {})
-            self.generator.characters(f'{data}')
-            self.generator.endElement(previous_element_tag)
+            generator.startElement(previous_element_tag, {})
+            generator.characters(f'{data}')
+            generator.endElement(previous_element_tag)
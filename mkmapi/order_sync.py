@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+import zlib
+
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.paging import iterate_pages
+
+
+class OrderSync:
+    """
+    Incremental synchronisation of filter_orders(actor, state, start).
+
+    The sync remembers a signature of the state (state name and dates) of every order it has seen and,
+    for every actor/state pair, the newest order ID. Orders are returned by MKM with the most recently
+    changed orders first, so paging stops at the first known and unchanged order at or below the newest
+    order ID of the last sync. Without such a mark, paging stops once `stop_after_known` known and unchanged
+    orders were seen in a row. Only new orders and orders whose state changed since the last sync are returned.
+
+    Use sync(..., full=True) from time to time to page through the complete collection.
+    """
+
+    def __init__(self, mkm, state_path, stop_after_known: int = 100):
+        """
+        Initializes the sync.
+
+        :param mkm: Mkm instance used for the requests
+        :param state_path: Path of the file the sync state is stored in
+        :param stop_after_known: Number of known, unchanged orders in a row after which paging stops if there
+            is no newest order ID of a previous sync (default: 100, one full page)
+        """
+        self.mkm = mkm
+        self.state_path = state_path
+        self.stop_after_known = stop_after_known
+        self.state = read_json(state_path, default={'orders': {}, 'marks': {}})
+        self._lock = threading.Lock()
+
+    def sync(self, actor, state, full: bool = False):
+        """
+        Fetches the orders of an actor/state pair until known orders are reached.
+
+        :param actor: seller or 1, buyer or 2
+        :param state: bought or 1, paid or 2, sent or 4, received or 8, lost or 32, cancelled or 128
+        :param full: Page through all orders instead of stopping at known orders (default: False)
+        :return: Dictionary with the lists of `new` and `transitioned` orders
+        """
+        order_management = self.mkm.order_management
+        changes = {'new': [], 'transitioned': []}
+        signatures = {}
+        newest = None
+        known_in_a_row = 0
+        mark = None if full else self.newest_order(actor, state)
+        reached_mark = False
+
+        pages = iterate_pages(lambda start: order_management.filter_orders(actor, state, start), 'order')
+        for page in pages:
+            for order in page:
+                order_id = str(order['idOrder'])
+                signature = order_signature(order)
+                previous = self.state['orders'].get(order_id)
+                signatures[order_id] = signature
+                newest = order['idOrder'] if newest is None else max(newest, order['idOrder'])
+
+                if previous is None:
+                    changes['new'].append(order)
+                    known_in_a_row = 0
+                elif previous != signature:
+                    changes['transitioned'].append(order)
+                    known_in_a_row = 0
+                else:
+                    known_in_a_row += 1
+                    if mark is not None and order['idOrder'] <= mark:
+                        reached_mark = True
+                        break
+
+            if reached_mark or (not full and known_in_a_row >= self.stop_after_known):
+                break
+
+        with self._lock:
+            self.state['orders'].update(signatures)
+            mark = self.state['marks'].setdefault(f'{actor}/{state}', {'newest': None})
+            if newest is not None and (mark['newest'] is None or newest > mark['newest']):
+                mark['newest'] = newest
+            mark['synced'] = time.time()
+            atomic_write_json(self.state_path, self.state)
+        return changes
+
+    def newest_order(self, actor, state):
+        """
+        :param actor: seller or 1, buyer or 2
+        :param state: State of the orders, see sync()
+        :return: The highest order ID seen for the actor/state pair or None
+        """
+        return self.state['marks'].get(f'{actor}/{state}', {}).get('newest')
+
+
+def order_signature(order):
+    """
+    Computes a compact signature of the state of an order.
+
+    :param order: Order entity
+    :return: Returns a CRC32 of the order's state object (state name and dates)
+    """
+    state = json.dumps(order.get('state'), sort_keys=True, separators=(',', ':'))
+    return zlib.crc32(state.encode('utf-8'))
@@ -0,0 +1,158 @@
+import hashlib
+import json
+
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.response_parser import get_entities
+
+# ID field and fields compared per entity, e.g. a changed price or order state makes an entity changed
+KEY_FIELDS = {
+    'article': ('idArticle', 'idProduct', 'price', 'count', 'condition', 'isFoil', 'comments'),
+    'order': ('idOrder', 'state', 'articleCount', 'totalValue'),
+}
+
+
+def iterate_pages(fetch_page, key, start: int = 1, page_size: int = 100):
+    """
+    Iterates over a paginated collection like get_stock(start) or filter_orders(actor, state, start).
+
+    Paging stops with the first page that holds less than `page_size` entities (MKM answers the last page
+    with 200 instead of 206 and an empty collection with 204 No Content).
+
+    :param fetch_page: Callable that takes the start position and returns the response of the page
+    :param key: Name of the entities in the response, e.g. 'article' or 'order'
+    :param start: Position of the first entity (default: 1)
+    :param page_size: Number of entities per page (default: 100)
+    :return: Yields the list of entities of every page
+    """
+    while True:
+        entities = get_entities(fetch_page(start), key)
+        if entities:
+            yield entities
+        if len(entities) < page_size:
+            return
+        start += page_size
+
+
+class PageFingerprints:
+    """
+    Fingerprints of the entities of a paginated collection, kept between runs in a JSON file.
+
+    Every entity is stored by its ID (the first of its KEY_FIELDS) with a hash of its key fields, so entities are
+    recognized wherever they moved in the collection. In addition the hash of the raw body of every page is
+    stored, a page with the same body as last time is not parsed. See iterate_changed_pages().
+    """
+
+    def __init__(self, path, key_fields=None):
+        """
+        :param path: Path of the file
+        :param key_fields: ID field followed by the fields hashed per entity (default: KEY_FIELDS of the collection)
+        """
+        self.path = path
+        self.key_fields = key_fields
+        stored = read_json(path, default={})
+        self.page_size = stored.get('page_size')
+        self.pages = stored.get('pages', {})
+        self.entities = stored.get('entities', {})
+        self.stats = {}
+
+    def fields(self, key):
+        """
+        :param key: Name of the entities, e.g. 'article'
+        :return: Returns the ID field followed by the fields hashed per entity
+        """
+        fields = self.key_fields if self.key_fields is not None else KEY_FIELDS.get(key)
+        if fields is None:
+            raise ValueError(f'No key fields known for `{key}`, pass key_fields.')
+        return fields
+
+    def fingerprint(self, entity, fields):
+        """
+        :param entity: Entity of a page
+        :param fields: See fields()
+        :return: Returns a hash of the key fields of the entity
+        """
+        values = json.dumps([entity.get(field) for field in fields], sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(values.encode('utf-8'), digest_size=8).hexdigest()
+
+    def save(self):
+        atomic_write_json(self.path, {'page_size': self.page_size, 'pages': self.pages, 'entities': self.entities})
+
+
+def iterate_changed_pages(fetch_page, key, fingerprints, start: int = 1, page_size: int = 100, stop_after=None):
+    """
+    Iterates over the entities of a paginated collection that are new or changed since the last run.
+
+    Entities are matched by their ID, so an entity inserted at the front only makes that one entity new, even
+    though it shifts all following pages. A page whose raw body is the same as last time is not parsed. With
+    `stop_after`, paging stops after that many pages in a row whose entities were all known and unchanged,
+    which saves the requests for the rest of the collection. This suits collections that change at the front,
+    e.g. filter_orders() (newest orders first); changes behind the stable pages are found by the next full run.
+
+    The fingerprints of a page are recorded once the consumer asks for the next page, so the entities of a page
+    whose processing failed are yielded again in the next run. The fingerprints are saved when the iteration ends
+    or is closed. After a complete run, entities that are no longer in the collection are forgotten.
+    `fingerprints.stats` holds the number of pages `fetched` and `parsed`, the number of `yielded` entities and
+    whether paging `stopped_early`.
+
+    :param fetch_page: Callable that takes the start position and returns the response of the page
+    :param key: Name of the entities in the response, e.g. 'article' or 'order'
+    :param fingerprints: PageFingerprints of the collection
+    :param start: Position of the first entity (default: 1)
+    :param page_size: Number of entities per page (default: 100)
+    :param stop_after: Stop after this many pages in a row without new or changed entities (optional)
+    :return: Yields the list of new or changed entities of every page that has any
+    """
+    if fingerprints.page_size != page_size:
+        fingerprints.page_size = page_size
+        fingerprints.pages = {}
+    fields = fingerprints.fields(key)
+    stats = fingerprints.stats = {'fetched': 0, 'parsed': 0, 'yielded': 0, 'stopped_early': False}
+    seen = {}
+    complete = False
+    stable_pages = 0
+    try:
+        while True:
+            response = fetch_page(start)
+            stats['fetched'] += 1
+            body = response.content if response is not None and not isinstance(response, dict) else None
+            body_hash = hashlib.blake2b(body, digest_size=8).hexdigest() if body is not None else None
+            stored = fingerprints.pages.get(str(start))
+
+            if stored is not None and body_hash is not None and stored[0] == body_hash:
+                count = stored[1]
+                seen.update((entity_id, fingerprints.entities.get(entity_id)) for entity_id in stored[2])
+                stable_pages += 1
+            else:
+                entities = get_entities(response, key)
+                stats['parsed'] += 1
+                count = len(entities)
+                page = {str(entity.get(fields[0])): fingerprints.fingerprint(entity, fields) for entity in entities}
+                changed = [
+                    entity for entity in entities
+                    if fingerprints.entities.get(str(entity.get(fields[0]))) != page[str(entity.get(fields[0]))]
+                ]
+                if changed:
+                    stable_pages = 0
+                    stats['yielded'] += len(changed)
+                    yield changed
+                else:
+                    stable_pages += 1
+                fingerprints.entities.update(page)
+                fingerprints.pages[str(start)] = [body_hash, count, list(page)]
+                seen.update(page)
+
+            if count < page_size:
+                complete = True
+                fingerprints.pages = {
+                    position: page for position, page in fingerprints.pages.items() if int(position) <= start
+                }
+                return
+            if stop_after is not None and stable_pages >= stop_after:
+                stats['stopped_early'] = True
+                return
+            start += page_size
+    finally:
+        if complete:
+            fingerprints.entities = {entity_id: fingerprint for entity_id, fingerprint in seen.items()
+                                     if fingerprint is not None}
+        fingerprints.save()
@@ -0,0 +1,104 @@
+import math
+
+
+class ThresholdRule:
+    """A rule that fires when a price field moved by at least `percent` percent between two price guides."""
+
+    def __init__(self, field, percent, direction: str = 'any', min_price: float = None, name=None):
+        """
+        :param field: Price field, e.g. 'TREND' or 'LOW'
+        :param percent: Minimum relative change in percent, e.g. 10 for 10%
+        :param direction: up, down or any (default: any)
+        :param min_price: Ignore products that cost less than this before and after the change (optional)
+        :param name: Name reported with every match (default: field, direction and percent)
+        """
+        if direction not in ('up', 'down', 'any'):
+            raise ValueError('direction must be up, down or any.')
+        self.field = field
+        self.percent = percent
+        self.direction = direction
+        self.min_price = min_price
+        self.name = name if name is not None else f'{field} {direction} {percent}%'
+
+    def matches(self, changes, old_prices, new_prices):
+        """
+        Evaluates the rule on aligned columns.
+
+        :param changes: Relative changes of the field (NaN where undefined)
+        :param old_prices: Old prices of the field
+        :param new_prices: New prices of the field
+        :return: Returns the positions matching the rule
+        """
+        threshold = self.percent / 100
+        if self.direction == 'up':
+            positions = [position for position, change in enumerate(changes) if change >= threshold]
+        elif self.direction == 'down':
+            positions = [position for position, change in enumerate(changes) if change <= -threshold]
+        else:
+            positions = [position for position, change in enumerate(changes) if abs(change) >= threshold]
+        if self.min_price is not None:
+            positions = [
+                position for position in positions
+                if max(old_prices[position], new_prices[position]) >= self.min_price
+            ]
+        return positions
+
+
+def diff_price_guides(old, new, rules):
+    """
+    Compares two price guides and evaluates all threshold rules.
+
+    The rows of both guides are aligned once, then the relative change of every field used by a rule is computed
+    column by column and shared by all rules on that field. Products missing in one of the guides and missing
+    prices are ignored.
+
+    :param old: PriceGuide of the earlier snapshot
+    :param new: PriceGuide of the later snapshot
+    :param rules: Iterable of ThresholdRule
+    :return: Returns a list of dictionaries with idProduct, rule, field, old, new and change (in percent),
+        sorted by idProduct
+    """
+    if old.product_ids == new.product_ids:
+        product_ids = old.product_ids
+        old_positions = new_positions = None
+    else:
+        new_index = {product_id: position for position, product_id in enumerate(new.product_ids)}
+        pairs = [
+            (product_id, position, new_index[product_id])
+            for position, product_id in enumerate(old.product_ids) if product_id in new_index
+        ]
+        product_ids = [product_id for product_id, _, _ in pairs]
+        old_positions = [position for _, position, _ in pairs]
+        new_positions = [position for _, _, position in pairs]
+
+    columns = {}
+    alerts = []
+    for rule in rules:
+        if rule.field not in old.columns or rule.field not in new.columns:
+            continue
+        if rule.field not in columns:
+            old_prices = _aligned(old.columns[rule.field], old_positions)
+            new_prices = _aligned(new.columns[rule.field], new_positions)
+            changes = [
+                (after - before) / before if before > 0 else math.nan
+                for before, after in zip(old_prices, new_prices)
+            ]
+            columns[rule.field] = (changes, old_prices, new_prices)
+
+        changes, old_prices, new_prices = columns[rule.field]
+        for position in rule.matches(changes, old_prices, new_prices):
+            alerts.append({
+                'idProduct': product_ids[position],
+                'rule': rule.name,
+                'field': rule.field,
+                'old': old_prices[position],
+                'new': new_prices[position],
+                'change': round(changes[position] * 100, 2),
+            })
+
+    alerts.sort(key=lambda alert: alert['idProduct'])
+    return alerts
+
+
+def _aligned(column, positions):
+    return column if positions is None else [column[position] for position in positions]
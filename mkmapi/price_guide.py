@@ -0,0 +1,195 @@
+import json
+import math
+import re
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from mkmapi.gzip_csv import decode_file, read_csv
+from mkmapi.response_parser import get_entities
+
+# Column names of the price guide CSV file mapped to the keys MKM uses for the priceGuide of a product
+PRICE_GUIDE_FIELDS = {
+    'Avg. Sell Price': 'SELL',
+    'Low Price': 'LOW',
+    'Trend Price': 'TREND',
+    'German Pro Low': 'GERMANPROLOW',
+    'Suggested Price': 'SUGGESTED',
+    'Foil Sell': 'FOILSELL',
+    'Foil Low': 'LOWFOIL',
+    'Foil Trend': 'TRENDFOIL',
+    'Low Price Ex+': 'LOWEX',
+    'AVG1': 'AVG1',
+    'AVG7': 'AVG7',
+    'AVG30': 'AVG30',
+    'Foil AVG1': 'FOILAVG1',
+    'Foil AVG7': 'FOILAVG7',
+    'Foil AVG30': 'FOILAVG30',
+}
+
+
+class PriceGuide:
+    """
+    Price guide as a columnar table.
+
+    Rows are sorted by product ID. `product_ids` and `game_ids` are arrays of integers and every price field
+    (see PRICE_GUIDE_FIELDS) is an array of floats in `columns`, missing prices are NaN.
+    """
+
+    def __init__(self, product_ids, game_ids, columns):
+        """
+        :param product_ids: array('q') of product IDs, sorted
+        :param game_ids: array('q') with the game ID of every row
+        :param columns: Dictionary mapping field names to array('d') of prices
+        """
+        self.product_ids = product_ids
+        self.game_ids = game_ids
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    @property
+    def fields(self):
+        return list(self.columns)
+
+    def position(self, product_id):
+        """
+        :param product_id: ID of the product
+        :return: Row of the product or None if the product is not in the price guide
+        """
+        position = bisect_left(self.product_ids, product_id)
+        if position < len(self.product_ids) and self.product_ids[position] == product_id:
+            return position
+        return None
+
+    def get(self, product_id, field, default=None):
+        """
+        :param product_id: ID of the product
+        :param field: Price field, e.g. 'TREND'
+        :param default: Returned if the product or the price is missing
+        :return: The price
+        """
+        position = self.position(product_id)
+        if position is None or field not in self.columns:
+            return default
+        value = self.columns[field][position]
+        return default if math.isnan(value) else value
+
+    def row(self, product_id):
+        """
+        :param product_id: ID of the product
+        :return: Dictionary with idProduct, idGame and all price fields or None if the product is missing
+        """
+        position = self.position(product_id)
+        if position is None:
+            return None
+        row = {'idProduct': self.product_ids[position], 'idGame': self.game_ids[position]}
+        row.update((field, column[position]) for field, column in self.columns.items())
+        return row
+
+    @classmethod
+    def concat(cls, guides):
+        """
+        Combines several price guides (e.g. of different games) into one table.
+
+        :param guides: Iterable of PriceGuide
+        :return: Returns a new PriceGuide
+        """
+        guides = list(guides)
+        if len(guides) == 1:
+            return guides[0]
+        fields = list(dict.fromkeys(field for guide in guides for field in guide.columns))
+
+        # Games use separate product ID ranges, usually the tables can simply be appended
+        guides = sorted((guide for guide in guides if len(guide)), key=lambda guide: guide.product_ids[0])
+        if all(previous.product_ids[-1] < guide.product_ids[0] for previous, guide in zip(guides, guides[1:])):
+            columns = {field: array('d') for field in fields}
+            for guide in guides:
+                for field, column in columns.items():
+                    column.extend(guide.columns.get(field) or array('d', [math.nan]) * len(guide))
+            return cls(
+                array('q', b''.join(guide.product_ids.tobytes() for guide in guides)),
+                array('q', b''.join(guide.game_ids.tobytes() for guide in guides)),
+                columns,
+            )
+
+        rows = sorted(
+            (product_id, number, position)
+            for number, guide in enumerate(guides)
+            for position, product_id in enumerate(guide.product_ids)
+        )
+        product_ids = array('q', (row[0] for row in rows))
+        game_ids = array('q', (guides[number].game_ids[position] for _, number, position in rows))
+        columns = {}
+        for field in fields:
+            sources = [guide.columns.get(field) for guide in guides]
+            columns[field] = array('d', (
+                sources[number][position] if sources[number] is not None else math.nan
+                for _, number, position in rows
+            ))
+        return cls(product_ids, game_ids, columns)
+
+
+def parse_price_guide(content, game_id: int = 1):
+    """
+    Decodes a price guide response body: JSON, Base64, gzip and CSV.
+    This is a top level function so that it can run in a process pool.
+
+    :param content: Body of the get_price_guide() response (bytes)
+    :param game_id: ID of the game the price guide is for (default: 1)
+    :return: Returns a PriceGuide
+    """
+    encoded = json.loads(content)['priceguidefile']
+    header, rows = read_csv(decode_file(encoded))
+    fields = [PRICE_GUIDE_FIELDS.get(name, re.sub(r'[^A-Z0-9]', '', name.upper())) for name in header[1:]]
+    # Transposing the rows lets every column be converted by one comprehension
+    values = list(zip(*(row for row in rows if row)))
+    if not values:
+        values = [()] * (len(fields) + 1)
+    product_ids = array('q', map(int, values[0]))
+    columns = {
+        field: array('d', [float(value or 'nan') for value in column]) for field, column in zip(fields, values[1:])
+    }
+
+    if any(previous > current for previous, current in zip(product_ids, product_ids[1:])):
+        order = sorted(range(len(product_ids)), key=product_ids.__getitem__)
+        product_ids = array('q', (product_ids[position] for position in order))
+        columns = {field: array('d', (column[position] for position in order)) for field, column in columns.items()}
+    return PriceGuide(product_ids, array('q', [game_id]) * len(product_ids), columns)
+
+
+def ingest_price_guides(mkm, game_ids=None, max_workers: int = 4, processes: int = None):
+    """
+    Downloads the price guides of several games concurrently and decodes them in a process pool.
+
+    Every file is handed to the process pool as soon as its download finished, so downloading and decoding
+    overlap and the total time is close to the time of the largest game.
+
+    :param mkm: Mkm instance used for the requests
+    :param game_ids: IDs of the games (default: all games returned by get_games())
+    :param max_workers: Number of concurrent downloads (default: 4)
+    :param processes: Number of decoding processes (default: number of CPUs; 0 decodes in this process)
+    :return: Returns a PriceGuide with the prices of all games
+    """
+    marketplace_info = mkm.marketplace_info
+    if game_ids is None:
+        game_ids = [game['idGame'] for game in get_entities(marketplace_info.get_games(), 'game')]
+
+    guides = []
+    decoder = ProcessPoolExecutor(max_workers=processes) if processes != 0 else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as downloader:
+            downloads = {downloader.submit(marketplace_info.get_price_guide, game_id): game_id for game_id in game_ids}
+            decoded = []
+            for download in as_completed(downloads):
+                content = download.result().content
+                if decoder is None:
+                    guides.append(parse_price_guide(content, downloads[download]))
+                else:
+                    decoded.append(decoder.submit(parse_price_guide, content, downloads[download]))
+            guides.extend(future.result() for future in decoded)
+    finally:
+        if decoder is not None:
+            decoder.shutdown()
+    return PriceGuide.concat(guides)
@@ -0,0 +1,246 @@
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.price_guide import PriceGuide
+
+MAGIC = b'MKPH'
+VERSION = 1
+MISSING = -(2 ** 31)
+GAME_FIELD = '_GAME'
+
+
+class PriceHistory:
+    """
+    Stores a series of price guide snapshots compactly.
+
+    Prices are stored as integer cents. Every snapshot file only holds the (idProduct, field) values that
+    changed since the previous snapshot, column by column: the sorted product IDs of a field are delta
+    encoded and the whole file is zlib compressed. Every `keyframe_interval` snapshots a full keyframe is
+    written, so any snapshot is rebuilt from the last keyframe plus at most `keyframe_interval - 1` deltas.
+
+    Time range queries for a set of products only look up those products in every file of the range
+    (binary search in the ID column), they never rebuild full snapshots.
+    """
+
+    def __init__(self, directory, keyframe_interval: int = 24):
+        """
+        Opens or creates a history.
+
+        :param directory: Directory of the history
+        :param keyframe_interval: Number of snapshots between two full keyframes (default: 24)
+        """
+        self.directory = directory
+        self.keyframe_interval = keyframe_interval
+        self.index = read_json(self._index_path, default=[])
+        self._last_state = None
+        self._lock = threading.Lock()
+        self._load = lru_cache(maxsize=64)(self._read_file)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    @property
+    def timestamps(self):
+        return [entry['timestamp'] for entry in self.index]
+
+    def append(self, price_guide, timestamp=None):
+        """
+        Adds a snapshot to the history.
+
+        :param price_guide: PriceGuide of the snapshot
+        :param timestamp: UNIX timestamp of the snapshot (default: now), must be later than the last snapshot
+        :return: Returns the number of (idProduct, field) values written
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self.index and timestamp <= self.index[-1]['timestamp']:
+                raise ValueError('Snapshots must be appended in chronological order.')
+            state = _state_from_guide(price_guide)
+            keyframe = len(self.index) % self.keyframe_interval == 0
+            if keyframe:
+                changes = {field: sorted(values.items()) for field, values in state.items()}
+            else:
+                previous = self._last_state if self._last_state is not None else self._rebuild(len(self.index) - 1)
+                changes = _changes(previous, state)
+
+            file_name = f'{len(self.index):08d}.bin'
+            _write_file(os.path.join(self.directory, file_name), changes)
+            self.index.append({'timestamp': timestamp, 'file': file_name, 'keyframe': keyframe})
+            atomic_write_json(self._index_path, self.index)
+            self._last_state = state
+            return sum(len(values) for values in changes.values())
+
+    def snapshot(self, timestamp=None):
+        """
+        Rebuilds the snapshot valid at a point in time.
+
+        :param timestamp: UNIX timestamp (default: the latest snapshot)
+        :return: Returns a PriceGuide or None if there is no snapshot at or before `timestamp`
+        """
+        position = len(self.index) - 1 if timestamp is None else bisect_right(self.timestamps, timestamp) - 1
+        if position < 0:
+            return None
+        return _guide_from_state(self._rebuild(position))
+
+    def query(self, product_ids, start=None, end=None, fields=None):
+        """
+        Returns the price changes of products within a time range.
+
+        :param product_ids: A product ID or an iterable of product IDs
+        :param start: UNIX timestamp of the start of the range (default: first snapshot)
+        :param end: UNIX timestamp of the end of the range (default: last snapshot)
+        :param fields: Price fields to return (default: all)
+        :return: Dictionary mapping product IDs to a dictionary mapping fields to lists of (timestamp, price)
+            tuples. The first tuple is the price valid at `start`, then one tuple per change. Missing prices are None.
+        """
+        if isinstance(product_ids, int):
+            product_ids = [product_ids]
+        product_ids = sorted(set(product_ids))
+        timestamps = self.timestamps
+        first = 0 if start is None else max(0, bisect_right(timestamps, start) - 1)
+        last = len(self.index) - 1 if end is None else bisect_right(timestamps, end) - 1
+        if last < first or not self.index:
+            return {product_id: {} for product_id in product_ids}
+
+        first_keyframe = max(position for position in range(first + 1) if self.index[position]['keyframe'])
+        result = {product_id: {} for product_id in product_ids}
+        for position in range(first_keyframe, last + 1):
+            entry = self.index[position]
+            point = entry['timestamp'] if start is None else max(entry['timestamp'], start)
+            for field, (ids, values) in self._load(entry['file']).items():
+                if field == GAME_FIELD or (fields is not None and field not in fields):
+                    continue
+                for product_id in product_ids:
+                    found = bisect_left(ids, product_id)
+                    if entry['keyframe']:
+                        value = values[found] if found < len(ids) and ids[found] == product_id else MISSING
+                    elif found < len(ids) and ids[found] == product_id:
+                        value = values[found]
+                    else:
+                        continue
+                    series = result[product_id].setdefault(field, [])
+                    price = None if value == MISSING else value / 100
+                    if position <= first and series:
+                        series[-1] = (point, price)
+                    elif not series or series[-1][1] != price:
+                        series.append((point, price))
+        return result
+
+    def _rebuild(self, position):
+        keyframe = max(number for number in range(position + 1) if self.index[number]['keyframe'])
+        state = {}
+        for number in range(keyframe, position + 1):
+            for field, (ids, values) in self._load(self.index[number]['file']).items():
+                column = state.setdefault(field, {})
+                for product_id, value in zip(ids, values):
+                    if value == MISSING:
+                        column.pop(product_id, None)
+                    else:
+                        column[product_id] = value
+        return state
+
+    def _read_file(self, file_name):
+        with open(os.path.join(self.directory, file_name), 'rb') as file:
+            payload = zlib.decompress(file.read())
+        magic, version, header_length = struct.unpack_from('<4sBI', payload)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{file_name} is not a price history file of version {VERSION}.')
+        offset = struct.calcsize('<4sBI')
+        header = json.loads(payload[offset:offset + header_length])
+        offset += header_length
+
+        columns = {}
+        for field, count in zip(header['fields'], header['counts']):
+            deltas = _read_array('q', payload, offset, count)
+            offset += count * 8
+            values = _read_array('i', payload, offset, count)
+            offset += count * 4
+            columns[field] = (array('q', accumulate(deltas)), values)
+        return columns
+
+
+def _state_from_guide(price_guide):
+    """Converts a PriceGuide to a dictionary of field -> {idProduct: cents}, missing prices are left out."""
+    state = {GAME_FIELD: dict(zip(price_guide.product_ids, price_guide.game_ids))}
+    for field, column in price_guide.columns.items():
+        state[field] = {
+            product_id: round(value * 100)
+            for product_id, value in zip(price_guide.product_ids, column) if not math.isnan(value)
+        }
+    return state
+
+
+def _guide_from_state(state):
+    product_ids = sorted(set().union(*state.values()))
+    games = state.get(GAME_FIELD, {})
+    columns = {
+        field: array('d', (
+            values[product_id] / 100 if product_id in values else math.nan for product_id in product_ids
+        ))
+        for field, values in state.items() if field != GAME_FIELD
+    }
+    game_ids = array('q', (games.get(product_id, 0) for product_id in product_ids))
+    return PriceGuide(array('q', product_ids), game_ids, columns)
+
+
+def _changes(previous, state):
+    """Changed (idProduct, cents) pairs per field, removed prices are MISSING."""
+    changes = {}
+    for field in set(previous) | set(state):
+        old = previous.get(field, {})
+        new = state.get(field, {})
+        changed = [(product_id, value) for product_id, value in new.items() if old.get(product_id) != value]
+        changed.extend((product_id, MISSING) for product_id in old.keys() - new.keys())
+        if changed:
+            changes[field] = sorted(changed)
+    return changes
+
+
+def _write_file(path, changes):
+    fields = list(changes)
+    header = json.dumps({'fields': fields, 'counts': [len(changes[field]) for field in fields]}).encode('utf-8')
+    parts = [struct.pack('<4sBI', MAGIC, VERSION, len(header)), header]
+    for field in fields:
+        deltas = array('q')
+        values = array('i')
+        previous = 0
+        for product_id, value in changes[field]:
+            deltas.append(product_id - previous)
+            values.append(value)
+            previous = product_id
+        parts.append(_to_bytes(deltas))
+        parts.append(_to_bytes(values))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(zlib.compress(b''.join(parts), 6))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _to_bytes(values):
+    """Serializes an array in little endian byte order."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(typecode, payload, offset, count):
+    values = array(typecode)
+    values.frombytes(payload[offset:offset + count * values.itemsize])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from mkmapi.exceptions import QuotaExhausted
+
+HIGH = 'high'
+NORMAL = 'normal'
+LOW = 'low'
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+
+class _PriorityClass:
+
+    def __init__(self, rank):
+        self.rank = rank
+        self.queue = deque()
+        self.running = 0
+        self.completed = 0
+        self.delays = deque(maxlen=1000)
+
+
+class PriorityDispatcher:
+    """
+    Dispatch queue in front of a resolve function (see Mkm.resolve) that serves interactive requests before
+    background traffic.
+
+    Every request is queued in its priority class (high, normal, low) and sent by a shared set of worker threads:
+        dispatcher = PriorityDispatcher(mkm.resolve)
+        cart = ShoppingCartManipulation(dispatcher.resolver('high'))
+        crawler = MarketplaceInfo(dispatcher.resolver('low'))
+
+    - `reserved_workers` workers only ever send high priority requests, so they never wait for a busy pool.
+    - With a RateLimiter, normal and low priority requests fail with QuotaExhausted once the remaining quota drops
+      to `reserved_quota`; the rest of the quota is kept for high priority requests.
+    - Against starvation a waiting request moves up one class every `aging_seconds`.
+    """
+
+    def __init__(
+            self, resolve, max_workers: int = 8, reserved_workers: int = 2, aging_seconds: float = 5.0,
+            rate_limiter=None, reserved_quota: int = 0
+    ):
+        """
+        Initializes the dispatcher and starts the worker threads.
+
+        :param resolve: Resolve function that sends the requests, e.g. mkm.resolve
+        :param max_workers: Number of worker threads (default: 8)
+        :param reserved_workers: Number of workers reserved for high priority requests (default: 2)
+        :param aging_seconds: Seconds of waiting after which a request is treated one class higher (default: 5)
+        :param rate_limiter: RateLimiter every request goes through (optional)
+        :param reserved_quota: Requests of the quota reserved for high priority requests (default: 0)
+        """
+        if not 0 <= reserved_workers < max_workers:
+            raise ValueError('reserved_workers must be at least 0 and less than max_workers.')
+        self.resolve = rate_limiter.wrap(resolve) if rate_limiter is not None else resolve
+        self.rate_limiter = rate_limiter
+        self.max_workers = max_workers
+        self.reserved_workers = reserved_workers
+        self.aging_seconds = aging_seconds
+        self.reserved_quota = reserved_quota
+
+        self._classes = {priority: _PriorityClass(rank) for rank, priority in enumerate(PRIORITIES)}
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._workers = [
+            threading.Thread(
+                target=self._work, args=(number < reserved_workers,), name=f'mkmapi-dispatch-{number}', daemon=True
+            )
+            for number in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, priority, request_method, resource_url, params=None, data=None, **kwargs):
+        """
+        Queues a request.
+
+        :param priority: high, normal or low
+        :param request_method: GET, PUT, POST, DELETE, etc
+        :param resource_url: URL that will be appended to the base endpoint URL
+        :param params: A dictionary of query parameters for the request
+        :param data: A dictionary that will be serialized to an MKM request object
+        :return: Returns a concurrent.futures.Future with the response
+        """
+        if priority not in self._classes:
+            raise ValueError(f'Priority must be one of {PRIORITIES}.')
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('The dispatcher is shut down.')
+            request = (request_method, resource_url, params, data, kwargs)
+            self._classes[priority].queue.append((time.monotonic(), future, request))
+            # Reserved workers can't take every request, wake them all
+            self._condition.notify_all()
+        return future
+
+    def resolver(self, priority):
+        """
+        :param priority: high, normal or low
+        :return: Returns a resolve function that sends its requests with `priority` and waits for the response,
+            it can be passed to the API map classes
+        """
+        if priority not in self._classes:
+            raise ValueError(f'Priority must be one of {PRIORITIES}.')
+
+        def prioritized_resolve(request_method, resource_url, params=None, data=None, **kwargs):
+            return self.submit(priority, request_method, resource_url, params=params, data=data, **kwargs).result()
+
+        return prioritized_resolve
+
+    def stats(self):
+        """
+        :return: Dictionary mapping every priority to its number of `queued`, `running` and `completed` requests
+            and the queueing delay in seconds of its last 1000 requests (`delay_mean`, `delay_p95`, `delay_max`)
+        """
+        with self._condition:
+            stats = {}
+            for priority, queue_class in self._classes.items():
+                delays = sorted(queue_class.delays)
+                stats[priority] = {
+                    'queued': len(queue_class.queue),
+                    'running': queue_class.running,
+                    'completed': queue_class.completed,
+                    'delay_mean': sum(delays) / len(delays) if delays else 0.0,
+                    'delay_p95': delays[int(0.95 * (len(delays) - 1))] if delays else 0.0,
+                    'delay_max': delays[-1] if delays else 0.0,
+                }
+            return stats
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the workers once all queued requests are sent.
+
+        :param wait: Wait for the workers to finish (default: True)
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _next_request(self, reserved):
+        """Picks the queued request with the best aged rank, returns the job or the seconds to wait for one."""
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.time_until_available()
+            if delay > 0:
+                return delay
+
+        now = time.monotonic()
+        best = None
+        for priority, queue_class in self._classes.items():
+            if not queue_class.queue:
+                continue
+            if reserved and priority != HIGH:
+                continue
+            queued_at = queue_class.queue[0][0]
+            rank = queue_class.rank - int((now - queued_at) / self.aging_seconds)
+            if best is None or (rank, queued_at) < best[0]:
+                best = ((rank, queued_at), queue_class, priority)
+        if best is None:
+            return None
+
+        _, queue_class, priority = best
+        queued_at, future, request = queue_class.queue.popleft()
+        queue_class.delays.append(now - queued_at)
+        queue_class.running += 1
+        return queue_class, priority, future, request
+
+    def _work(self, reserved):
+        while True:
+            with self._condition:
+                while True:
+                    job = self._next_request(reserved)
+                    if isinstance(job, tuple):
+                        break
+                    if self._shutdown and not any(queue_class.queue for queue_class in self._classes.values()):
+                        return
+                    self._condition.wait(timeout=job)
+
+            queue_class, priority, future, (request_method, resource_url, params, data, kwargs) = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    remaining = self.rate_limiter.remaining if self.rate_limiter is not None else None
+                    if priority != HIGH and remaining is not None and remaining <= self.reserved_quota:
+                        raise QuotaExhausted(self.rate_limiter.limit_max)
+                    future.set_result(
+                        self.resolve(request_method, resource_url, params=params, data=data, **kwargs)
+                    )
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._condition:
+                queue_class.running -= 1
+                queue_class.completed += 1
+                self._condition.notify_all()
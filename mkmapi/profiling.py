@@ -0,0 +1,183 @@
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+PHASES = ('serialize', 'sign', 'network', 'parse')
+
+
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.stack = self.profiler._stack()
+        self.children_wall = self.children_cpu = 0.0
+        self.children_allocated = 0
+        self.stack.append(self)
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory if self.memory is not None else 0
+        self.stack.pop()
+        if self.stack:
+            self.stack[-1].children_wall += wall
+            self.stack[-1].children_cpu += cpu
+            self.stack[-1].children_allocated += allocated
+        self.profiler._record(
+            self.name, wall - self.children_wall, cpu - self.children_cpu, allocated - self.children_allocated
+        )
+        return False
+
+
+class Profiler:
+    """
+    Opt-in profiler for the request path.
+
+    Every sampled request is split into phases: serialize (XML body), sign (OAuth signature), network
+    (sending and receiving, without signing) and parse (decoding the JSON response with response_parser).
+    For every phase the wall time, the CPU time of the thread and, with memory tracing, the net allocated memory
+    are summed up. Nested phases are only counted once, the time of `sign` is not part of `network`.
+
+    Profiling is switched on with the environment variable MKMAPI_PROFILE (the share of requests to sample, e.g.
+    1 or 0.1) or at runtime with enable(). MKMAPI_PROFILE_MEMORY=1 also traces allocations, which is slow.
+    With the environment variable the report is printed to stderr when the process exits.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._requests = 0
+
+    def enable(self, sample_rate: float = 1.0, trace_memory: bool = False):
+        """
+        :param sample_rate: Share of requests to profile, from 0 to 1 (default: 1)
+        :param trace_memory: Also measure allocated memory with tracemalloc (default: False)
+        """
+        self.sample_rate = sample_rate
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+            self._requests = 0
+
+    def sample_request(self):
+        """
+        Decides whether the request the current thread is about to send is profiled.
+        The decision also applies to parsing its response, until the thread sends the next request.
+        """
+        if not self.enabled:
+            return
+        sampled = random.random() < self.sample_rate
+        self._local.sampled = sampled
+        if sampled:
+            with self._lock:
+                self._requests += 1
+
+    def phase(self, name):
+        """
+        :param name: Name of the phase, see PHASES
+        :return: Returns a context manager that measures the phase if the current request is sampled
+        """
+        if not self.enabled or not getattr(self._local, 'sampled', False):
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def stats(self):
+        """
+        :return: Dictionary mapping phases to their number of `calls`, `wall` and `cpu` seconds and
+            `allocated` bytes
+        """
+        with self._lock:
+            return {name: dict(values) for name, values in self._totals.items()}
+
+    def report(self):
+        """
+        :return: Returns a table of the phases with their share of the total wall time
+        """
+        stats = self.stats()
+        total_wall = sum(values['wall'] for values in stats.values()) or 1e-9
+        lines = [
+            f'mkmapi profile: {self._requests} sampled requests',
+            f'{"phase":<10} {"calls":>8} {"wall ms":>10} {"ms/call":>8} {"cpu ms":>10} {"share":>6} {"alloc KiB":>10}',
+        ]
+        names = [name for name in PHASES if name in stats] + [name for name in stats if name not in PHASES]
+        for name in names:
+            values = stats[name]
+            lines.append(
+                f'{name:<10} {values["calls"]:>8} {values["wall"] * 1000:>10.1f} '
+                f'{values["wall"] * 1000 / values["calls"]:>8.3f} {values["cpu"] * 1000:>10.1f} '
+                f'{values["wall"] / total_wall:>6.1%} {values["allocated"] / 1024:>10.1f}'
+            )
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        """
+        Writes the report to a file or to stderr.
+
+        :param path: Path of the file (default: stderr)
+        """
+        if path is None:
+            print(self.report(), file=sys.stderr)
+        else:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(self.report() + '\n')
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name, wall, cpu, allocated):
+        with self._lock:
+            values = self._totals.get(name)
+            if values is None:
+                values = self._totals[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'allocated': 0}
+            values['calls'] += 1
+            values['wall'] += wall
+            values['cpu'] += cpu
+            values['allocated'] += allocated
+
+
+profiler = Profiler()
+
+if os.environ.get('MKMAPI_PROFILE'):
+    profiler.enable(
+        sample_rate=float(os.environ['MKMAPI_PROFILE']),
+        trace_memory=os.environ.get('MKMAPI_PROFILE_MEMORY') == '1',
+    )
+    atexit.register(profiler.dump)
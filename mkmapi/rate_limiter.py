@@ -0,0 +1,127 @@
+import threading
+import time
+
+from mkmapi.exceptions import MKMConnectionError, QuotaExhausted
+
+
+class RateLimiter:
+    """
+    Thread-safe request budget.
+
+    Limits the request rate with a token bucket and keeps track of the account's request quota.
+    MKM reports the quota with the X-Request-Limit-Max and X-Request-Limit-Count headers of every response,
+    the limiter reads them to stay in sync with the server.
+    """
+
+    def __init__(self, requests_per_second: float = None, burst: int = 1, daily_limit: int = None, reserve: int = 0):
+        """
+        Initializes the limiter.
+
+        :param requests_per_second: Maximum request rate (optional; default: unlimited)
+        :param burst: Number of requests that can be sent at once before the rate applies (default: 1)
+        :param daily_limit: Request quota of the account if known in advance (optional; updated from responses)
+        :param reserve: Number of requests of the quota that are never used by this limiter (default: 0)
+        """
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.limit_max = daily_limit
+        self.limit_count = 0
+        self.reserve = reserve
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        """
+        :return: Remaining requests of the quota or None if the quota is unknown
+        """
+        if self.limit_max is None:
+            return None
+        return max(0, self.limit_max - self.limit_count - self.reserve)
+
+    def acquire(self, blocking: bool = True):
+        """
+        Takes one request from the budget.
+
+        :raise QuotaExhausted: If the quota is used up
+        :param blocking: Wait until the rate allows another request (default: True)
+        :return: True if the request can be sent, False if `blocking` is False and the rate is exceeded
+        """
+        while True:
+            with self._lock:
+                if self.remaining == 0:
+                    raise QuotaExhausted(self.limit_max)
+                wait = self._take_token()
+                if wait == 0:
+                    self.limit_count += 1
+                    return True
+            if not blocking:
+                return False
+            time.sleep(wait)
+
+    def time_until_available(self):
+        """
+        :return: Seconds until the rate allows the next request (0 if a request can be sent now)
+        """
+        with self._lock:
+            self._refill()
+            if self.requests_per_second is None or self._tokens >= 1:
+                return 0
+            return (1 - self._tokens) / self.requests_per_second
+
+    def update(self, response):
+        """
+        Synchronizes the quota with the headers of a response.
+
+        :param response: Response received from the server
+        """
+        headers = getattr(response, 'headers', None)
+        if not headers:
+            return
+        limit_max = headers.get('X-Request-Limit-Max')
+        limit_count = headers.get('X-Request-Limit-Count')
+        with self._lock:
+            if limit_max is not None:
+                self.limit_max = int(limit_max)
+            if limit_count is not None:
+                self.limit_count = int(limit_count)
+            if getattr(response, 'status_code', None) == 429 and self.limit_max is not None:
+                self.limit_count = self.limit_max
+
+    def wrap(self, resolve):
+        """
+        Wraps a resolve function (see Mkm.resolve) so that every request goes through the limiter.
+        The result can be passed to the API map classes, e.g. MarketplaceInfo(limiter.wrap(mkm.resolve)).
+
+        :param resolve: The resolve function to wrap
+        :return: Returns the limited resolve function
+        """
+
+        def limited_resolve(request_method, resource_url, params=None, data=None, **kwargs):
+            self.acquire()
+            try:
+                response = resolve(request_method, resource_url, params=params, data=data, **kwargs)
+            except MKMConnectionError as e:
+                self.update(e.response)
+                raise
+            self.update(response)
+            return response
+
+        return limited_resolve
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.requests_per_second is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.requests_per_second)
+        self._last_refill = now
+
+    def _take_token(self):
+        """Consumes a token and returns 0 or returns the seconds to wait for the next token."""
+        if self.requests_per_second is None:
+            return 0
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.requests_per_second
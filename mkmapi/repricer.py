@@ -0,0 +1,170 @@
+import math
+
+from mkmapi.response_parser import CONDITIONS
+
+CHANGE_BATCH_SIZE = 100
+
+
+class PricingRule:
+    """
+    Computes the price of stock articles from a price guide field.
+
+    The first rule that applies to an article decides its price:
+        new price = max(min_price, guide price * multiplier * condition factor + offset)
+    rounded to `round_to`.
+    """
+
+    def __init__(
+            self, field: str = 'TREND', multiplier: float = 1.0, offset: float = 0.0, foil_field: str = 'TRENDFOIL',
+            condition_factors=None, conditions=None, language_ids=None, is_foil: bool = None,
+            min_price: float = 0.02, round_to: float = 0.01, name=None
+    ):
+        """
+        :param field: Price guide field for non foil articles (default: TREND)
+        :param multiplier: Factor applied to the guide price (default: 1.0)
+        :param offset: Amount added after the multiplication (default: 0.0)
+        :param foil_field: Price guide field for foil articles (default: TRENDFOIL; None uses `field`)
+        :param condition_factors: Dictionary mapping conditions to additional factors, e.g. {'EX': 0.9, 'GD': 0.75}
+        :param conditions: Only apply to these conditions (optional)
+        :param language_ids: Only apply to these language IDs (optional)
+        :param is_foil: Only apply to foil (True) or non foil (False) articles (optional)
+        :param min_price: Lowest price set by the rule (default: 0.02)
+        :param round_to: Prices are rounded to multiples of this amount (default: 0.01)
+        :param name: Name reported in the repricing report (default: field and multiplier)
+        """
+        if conditions is not None and not set(conditions) <= set(CONDITIONS):
+            raise ValueError(f'Conditions must be in {CONDITIONS}.')
+        self.field = field
+        self.multiplier = multiplier
+        self.offset = offset
+        self.foil_field = foil_field
+        self.condition_factors = condition_factors or {}
+        self.conditions = set(conditions) if conditions is not None else None
+        self.language_ids = set(language_ids) if language_ids is not None else None
+        self.is_foil = is_foil
+        self.min_price = min_price
+        self.round_to = round_to
+        self.name = name if name is not None else f'{field} x{multiplier}'
+
+    def applies(self, article):
+        """
+        :param article: StockArticle
+        :return: True if the rule applies to the article
+        """
+        return (
+            (self.conditions is None or article.condition in self.conditions)
+            and (self.language_ids is None or article.id_language in self.language_ids)
+            and (self.is_foil is None or article.is_foil == self.is_foil)
+        )
+
+    def field_for(self, article):
+        return self.foil_field if article.is_foil and self.foil_field else self.field
+
+    def price(self, article, guide_price):
+        """
+        :param article: StockArticle
+        :param guide_price: Price guide value of the field returned by field_for()
+        :return: The new price or None if the guide price is missing
+        """
+        if guide_price is None or math.isnan(guide_price) or guide_price <= 0:
+            return None
+        price = guide_price * self.multiplier * self.condition_factors.get(article.condition, 1.0) + self.offset
+        price = round(round(price / self.round_to) * self.round_to, 2)
+        return max(price, self.min_price)
+
+
+class Repricer:
+    """
+    Reprices a stock snapshot with a price guide.
+
+    The stock is joined with the price guide once: the articles are sorted by product ID and matched against the
+    sorted product IDs of the guide in a single merge pass, then the price columns are read by row position.
+    Only articles whose price changes by at least `min_change` are sent, in batches of bulk_modify_stock('change').
+    """
+
+    def __init__(self, price_guide, rules, min_change: float = 0.01):
+        """
+        :param price_guide: PriceGuide with the current prices
+        :param rules: List of PricingRule, the first rule that applies to an article is used
+        :param min_change: Smallest price difference worth an update (default: 0.01)
+        """
+        self.price_guide = price_guide
+        self.rules = list(rules)
+        self.min_change = min_change
+
+    def plan(self, stock):
+        """
+        Computes the new prices without sending anything.
+
+        :param stock: Iterable of StockArticle, see stock_snapshot.read_stock_file() and iterate_stock()
+        :return: Returns a dictionary with
+            changes: list of dictionaries with idArticle, idProduct, rule, field, guide, old and new,
+            unchanged: number of articles whose price stays,
+            unpriced: number of articles without a rule or a guide price,
+            articles: the changed StockArticle records with their new price
+        """
+        stock = sorted(stock, key=lambda article: article.id_product)
+        rows = self._join(stock)
+
+        changes = []
+        articles = []
+        unchanged = unpriced = 0
+        for article, row in zip(stock, rows):
+            rule = next((rule for rule in self.rules if rule.applies(article)), None)
+            if rule is None or row is None:
+                unpriced += 1
+                continue
+            field = rule.field_for(article)
+            column = self.price_guide.columns.get(field)
+            guide_price = column[row] if column is not None else None
+            price = rule.price(article, guide_price)
+            if price is None:
+                unpriced += 1
+            elif abs(price - article.price) < self.min_change:
+                unchanged += 1
+            else:
+                articles.append(article._replace(price=price))
+                changes.append({
+                    'idArticle': article.id_article,
+                    'idProduct': article.id_product,
+                    'rule': rule.name,
+                    'field': field,
+                    'guide': guide_price,
+                    'old': article.price,
+                    'new': price,
+                })
+        return {'changes': changes, 'unchanged': unchanged, 'unpriced': unpriced, 'articles': articles}
+
+    def reprice(self, stock_management, stock, dry_run: bool = True, batch_size: int = CHANGE_BATCH_SIZE):
+        """
+        Computes the new prices and sends the changed articles.
+
+        :param stock_management: StockManagement instance, e.g. mkm.stock_management
+        :param stock: Iterable of StockArticle
+        :param dry_run: Only report the changes, nothing is sent (default: True)
+        :param batch_size: Number of articles per bulk_modify_stock() request (default: 100)
+        :return: Returns the report of plan() with an additional key `responses` (the responses of the requests)
+        """
+        report = self.plan(stock)
+        report['responses'] = []
+        if dry_run:
+            return report
+
+        articles = [article.to_api() for article in report['articles']]
+        for position in range(0, len(articles), batch_size):
+            report['responses'].append(
+                stock_management.bulk_modify_stock('change', articles[position:position + batch_size])
+            )
+        return report
+
+    def _join(self, stock):
+        """Row positions in the price guide of articles sorted by product ID, None for unknown products."""
+        product_ids = self.price_guide.product_ids
+        rows = []
+        position = 0
+        for article in stock:
+            while position < len(product_ids) and product_ids[position] < article.id_product:
+                position += 1
+            found = position < len(product_ids) and product_ids[position] == article.id_product
+            rows.append(position if found else None)
+        return rows
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from mkmapi.profiling import profiler
+
+
+def parse_json(response):
+    """
+    Parses the JSON body of a response.
+
+    MKM answers with 204 No Content when a collection is empty, in that case an empty dictionary is returned.
+
+    :param response: Response received from the server
+    :return: Returns the decoded JSON body as dictionary
+    """
+    if response is None or response.status_code == 204 or not response.content:
+        return {}
+    with profiler.phase('parse'):
+        return response.json()
+
+
+def get_entities(response, key):
+    """
+    Returns the list of entities stored under `key` in the JSON body of a response.
+
+    MKM returns a single object instead of a list for some requests, this always returns a list.
+
+    :param response: Response received from the server or an already decoded dictionary
+    :param key: Name of the entity, e.g. 'article', 'order' or 'expansion'
+    :return: Returns a list of entities (dictionaries)
+    """
+    body = response if isinstance(response, dict) else parse_json(response)
+    entities = body.get(key, [])
+    if entities is None:
+        return []
+    if isinstance(entities, dict):
+        return [entities]
+    return list(entities)
+
+
+# Article conditions from best to worst
+CONDITIONS = ('MT', 'NM', 'EX', 'GD', 'LP', 'PL', 'PO')
+
+ARTICLE_FIELDS = (
+    'idArticle', 'idProduct', 'idLanguage', 'condition', 'price', 'count',
+    'isFoil', 'isSigned', 'isAltered', 'isPlayset', 'idUser',
+)
+
+
+def flatten_article(article):
+    """
+    Reduces an Article entity to the flat fields in ARTICLE_FIELDS.
+    Language and seller are nested objects in the API response, they are replaced by their IDs.
+    Already flattened articles are returned unchanged.
+
+    :param article: Article entity
+    :return: Returns a dictionary with the keys of ARTICLE_FIELDS
+    """
+    if 'language' not in article and 'seller' not in article:
+        return article
+    flat = {field: article.get(field) for field in ARTICLE_FIELDS}
+    if flat['idLanguage'] is None:
+        flat['idLanguage'] = (article.get('language') or {}).get('idLanguage')
+    if flat['idUser'] is None:
+        flat['idUser'] = (article.get('seller') or {}).get('idUser')
+    return flat
+
+
+def parse_date(value):
+    """
+    Parses the ISO 8601 dates used by MKM, e.g. 2019-01-25T00:00:00+0100.
+
+    :param value: Date string
+    :return: Returns a timezone aware datetime or None if the date is empty or malformed
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        return None
@@ -0,0 +1,182 @@
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mkmapi.api_map.marketplace_info import MarketplaceInfo
+from mkmapi.exceptions import QuotaExhausted
+from mkmapi.file_storage import atomic_write_json, read_json
+from mkmapi.paging import iterate_pages
+from mkmapi.response_parser import flatten_article
+
+PAGE_SIZE = 1000
+# Fields covered by the fingerprint of an article, the price is compared separately
+FINGERPRINT_FIELDS = (
+    'idProduct', 'idLanguage', 'condition', 'count', 'isFoil', 'isSigned', 'isAltered', 'isPlayset',
+)
+
+
+class SellerCrawler:
+    """
+    Monitors the inventories of other sellers with get_articles_for_user().
+
+    The inventories of all (user, game) pairs are paged through concurrently. Articles are deduplicated by
+    idArticle, because articles move between pages when the inventory changes while it is paged through.
+    Per user and game only a compact snapshot is kept: the sorted article IDs, their prices in cents and a
+    CRC32 fingerprint of the other fields. Every crawl is compared with the previous snapshot and only the
+    differences are reported, see diff_inventory().
+    """
+
+    def __init__(self, mkm, snapshot_dir, rate_limiter=None, max_workers: int = 4):
+        """
+        :param mkm: Mkm instance used for the requests
+        :param snapshot_dir: Directory of the snapshots
+        :param rate_limiter: RateLimiter all requests go through (optional)
+        :param max_workers: Number of inventories paged through concurrently (default: 4)
+        """
+        self.snapshot_dir = snapshot_dir
+        self.max_workers = max_workers
+        resolve = rate_limiter.wrap(mkm.resolve) if rate_limiter is not None else mkm.resolve
+        self.marketplace_info = MarketplaceInfo(resolve)
+
+    def snapshot_path(self, user_id, game_id):
+        return os.path.join(self.snapshot_dir, f'{user_id}-{game_id}.json')
+
+    def crawl(self, user_ids, game_ids=(1,), progress=None):
+        """
+        Fetches the inventories of all users for all games and stores the new snapshots.
+
+        :param user_ids: Iterable of user IDs or usernames
+        :param game_ids: IDs of the games (default: (1,) for MtG)
+        :param progress: Callable invoked with (completed, total) after every inventory (optional)
+        :return: Dictionary with the `changes` mapping (user_id, game_id) to the result of diff_inventory(),
+            the `failed` (user_id, game_id) pairs mapped to the error message and `quota_exhausted`
+        """
+        shards = [(user_id, game_id) for user_id in dict.fromkeys(user_ids) for game_id in game_ids]
+        changes = {}
+        failed = {}
+        quota_exhausted = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.update, *shard): shard for shard in shards}
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                shard = futures[future]
+                try:
+                    changes[shard] = future.result()
+                except QuotaExhausted:
+                    if not quota_exhausted:
+                        quota_exhausted = True
+                        for pending in futures:
+                            pending.cancel()
+                except Exception as e:
+                    failed[shard] = str(e)
+                if progress is not None:
+                    progress(len(changes) + len(failed), len(shards))
+        return {'changes': changes, 'failed': failed, 'quota_exhausted': quota_exhausted}
+
+    def update(self, user_id, game_id: int = 1):
+        """
+        Fetches the inventory of a user, compares it with the previous snapshot and stores the new snapshot.
+
+        :param user_id: User ID or username
+        :param game_id: ID of the game (default: 1 for MtG)
+        :return: Returns the result of diff_inventory()
+        """
+        articles = self.fetch_inventory(user_id, game_id)
+        previous = read_json(self.snapshot_path(user_id, game_id))
+        result = diff_inventory(previous, articles)
+        atomic_write_json(self.snapshot_path(user_id, game_id), inventory_snapshot(articles))
+        return result
+
+    def fetch_inventory(self, user_id, game_id: int = 1):
+        """
+        :param user_id: User ID or username
+        :param game_id: ID of the game (default: 1 for MtG)
+        :return: Returns a dictionary mapping idArticle to the flattened article
+        """
+        return fetch_user_articles(self.marketplace_info, user_id, game_id)
+
+    def snapshot(self, user_id, game_id: int = 1):
+        """
+        :return: The stored snapshot of the inventory (see inventory_snapshot()) or None
+        """
+        return read_json(self.snapshot_path(user_id, game_id))
+
+
+def fetch_user_articles(marketplace_info, user_id, game_id: int = 1):
+    """
+    Fetches all articles of a user, deduplicated by idArticle.
+
+    :param marketplace_info: MarketplaceInfo instance used for the requests
+    :param user_id: User ID or username
+    :param game_id: ID of the game (default: 1 for MtG)
+    :return: Returns a dictionary mapping idArticle to the flattened article
+    """
+    pages = iterate_pages(
+        lambda start: marketplace_info.get_articles_for_user(user_id, game_id, start, PAGE_SIZE),
+        'article', start=0, page_size=PAGE_SIZE,
+    )
+    articles = {}
+    for page in pages:
+        for article in page:
+            article = flatten_article(article)
+            articles[article['idArticle']] = article
+    return articles
+
+
+def article_fingerprint(article):
+    """
+    :param article: Flattened article
+    :return: Returns the CRC32 of all FINGERPRINT_FIELDS of the article
+    """
+    return zlib.crc32('\x1f'.join(str(article.get(field)) for field in FINGERPRINT_FIELDS).encode('utf-8'))
+
+
+def inventory_snapshot(articles):
+    """
+    :param articles: Dictionary mapping idArticle to the flattened article
+    :return: Returns the compact snapshot: `fetched` and the columns idArticle (sorted), price (cents) and
+        fingerprint
+    """
+    article_ids = sorted(articles)
+    return {
+        'fetched': time.time(),
+        'idArticle': article_ids,
+        'price': [_cents(articles[article_id].get('price')) for article_id in article_ids],
+        'fingerprint': [article_fingerprint(articles[article_id]) for article_id in article_ids],
+    }
+
+
+def diff_inventory(previous, articles):
+    """
+    Compares an inventory with a snapshot. Without a snapshot every article is added.
+
+    :param previous: Snapshot of inventory_snapshot() or None
+    :param articles: Dictionary mapping idArticle to the flattened article
+    :return: Dictionary with the `added` articles, the `removed` article IDs, the `repriced` articles
+        (with `oldPrice`) and the `changed` articles (other fields like count or condition changed)
+    """
+    result = {'added': [], 'removed': [], 'repriced': [], 'changed': []}
+    known = {}
+    if previous is not None:
+        known = {
+            article_id: (price, fingerprint)
+            for article_id, price, fingerprint in zip(previous['idArticle'], previous['price'], previous['fingerprint'])
+        }
+
+    for article_id, article in articles.items():
+        if article_id not in known:
+            result['added'].append(article)
+            continue
+        price, fingerprint = known[article_id]
+        if _cents(article.get('price')) != price:
+            result['repriced'].append(dict(article, oldPrice=price / 100 if price is not None else None))
+        if article_fingerprint(article) != fingerprint:
+            result['changed'].append(article)
+    result['removed'] = [article_id for article_id in known if article_id not in articles]
+    return result
+
+
+def _cents(price):
+    return None if price is None else round(price * 100)
@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mkmapi.exceptions import MKMConnectionError
+from mkmapi.response_parser import get_entities
+from mkmapi.stock_snapshot import StockArticle
+
+MODIFY = 'modify'
+QUANTITY = 'quantity'
+
+UNSENT = 'unsent'
+UNCONFIRMED = 'unconfirmed'
+
+
+class StockJournal:
+    """
+    Write-ahead journal for stock mutations.
+
+    Every chunk of a bulk_modify_stock() or bulk_change_stock_quantity() run is written to the journal (one JSON
+    object per line) before anything is sent:
+        intent  the chunk with its action and articles, all chunks of a run are written with a single fsync
+        sent    written right before the request
+        done    the server confirmed the chunk
+        partial the server applied the chunk but rejected some of its articles (listed under `rejected`)
+        failed  the server rejected the chunk (nothing was changed)
+
+    `done` marks are synced in groups of `sync_every` records or every `sync_interval` seconds, so the journal
+    costs about one fsync per run instead of one per request. `sent` marks are synced before the request: no
+    action is safe to apply twice, not even a change, which would overwrite edits made after the first attempt.
+
+    After a crash, pending() tells which chunks were never sent and which were sent but not confirmed, and
+    resume() sends exactly that work. rejected() lists the articles of partially applied chunks. compact() drops
+    finished chunks from the file, partially applied chunks are kept until their rejections are handled.
+    """
+
+    def __init__(self, path, sync_every: int = 32, sync_interval: float = 1.0):
+        """
+        Opens or creates a journal.
+
+        :param path: Path of the journal file
+        :param sync_every: Number of records after which the journal is synced to disk (default: 32)
+        :param sync_interval: Maximum seconds between two syncs while records are written (default: 1.0)
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._entries = {}
+        self._next_id = 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._load()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def bulk_modify_stock(self, stock_management, action, articles, chunk_size: int = 100, max_workers: int = 1):
+        """
+        Journaled version of StockManagement.bulk_modify_stock().
+
+        :param stock_management: StockManagement instance, e.g. mkm.stock_management
+        :param action: add, change or remove
+        :param articles: List of article dictionaries, see StockManagement.bulk_modify_stock()
+        :param chunk_size: Number of articles per request (default: 100)
+        :param max_workers: Number of requests sent concurrently (default: 1)
+        :return: Returns the list of responses
+        """
+        return self._run(stock_management, MODIFY, action, articles, chunk_size, max_workers)
+
+    def bulk_change_stock_quantity(
+            self, stock_management, increase_or_decrease, articles, chunk_size: int = 100, max_workers: int = 1
+    ):
+        """
+        Journaled version of StockManagement.bulk_change_stock_quantity().
+
+        :param stock_management: StockManagement instance, e.g. mkm.stock_management
+        :param increase_or_decrease: 'increase' or 'decrease'
+        :param articles: List of dictionaries with idArticle and count
+        :param chunk_size: Number of articles per request (default: 100)
+        :param max_workers: Number of requests sent concurrently (default: 1)
+        :return: Returns the list of responses
+        """
+        return self._run(stock_management, QUANTITY, increase_or_decrease, articles, chunk_size, max_workers)
+
+    def pending(self):
+        """
+        :return: Returns the chunks that are not done, as dictionaries with id, kind, action, articles and
+            status (unsent or unconfirmed), in journal order
+        """
+        with self._lock:
+            return [
+                dict(entry, status=UNCONFIRMED if entry['sent'] else UNSENT)
+                for entry in self._entries.values() if entry['state'] == 'pending'
+            ]
+
+    def resume(self, stock_management, confirm=None):
+        """
+        Sends the chunks left over from an interrupted run.
+
+        Unsent chunks are sent. Unconfirmed chunks may or may not have reached the server: with `confirm` they are
+        marked done if confirm(chunk) returns True, sent if it returns False and left pending if it returns None
+        (e.g. check the articles with get_stock_article(), see confirm_change()). Without `confirm`, unconfirmed
+        chunks stay pending; pass `lambda chunk: False` to send them again or drop them with discard().
+
+        :param stock_management: StockManagement instance, e.g. mkm.stock_management
+        :param confirm: Callable that takes an unconfirmed chunk (see pending()) and returns True if it was applied,
+            False if it was not and None if that is unknown
+        :return: Returns the list of responses
+        """
+        responses = []
+        for entry in self.pending():
+            if entry['status'] == UNCONFIRMED:
+                applied = confirm(entry) if confirm is not None else None
+                if applied is None:
+                    continue
+                if applied:
+                    self._mark(entry['id'], 'done')
+                    continue
+            responses.append(self._send(stock_management, entry))
+        self.sync()
+        return responses
+
+    def rejected(self):
+        """
+        :return: Returns the partially applied chunks, as dictionaries with id, kind, action, articles and the
+            `rejected` entries of the response (e.g. {'success': False, 'tried': {...}, 'error': '...'})
+        """
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values() if entry['state'] == 'partial']
+
+    def discard(self, entry_id):
+        """
+        Marks a partially applied or pending chunk as handled without sending it, compact() drops it afterwards.
+
+        :param entry_id: ID of the chunk, see rejected() and pending()
+        """
+        self._mark(entry_id, 'done', force_sync=True)
+
+    def sync(self):
+        """Writes all buffered records to disk."""
+        with self._lock:
+            self._sync()
+
+    def compact(self):
+        """Rewrites the journal with only the pending and partially applied chunks."""
+        with self._lock:
+            self._sync()
+            self._file.close()
+            pending = [entry for entry in self._entries.values() if entry['state'] in ('pending', 'partial')]
+            temporary_path = f'{self.path}.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                for entry in pending:
+                    file.write(_record('intent', entry['id'], kind=entry['kind'], action=entry['action'],
+                                       articles=entry['articles']))
+                    if entry['sent']:
+                        file.write(_record('sent', entry['id']))
+                    if entry['state'] == 'partial':
+                        file.write(_record('partial', entry['id'], rejected=entry['rejected']))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self.path)
+            self._entries = {entry['id']: entry for entry in pending}
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def _run(self, stock_management, kind, action, articles, chunk_size, max_workers):
+        if not isinstance(articles, (list, tuple)):
+            articles = [articles]
+        with self._lock:
+            entries = []
+            for position in range(0, len(articles), chunk_size):
+                entry = {
+                    'id': self._next_id, 'kind': kind, 'action': action,
+                    'articles': list(articles[position:position + chunk_size]), 'sent': False, 'state': 'pending',
+                }
+                self._next_id += 1
+                self._entries[entry['id']] = entry
+                self._file.write(_record('intent', entry['id'], kind=kind, action=action, articles=entry['articles']))
+                entries.append(entry)
+            self._sync()
+
+        try:
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    return list(executor.map(lambda entry: self._send(stock_management, entry), entries))
+            return [self._send(stock_management, entry) for entry in entries]
+        finally:
+            self.sync()
+
+    def _send(self, stock_management, entry):
+        self._mark(entry['id'], 'sent', force_sync=True)
+        if entry['kind'] == MODIFY:
+            send = stock_management.bulk_modify_stock
+        else:
+            send = stock_management.bulk_change_stock_quantity
+        try:
+            response = send(entry['action'], entry['articles'])
+        except MKMConnectionError as e:
+            status = getattr(e.response, 'status_code', None)
+            # A client error means nothing was applied, after a server error the chunk stays unconfirmed
+            if status is not None and status < 500:
+                self._mark(entry['id'], 'failed', force_sync=True, status=status)
+            raise
+        if response is None:
+            self._mark(entry['id'], 'failed', force_sync=True)
+            raise ValueError(f'Invalid action `{entry["action"]}`.')
+        rejected = rejected_articles(response)
+        if rejected:
+            self._mark(entry['id'], 'partial', force_sync=True, rejected=rejected)
+        else:
+            self._mark(entry['id'], 'done')
+        return response
+
+    def _mark(self, entry_id, operation, force_sync: bool = False, **fields):
+        with self._lock:
+            entry = self._entries[entry_id]
+            if operation == 'sent':
+                entry['sent'] = True
+            else:
+                entry['state'] = operation
+            if 'rejected' in fields:
+                entry['rejected'] = fields['rejected']
+            self._file.write(_record(operation, entry_id, **fields))
+            self._unsynced += 1
+            if force_sync or self._unsynced >= self.sync_every \
+                    or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self):
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            valid = 0
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line of a crashed process, the record was never acknowledged
+                    break
+                valid += len(line)
+                entry_id = record['id']
+                if record['op'] == 'intent':
+                    self._entries[entry_id] = {
+                        'id': entry_id, 'kind': record['kind'], 'action': record['action'],
+                        'articles': record['articles'], 'sent': False, 'state': 'pending',
+                    }
+                elif entry_id in self._entries:
+                    if record['op'] == 'sent':
+                        self._entries[entry_id]['sent'] = True
+                    else:
+                        self._entries[entry_id]['state'] = record['op']
+                    if 'rejected' in record:
+                        self._entries[entry_id]['rejected'] = record['rejected']
+                self._next_id = max(self._next_id, entry_id + 1)
+        if valid < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as file:
+                file.truncate(valid)
+
+
+def confirm_change(stock_management):
+    """
+    Builds a `confirm` callable for resume() that checks unconfirmed chunks with get_stock_article().
+
+    A change is applied if every article in the stock has the values that were sent. Added articles have no ID
+    yet and removed articles are gone either way, so those chunks and quantity changes return None (unknown).
+
+    :param stock_management: StockManagement instance, e.g. mkm.stock_management
+    :return: Returns the callable
+    """
+    def confirm(chunk):
+        if chunk['kind'] != MODIFY or chunk['action'] != 'change':
+            return None
+        for article in chunk['articles']:
+            current = get_entities(stock_management.get_stock_article(article['idArticle']), 'article')
+            if not current or StockArticle.from_api(current[0]).to_api() != article:
+                return False
+        return True
+
+    return confirm
+
+
+def rejected_articles(response):
+    """
+    Collects the articles a bulk stock request did not apply although the request succeeded.
+
+    Adding and removing report every article under `inserted` / `deleted` with a success flag, changing lists the
+    rejected ones under `notUpdatedArticles` and quantity changes under `failed`.
+
+    :param response: Response of bulk_modify_stock() or bulk_change_stock_quantity()
+    :return: Returns the list of rejected entries as sent by the server
+    """
+    try:
+        rejected = get_entities(response, 'notUpdatedArticles') + get_entities(response, 'failed')
+        for key in ('inserted', 'deleted'):
+            rejected.extend(
+                entry for entry in get_entities(response, key)
+                if isinstance(entry, dict) and entry.get('success') is False
+            )
+    except (ValueError, AttributeError):
+        return []
+    return rejected
+
+
+def _record(operation, entry_id, **fields):
+    return json.dumps(dict({'op': operation, 'id': entry_id}, **fields), separators=(',', ':')) + '\n'
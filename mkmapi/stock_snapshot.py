@@ -0,0 +1,339 @@
+import base64
+import codecs
+import json
+import math
+import re
+import zlib
+from typing import NamedTuple
+
+from mkmapi.api_map.stock_management import StockManagement
+from mkmapi.gzip_csv import decode_file, read_csv, read_csv_lines
+from mkmapi.paging import iterate_pages
+from mkmapi.response_parser import get_entities, parse_json
+
+STOCK_PAGE_SIZE = 100
+
+LANGUAGES = {
+    'english': 1, 'french': 2, 'german': 3, 'spanish': 4, 'italian': 5, 's-chinese': 6,
+    'japanese': 7, 'portuguese': 8, 'russian': 9, 'korean': 10, 't-chinese': 11,
+}
+
+# Columns of the stock file mapped to StockArticle attributes
+_STOCK_FILE_COLUMNS = {
+    'idarticle': 'id_article',
+    'idproduct': 'id_product',
+    'price': 'price',
+    'language': 'id_language',
+    'condition': 'condition',
+    'foil?': 'is_foil',
+    'signed?': 'is_signed',
+    'playset?': 'is_playset',
+    'altered?': 'is_altered',
+    'firsted?': 'is_first_ed',
+    'comments': 'comments',
+    'amount': 'count',
+}
+
+
+class StockArticle(NamedTuple):
+    """An article of the authenticated user's stock, the same record for get_stock() and get_stock_as_file()."""
+
+    id_article: int
+    id_product: int
+    id_language: int
+    condition: str
+    price: float
+    count: int
+    is_foil: bool = False
+    is_signed: bool = False
+    is_altered: bool = False
+    is_playset: bool = False
+    is_first_ed: bool = False
+    comments: str = ''
+
+    @classmethod
+    def from_api(cls, article):
+        """
+        :param article: Article entity as returned by get_stock()
+        :return: Returns a StockArticle
+        """
+        language = article.get('language') or {}
+        return cls(
+            id_article=int(article['idArticle']),
+            id_product=int(article['idProduct']),
+            id_language=int(language.get('idLanguage', article.get('idLanguage', 1))),
+            condition=article.get('condition'),
+            price=float(article['price']),
+            count=int(article['count']),
+            is_foil=bool(article.get('isFoil')),
+            is_signed=bool(article.get('isSigned')),
+            is_altered=bool(article.get('isAltered')),
+            is_playset=bool(article.get('isPlayset')),
+            is_first_ed=bool(article.get('isFirstEd')),
+            comments=article.get('comments') or '',
+        )
+
+    @classmethod
+    def from_csv_row(cls, columns, row):
+        """
+        :param columns: Dictionary mapping StockArticle attributes to column positions, see stock_file_columns()
+        :param row: Row of the stock file
+        :return: Returns a StockArticle
+        """
+        def value(name, default=''):
+            position = columns.get(name)
+            return row[position].strip() if position is not None and position < len(row) else default
+
+        language = value('id_language', '1')
+        return cls(
+            id_article=int(value('id_article') or 0),
+            id_product=int(value('id_product')),
+            id_language=int(language) if language.isdigit() else LANGUAGES.get(language.lower(), 1),
+            condition=value('condition') or None,
+            price=float(value('price', '0').replace(',', '.')),
+            count=int(value('count', '1')),
+            is_foil=_flag(value('is_foil')),
+            is_signed=_flag(value('is_signed')),
+            is_altered=_flag(value('is_altered')),
+            is_playset=_flag(value('is_playset')),
+            is_first_ed=_flag(value('is_first_ed')),
+            comments=value('comments'),
+        )
+
+    def to_api(self, **changes):
+        """
+        Converts the article to the dictionary expected by bulk_modify_stock().
+        All properties are included, MKM resets omitted properties to their defaults on change.
+
+        :param changes: Attributes to replace, e.g. price=1.5
+        :return: Returns a dictionary
+        """
+        article = self._replace(**changes)
+        data = {
+            'idArticle': article.id_article,
+            'idLanguage': article.id_language,
+            'comments': article.comments,
+            'count': article.count,
+            'price': article.price,
+            'isFoil': 'true' if article.is_foil else 'false',
+            'isSigned': 'true' if article.is_signed else 'false',
+            'isAltered': 'true' if article.is_altered else 'false',
+            'isPlayset': 'true' if article.is_playset else 'false',
+            'isFirstEd': 'true' if article.is_first_ed else 'false',
+        }
+        if article.condition is not None:
+            data['condition'] = article.condition
+        return data
+
+
+def stock_file_columns(header):
+    """
+    :param header: Column names of a stock file
+    :return: Dictionary mapping StockArticle attributes to column positions
+    """
+    return {
+        _STOCK_FILE_COLUMNS[name.strip().lower()]: position
+        for position, name in enumerate(header) if name.strip().lower() in _STOCK_FILE_COLUMNS
+    }
+
+
+def read_stock_file(response):
+    """
+    Decodes the response of get_stock_as_file().
+
+    :param response: Response of get_stock_as_file() or its body (bytes)
+    :return: Returns a list of StockArticle
+    """
+    body = json.loads(response) if isinstance(response, (bytes, str)) else parse_json(response)
+    header, rows = read_csv(decode_file(body['stock']))
+    columns = stock_file_columns(header)
+    return [StockArticle.from_csv_row(columns, row) for row in rows if row]
+
+
+def iter_stock_file(response, chunk_size: int = 65536):
+    """
+    Decodes a streamed get_stock_as_file() response while it is downloaded: the Base64 string is decoded,
+    unzipped and parsed chunk by chunk, so neither the encoded nor the unpacked file is held in memory.
+
+    :param response: Response of get_stock_as_file() requested in streaming mode, see Mkm.streaming_resolve()
+    :param chunk_size: Number of bytes read at once (default: 64 KiB)
+    :return: Yields StockArticle
+    """
+    try:
+        header, rows = read_csv_lines(_iter_lines(response.iter_content(chunk_size=chunk_size)))
+        columns = stock_file_columns(header)
+        for row in rows:
+            if row:
+                yield StockArticle.from_csv_row(columns, row)
+    finally:
+        response.close()
+
+
+def iterate_stock(stock_management, first_page=None, game_ids=None, include_sealed: bool = True):
+    """
+    Pages through get_stock(start), 100 articles per request.
+
+    With `game_ids` only the articles the file exports of these games contain are returned, see snapshot_stock().
+
+    :param stock_management: StockManagement instance, e.g. mkm.stock_management
+    :param first_page: Already received response of get_stock(1) (optional)
+    :param game_ids: Only return articles of these games (optional; default: all games)
+    :param include_sealed: Also return sealed products, only applies with `game_ids` (default: True)
+    :return: Yields StockArticle
+    """
+    for article in _iterate_stock_entities(stock_management, first_page):
+        if game_ids is None or _is_exported(article, game_ids, include_sealed):
+            yield StockArticle.from_api(article)
+
+
+def _iterate_stock_entities(stock_management, first_page=None):
+    start = 1
+    if first_page is not None:
+        articles = get_entities(first_page, 'article')
+        yield from articles
+        if len(articles) < STOCK_PAGE_SIZE:
+            return
+        start += STOCK_PAGE_SIZE
+    for page in iterate_pages(stock_management.get_stock, 'article', start=start, page_size=STOCK_PAGE_SIZE):
+        yield from page
+
+
+def choose_stock_strategy(stock_size, file_requests: int, remaining=None):
+    """
+    Decides how to download the rest of the stock after the first page of get_stock().
+
+    :param stock_size: Number of articles in the stock or None if unknown
+    :param file_requests: Number of get_stock_as_file() requests needed
+    :param remaining: Remaining requests of the quota or None if unknown
+    :return: Returns 'file' or 'paged'
+    """
+    if stock_size is None:
+        return 'file'
+    paged_requests = math.ceil(stock_size / STOCK_PAGE_SIZE) - 1
+    if remaining is not None and paged_requests > remaining >= file_requests:
+        return 'file'
+    return 'file' if file_requests < paged_requests else 'paged'
+
+
+def snapshot_stock(mkm, game_ids=(1,), include_sealed: bool = False, stock_size: int = None):
+    """
+    Downloads the whole stock with the fewest requests.
+
+    The first page of get_stock() is always requested. If the stock fits on it, that is all. Otherwise the
+    number of remaining pages (from the stock size reported by the server or `stock_size`) is compared to the
+    number of file exports (one per game, two with sealed products) and the remaining quota, and the rest is
+    fetched page by page or as streamed file exports. Both paths return the same StockArticle records: articles
+    of get_stock() are filtered by the idGame of their product and by sealed or single (products without rarity
+    are sealed), like the file export.
+
+    :param mkm: Mkm instance used for the requests
+    :param game_ids: Games the stock consists of (default: (1,) - MtG)
+    :param include_sealed: Also export sealed products (default: False)
+    :param stock_size: Number of articles in the stock if known (optional)
+    :return: Returns a list of StockArticle
+    """
+    stock_management = mkm.stock_management
+    first_page = stock_management.get_stock(1)
+    articles = get_entities(first_page, 'article')
+    if len(articles) < STOCK_PAGE_SIZE:
+        return [
+            StockArticle.from_api(article) for article in articles
+            if _is_exported(article, game_ids, include_sealed)
+        ]
+
+    headers = getattr(first_page, 'headers', None) or {}
+    if stock_size is None:
+        stock_size = _total_from_content_range(headers.get('Content-Range'))
+    remaining = None
+    if headers.get('X-Request-Limit-Max') is not None and headers.get('X-Request-Limit-Count') is not None:
+        remaining = int(headers['X-Request-Limit-Max']) - int(headers['X-Request-Limit-Count'])
+    kinds = (False, True) if include_sealed else (False,)
+    exports = [(game_id, is_sealed) for game_id in game_ids for is_sealed in kinds]
+
+    if choose_stock_strategy(stock_size, len(exports), remaining) == 'paged':
+        return list(iterate_stock(stock_management, first_page, game_ids, include_sealed))
+
+    streaming_stock_management = StockManagement(mkm.streaming_resolve)
+    stock = []
+    for game_id, is_sealed in exports:
+        stock.extend(iter_stock_file(streaming_stock_management.get_stock_as_file(game_id, is_sealed)))
+    return stock
+
+
+def _is_exported(article, game_ids, include_sealed):
+    """Whether the file exports of `game_ids` contain a get_stock() article. Articles without product are kept."""
+    product = article.get('product')
+    if not product:
+        return True
+    if product.get('idGame') is not None and int(product['idGame']) not in game_ids:
+        return False
+    return include_sealed or bool(product.get('rarity'))
+
+
+def _total_from_content_range(content_range):
+    """Total of a Content-Range header like 'article 1-100/1234', None if missing."""
+    match = re.search(r'/(\d+)\s*$', content_range or '')
+    return int(match.group(1)) if match else None
+
+
+def _iter_base64_value(chunks, key):
+    """Yields the decoded bytes of the Base64 string stored under `key` in a JSON document given as byte chunks."""
+    chunks = iter(chunks)
+    pattern = re.compile(b'"' + re.escape(key.encode('ascii')) + rb'"\s*:\s*"')
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        match = pattern.search(buffer)
+        if match:
+            break
+        buffer = buffer[-(len(key) + 16):]
+    else:
+        raise ValueError(f'`{key}` not found in the response.')
+
+    pending = b''
+    chunk = buffer[match.end():]
+    while True:
+        pending += chunk
+        end = pending.find(b'"')
+        if end >= 0:
+            pending = pending[:end]
+        # JSON encoders may escape the slashes of the Base64 alphabet
+        if end < 0 and pending.endswith(b'\\'):
+            usable = pending[:-1].replace(b'\\/', b'/')
+            carry = b'\\'
+        else:
+            usable = pending.replace(b'\\/', b'/')
+            carry = b''
+        complete = len(usable) // 4 * 4
+        if end >= 0:
+            yield base64.b64decode(usable)
+            return
+        if complete:
+            yield base64.b64decode(usable[:complete])
+        pending = usable[complete:] + carry
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError(f'`{key}` is truncated.')
+
+
+def _iter_lines(chunks):
+    """Yields the lines of the gzipped CSV file of a streamed get_stock_as_file() response."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    text = ''
+    first = True
+    for data in _iter_base64_value(chunks, 'stock'):
+        text += text_decoder.decode(decompressor.decompress(data))
+        if first and text:
+            text = text.lstrip('\ufeff')
+            first = False
+        *lines, text = text.split('\n')
+        for line in lines:
+            yield line + '\n'
+    text += text_decoder.decode(decompressor.flush(), final=True)
+    if text:
+        yield text
+
+
+def _flag(value):
+    return value.lower() in ('x', '1', 'true', 'yes')
@@ -0,0 +1,169 @@
+import base64
+import threading
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from mkmapi.exceptions import ReplayMiss
+from mkmapi.file_storage import atomic_write_json, read_json
+
+
+class Transport:
+    """
+    Sends the signed requests of an ApiRequest.
+    Implementations take the arguments of requests.request() and return a requests.Response.
+    """
+
+    def send(self, method, url, auth=None, params=None, **kwargs):
+        """
+        :param method: Method used for the request
+        :param url: Complete URL of the request
+        :param auth: requests authentication handler, signs the request
+        :param params: Query parameters for the request
+        :param kwargs: Optional additional parameters such as data, stream or timeout
+        :return: Returns the response received from the server
+        """
+        raise NotImplementedError
+
+
+class RequestsTransport(Transport):
+    """
+    Default transport, sends the requests with the requests library.
+    Without a session and `pool_size` every request opens a new connection.
+    """
+
+    def __init__(self, session=None, pool_size: int = None):
+        """
+        :param session: requests.Session used to send the requests, e.g. to share a connection pool (optional)
+        :param pool_size: Creates a session keeping up to this many connections open, use the number of threads
+            sharing the client (ignored if `session` is given)
+        """
+        if session is None and pool_size is not None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+    def send(self, method, url, auth=None, params=None, **kwargs):
+        send = self.session.request if self.session is not None else requests.request
+        return send(method=method, url=url, auth=auth, params=params, **kwargs)
+
+
+class RecordingTransport(Transport):
+    """
+    Sends requests through another transport and records every request and response in memory.
+    The body of streamed responses is downloaded completely to be recorded.
+
+        recorder = RecordingTransport()
+        mkm = Mkm(transport=recorder)
+        mkm.stock_management.get_stock(1)
+        recorder.save('session.json')
+    """
+
+    def __init__(self, transport=None):
+        """
+        :param transport: Transport that sends the requests (default: RequestsTransport())
+        """
+        self.transport = transport if transport is not None else RequestsTransport()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def send(self, method, url, auth=None, params=None, **kwargs):
+        response = self.transport.send(method, url, auth=auth, params=params, **kwargs)
+        record = {
+            'method': method.upper(),
+            'url': _full_url(method, url, params),
+            'body': _text(kwargs.get('data')),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict(response.headers),
+            'encoding': response.encoding,
+            'content': base64.b64encode(response.content).decode('ascii'),
+        }
+        with self._lock:
+            self.records.append(record)
+        return response
+
+    def save(self, path):
+        """
+        Writes the recorded session to a JSON file, see ReplayTransport.load().
+
+        :param path: Path of the file
+        """
+        with self._lock:
+            atomic_write_json(path, self.records)
+
+
+class ReplayTransport(Transport):
+    """
+    Answers requests with recorded responses, without any network access.
+
+    Requests are still prepared and signed like real requests, so replaying a session measures the CPU cost of
+    the client itself (serialization, OAuth signing, response handling). Responses are matched by method, URL
+    with query string and request body. Identical requests get their recorded responses in the recorded order;
+    with `loop` the responses are served again from the start once they are used up.
+    """
+
+    def __init__(self, records, loop: bool = True):
+        """
+        :param records: Recorded requests, see RecordingTransport.records
+        :param loop: Serve the responses of a request again when they are used up (default: True)
+        """
+        self.loop = loop
+        self._recorded = defaultdict(list)
+        for record in records:
+            self._recorded[(record['method'], record['url'], record['body'])].append(record)
+        self._pending = {key: deque(responses) for key, responses in self._recorded.items()}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, loop: bool = True):
+        """
+        :param path: Path of a file written by RecordingTransport.save()
+        :param loop: See __init__()
+        :return: Returns a ReplayTransport
+        """
+        return cls(read_json(path, default=[]), loop=loop)
+
+    def send(self, method, url, auth=None, params=None, **kwargs):
+        prepared = requests.Request(method=method, url=url, params=params, data=kwargs.get('data'), auth=auth)
+        prepared = prepared.prepare()
+        key = (prepared.method, prepared.url, _text(kwargs.get('data')))
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                raise ReplayMiss(prepared.method, prepared.url)
+            if not pending and self.loop:
+                pending.extend(self._recorded[key])
+            if not pending:
+                raise ReplayMiss(prepared.method, prepared.url)
+            record = pending.popleft()
+        return _build_response(record, prepared)
+
+
+def _full_url(method, url, params):
+    return requests.Request(method=method, url=url, params=params).prepare().url
+
+
+def _text(data):
+    if data is None or isinstance(data, str):
+        return data
+    if isinstance(data, bytes):
+        return data.decode('utf-8')
+    return str(data)
+
+
+def _build_response(record, prepared):
+    response = requests.Response()
+    response.status_code = record['status']
+    response.reason = record.get('reason')
+    response.headers = CaseInsensitiveDict(record.get('headers') or {})
+    response.encoding = record.get('encoding')
+    response.url = prepared.url
+    response.request = prepared
+    response._content = base64.b64decode(record['content'])
+    response._content_consumed = True
+    return response
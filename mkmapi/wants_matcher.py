@@ -0,0 +1,181 @@
+import heapq
+from bisect import bisect_left
+from itertools import count
+
+from mkmapi.market_crawler import iterate_product_articles, read_market_snapshot
+from mkmapi.response_parser import CONDITIONS, flatten_article, get_entities, parse_json
+
+_CONDITION_RANKS = {condition: rank for rank, condition in enumerate(CONDITIONS)}
+
+
+class WantsMatcher:
+    """
+    Matches wants list items against market offers (articles).
+
+    Wants are indexed by product or metaproduct, then by language and foil flag. Every bucket holds its
+    wants sorted by minimum condition, so an offer is matched by a few dictionary lookups and a bisect
+    instead of a loop over all wants. Offers can be streamed in from get_articles_for_product() or from a
+    snapshot written by MarketCrawler. For every want the `top` cheapest matching offers are kept.
+    """
+
+    def __init__(self, wants, product_metaproducts=None, top: int = 5):
+        """
+        Initializes the matcher and builds the index.
+
+        :param wants: List of WantsListItem entities, see get_wants_list()
+        :param product_metaproducts: Dictionary mapping product IDs to metaproduct IDs, required to match
+            wants of type metaproduct (optional)
+        :param top: Number of best matches kept per want (default: 5)
+        """
+        self.product_metaproducts = product_metaproducts or {}
+        self.top = top
+        self.wants = {}
+        self._index = {}
+        self._best = {}
+        self._sequence = count()
+        for want in wants:
+            self.add_want(want)
+
+    @classmethod
+    def from_wants_list(cls, response, **kwargs):
+        """
+        Creates a matcher from the response of get_wants_list().
+
+        :param response: Response of get_wants_list()
+        :param kwargs: Additional arguments, see __init__()
+        :return: Returns a WantsMatcher
+        """
+        wants_list = parse_json(response).get('wantslist') or {}
+        return cls(get_entities(wants_list, 'item'), **kwargs)
+
+    @property
+    def product_ids(self):
+        """
+        :return: IDs of all products that can satisfy a want, including the products of wanted metaproducts
+        """
+        product_ids = {key for kind, key in self._index if kind == 'product'}
+        metaproduct_ids = {key for kind, key in self._index if kind == 'metaproduct'}
+        product_ids.update(
+            product_id for product_id, metaproduct_id in self.product_metaproducts.items()
+            if metaproduct_id in metaproduct_ids
+        )
+        return sorted(product_ids)
+
+    def add_want(self, want):
+        """
+        Adds a WantsListItem to the index.
+
+        :param want: WantsListItem entity
+        """
+        want_id = want['idWant']
+        self.wants[want_id] = want
+        self._best[want_id] = []
+
+        kind = 'metaproduct' if want.get('type') == 'metaproduct' else 'product'
+        id_key = 'idMetaproduct' if kind == 'metaproduct' else 'idProduct'
+        key = (kind, want[id_key] if id_key in want else want[kind][id_key])
+        languages = want.get('idLanguage') or [None]
+        if not isinstance(languages, (list, tuple)):
+            languages = [languages]
+        rank = _CONDITION_RANKS.get(want.get('minCondition'), len(CONDITIONS) - 1)
+
+        buckets = self._index.setdefault(key, {})
+        for language in languages:
+            ranks, bucket_wants = buckets.setdefault((language, want.get('isFoil')), ([], []))
+            position = bisect_left(ranks, rank)
+            ranks.insert(position, rank)
+            bucket_wants.insert(position, want)
+
+    def match(self, article):
+        """
+        Returns the wants an article satisfies.
+
+        :param article: Article entity (as returned by the API or flattened)
+        :return: Returns a list of WantsListItem entities
+        """
+        article = flatten_article(article)
+        product_id = article['idProduct']
+        keys = [('product', product_id)]
+        if product_id in self.product_metaproducts:
+            keys.append(('metaproduct', self.product_metaproducts[product_id]))
+
+        rank = _CONDITION_RANKS.get(article.get('condition'), 0)
+        languages = {article.get('idLanguage'), None}
+        matches = []
+        for key in keys:
+            buckets = self._index.get(key)
+            if buckets is None:
+                continue
+            for language in languages:
+                for foil in (bool(article.get('isFoil')), None):
+                    bucket = buckets.get((language, foil))
+                    if bucket is None:
+                        continue
+                    ranks, bucket_wants = bucket
+                    # Wants accept the offer if their minimum condition is the same or worse
+                    for want in bucket_wants[bisect_left(ranks, rank):]:
+                        if _accepts(want, article):
+                            matches.append(want)
+        return matches
+
+    def feed(self, articles):
+        """
+        Streams offers through the index and keeps the best matches for every want.
+
+        :param articles: Iterable of Article entities (as returned by the API or flattened)
+        :return: Returns the number of matches found
+        """
+        found = 0
+        for article in articles:
+            article = flatten_article(article)
+            for want in self.match(article):
+                found += 1
+                best = self._best[want['idWant']]
+                entry = (-article['price'], next(self._sequence), article)
+                if len(best) < self.top:
+                    heapq.heappush(best, entry)
+                elif entry[0] > best[0][0]:
+                    heapq.heapreplace(best, entry)
+        return found
+
+    def feed_market(self, marketplace_info, product_ids=None, **filters):
+        """
+        Fetches the offers of all wanted products with get_articles_for_product() and feeds them.
+
+        :param marketplace_info: MarketplaceInfo instance used for the requests
+        :param product_ids: Products to fetch (default: product_ids)
+        :param filters: Filter parameters passed to get_articles_for_product()
+        :return: Returns the number of matches found
+        """
+        product_ids = self.product_ids if product_ids is None else product_ids
+        return sum(
+            self.feed(iterate_product_articles(marketplace_info, product_id, **filters))
+            for product_id in product_ids
+        )
+
+    def feed_snapshot(self, path):
+        """
+        Feeds all offers of a snapshot written by MarketCrawler.
+
+        :param path: Path of the snapshot file
+        :return: Returns the number of matches found
+        """
+        return sum(self.feed(record['article']) for record in read_market_snapshot(path))
+
+    def results(self):
+        """
+        :return: Dictionary mapping every idWant to its best matching offers, cheapest first
+        """
+        return {
+            want_id: [article for _, _, article in sorted(best, reverse=True)]
+            for want_id, best in self._best.items()
+        }
+
+
+def _accepts(want, article):
+    """Checks the conditions of a want that are not part of the index."""
+    for flag in ('isSigned', 'isAltered', 'isPlayset'):
+        if want.get(flag) is not None and bool(want[flag]) != bool(article.get(flag)):
+            return False
+    wish_price = want.get('wishPrice')
+    return not wish_price or article['price'] <= wish_price
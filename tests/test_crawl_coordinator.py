@@ -0,0 +1,67 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from mkmapi.crawl_coordinator import CrawlQueue, CrawlWorker
+from mkmapi.exceptions import ShardStalled
+from mkmapi.market_crawler import PAGE_SIZE
+
+
+class _Market:
+    """
+    Answers get_articles_for_product(). Product 1 fails, product 2 has endless pages that take `page_seconds`
+    each and product 3 hangs for `hang_seconds` (like a request running into its timeout).
+    """
+
+    def __init__(self, page_seconds=0.05, hang_seconds=0.0):
+        self.page_seconds = page_seconds
+        self.hang_seconds = hang_seconds
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def resolve(self, request_method, resource_url, params=None, data=None, **kwargs):
+        product_id = int(resource_url.split('/')[2])
+        with self._lock:
+            self.requests.append((time.monotonic(), product_id))
+        if product_id == 1:
+            time.sleep(0.1)
+            raise ValueError('product 1 failed')
+        if product_id == 2:
+            time.sleep(self.page_seconds)
+            return {'article': [{'idArticle': position, 'price': 1.0} for position in range(PAGE_SIZE)]}
+        time.sleep(self.hang_seconds)
+        return {'article': []}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = CrawlQueue(str(tmp_path / 'crawl.db'), lease_seconds=0.6)
+    yield queue
+    queue.close()
+
+
+def test_failed_item_stops_running_items_before_the_shard_is_failed(queue, tmp_path):
+    market = _Market()
+    queue.add('product', [1, 2])
+    worker = CrawlWorker(queue, SimpleNamespace(resolve=market.resolve), str(tmp_path / 'out'), max_workers=2)
+
+    result = worker.run(max_shards=1)
+    returned = time.monotonic()
+    time.sleep(0.2)
+
+    assert result['failed'] == 1
+    assert all(sent < returned for sent, _ in market.requests)
+    assert queue.stats()['pending'] == 1
+
+
+def test_stalled_shard_is_not_renewed_and_fails(queue, tmp_path):
+    market = _Market(hang_seconds=2.0)
+    queue.add('product', [3])
+    worker = CrawlWorker(queue, SimpleNamespace(resolve=market.resolve), str(tmp_path / 'out'))
+
+    with pytest.raises(ShardStalled):
+        worker.crawl_shard(queue.lease(worker.worker))
+    # The lease was not renewed while the request hung, another worker takes the shard over
+    assert queue.lease('b') is not None
@@ -0,0 +1,103 @@
+import csv
+from types import SimpleNamespace
+
+import pytest
+
+from mkmapi.cli import build_parser
+from mkmapi.exceptions import MKMConnectionError
+from mkmapi.stock_journal import StockJournal
+from mkmapi.stock_snapshot import StockArticle
+
+ARTICLES = [StockArticle(article_id, 1000 + article_id, 1, 'NM', 1.5, 2) for article_id in range(1, 6)]
+
+
+class _StockManagement:
+    """Stock of ARTICLES that applies changes, the requests of `lose_answers` reach the server but fail with 503."""
+
+    def __init__(self, lose_answers=()):
+        self.stock = {article.id_article: article.to_api() for article in ARTICLES}
+        self.lose_answers = set(lose_answers)
+        self.requests = []
+
+    def bulk_modify_stock(self, action, articles):
+        self.requests.append([article['idArticle'] for article in articles])
+        for article in articles:
+            self.stock[article['idArticle']] = dict(article)
+        if len(self.requests) in self.lose_answers:
+            raise MKMConnectionError(SimpleNamespace(status_code=503, reason='Service Unavailable'))
+        return {'updatedArticles': articles, 'notUpdatedArticles': []}
+
+    def get_stock_article(self, article_id):
+        article = {
+            name: value == 'true' if value in ('true', 'false') else value
+            for name, value in self.stock[article_id].items()
+        }
+        return {'article': dict(article, idProduct=1000 + article_id)}
+
+
+@pytest.fixture
+def stock_file(tmp_path):
+    path = tmp_path / 'stock.csv'
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(StockArticle._fields)
+        writer.writerows(article._replace(price=2.0) for article in ARTICLES)
+    return path
+
+
+def _import(stock_management, stock_file, journal, *options):
+    args = build_parser().parse_args([
+        'import-stock', str(stock_file), '--action', 'change', '--chunk-size', '2', '--workers', '1',
+        '--journal', str(journal), *options,
+    ])
+    return args.command(SimpleNamespace(stock_management=stock_management), args)
+
+
+def _interrupted_import(stock_file, journal):
+    stock_management = _StockManagement(lose_answers={1})
+    assert _import(stock_management, stock_file, journal) == 1
+    pending = StockJournal(journal).pending()
+    assert [chunk['status'] for chunk in pending] == ['unconfirmed', 'unsent', 'unsent']
+    return stock_management
+
+
+def test_rerun_sends_unsent_requests_and_keeps_unconfirmed_pending(stock_file, tmp_path, capsys):
+    journal = tmp_path / 'import.journal'
+    stock_management = _interrupted_import(stock_file, journal)
+
+    assert _import(stock_management, stock_file, journal) == 1
+    assert stock_management.requests[1:] == [[3, 4], [5]]
+    assert [chunk['status'] for chunk in StockJournal(journal).pending()] == ['unconfirmed']
+    assert '--confirm' in capsys.readouterr().err
+
+
+def test_confirm_settles_applied_changes(stock_file, tmp_path):
+    journal = tmp_path / 'import.journal'
+    stock_management = _interrupted_import(stock_file, journal)
+
+    assert _import(stock_management, stock_file, journal, '--confirm') == 0
+    assert stock_management.requests == [[1, 2], [3, 4], [5]]
+    assert StockJournal(journal).pending() == []
+
+
+def test_confirm_resends_changes_that_were_not_applied(stock_file, tmp_path):
+    journal = tmp_path / 'import.journal'
+    stock_management = _interrupted_import(stock_file, journal)
+    stock_management.stock[2]['price'] = 1.5
+
+    assert _import(stock_management, stock_file, journal, '--confirm') == 0
+    assert stock_management.requests == [[1, 2], [1, 2], [3, 4], [5]]
+    assert all(article['price'] == 2.0 for article in stock_management.stock.values())
+
+
+def test_resend_unconfirmed_and_discard_pending(stock_file, tmp_path):
+    journal = tmp_path / 'import.journal'
+    stock_management = _interrupted_import(stock_file, journal)
+    assert _import(stock_management, stock_file, journal, '--resend-unconfirmed') == 0
+    assert stock_management.requests == [[1, 2], [1, 2], [3, 4], [5]]
+
+    other_journal = tmp_path / 'other.journal'
+    stock_management = _interrupted_import(stock_file, other_journal)
+    assert _import(stock_management, stock_file, other_journal, '--discard-pending') == 0
+    assert stock_management.requests == [[1, 2], [1, 2], [3, 4], [5]]
+    assert StockJournal(other_journal).pending() == []
@@ -0,0 +1,80 @@
+import json
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mkmapi.mkm import Mkm
+
+THREADS = 16
+REQUESTS_PER_THREAD = 25
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    """Answers every request with its path, body and Authorization header as JSON."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _echo(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.dumps({
+            'path': self.path,
+            'body': self.rfile.read(length).decode('utf-8'),
+            'authorization': self.headers.get('Authorization'),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = _echo
+
+    def log_message(self, *args):
+        pass
+
+
+class _EchoServer(ThreadingHTTPServer):
+    # All threads connect at once, the default backlog of 5 would reset some of the connections
+    request_queue_size = THREADS * 2
+
+
+@pytest.fixture
+def server():
+    server = _EchoServer(('127.0.0.1', 0), _EchoHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_mkm_keeps_concurrent_requests_apart(server):
+    mkm = Mkm('app_token', 'app_secret', 'access_token', 'access_token_secret', pool_size=THREADS)
+    mkm.api_request.base_endpoint = server
+    barrier = threading.Barrier(THREADS)
+
+    def worker(thread_id):
+        barrier.wait()
+        results = []
+        for number in range(REQUESTS_PER_THREAD):
+            article_ids = [thread_id * 100000 + number * 10 + position for position in range(1 + number % 3)]
+            data = {'article': [{'idArticle': article_id, 'count': thread_id} for article_id in article_ids]}
+            response = mkm.resolve('PUT', f'/stock/{thread_id}/{number}', data=data)
+            results.append((thread_id, number, article_ids, response.json()))
+        return results
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = [result for results in executor.map(worker, range(THREADS)) for result in results]
+
+    assert len(results) == THREADS * REQUESTS_PER_THREAD
+    for thread_id, number, article_ids, echo in results:
+        assert echo['path'] == f'/stock/{thread_id}/{number}'
+        assert f'realm="{server}/stock/{thread_id}/{number}"' in echo['authorization']
+        root = ElementTree.fromstring(echo['body'])
+        articles = root.findall('article')
+        assert [int(article.findtext('idArticle')) for article in articles] == article_ids
+        assert {article.findtext('count') for article in articles} == {str(thread_id)}